@@ -0,0 +1,216 @@
+"""
+API served from the allocation journal
+
+With storage_engine set to "journal", api_server starts this app instead of
+api.main: pools, allocations and leases live in a JournalAllocator and no
+database is opened. Only the pool and allocation routes are offered;
+history, import, export, forecasts and network binding need the database.
+
+Handlers are plain functions, run in the threadpool, so concurrent requests
+wait for their journal sync side by side and share it.
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Response, status
+
+from core.journal import close_journal_allocator, get_journal_allocator
+from core.metrics import REGISTRY
+from .middleware import RequestMetricsMiddleware
+from .schemas import (
+    IPPoolCreate, IPPoolResponse, IPPoolUtilization,
+    IPAllocationCreate, IPReservationCreate, IPAllocationResponse, IPAllocationResult,
+    LeaseRenewalRequest, OperationResult
+)
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(
+    title="BlackzAllocator Edge API",
+    description="IP allocation from an event journal, without a database",
+    version="1.0.0",
+    docs_url="/docs",
+    redoc_url="/redoc"
+)
+app.add_middleware(RequestMetricsMiddleware)
+
+@app.on_event("startup")
+def open_journal():
+    """Open the journal, replaying it into memory"""
+    get_journal_allocator()
+
+@app.on_event("shutdown")
+def close_journal():
+    close_journal_allocator()
+
+def _pool_response(pool: Dict[str, object]) -> IPPoolResponse:
+    return IPPoolResponse(
+        id=pool["id"],
+        name=pool["name"],
+        cidr=pool["cidr"],
+        description=None,
+        gateway=None,
+        dns_servers=json.dumps([]),
+        reserved_ranges=json.dumps(pool["reserved_ranges"]),
+        quarantine_seconds=pool["quarantine_seconds"],
+        created_at=pool["created_at"],
+        updated_at=pool["created_at"],
+        is_active=True
+    )
+
+def _allocation_response(allocation: Dict[str, object]) -> IPAllocationResponse:
+    return IPAllocationResponse(
+        id=allocation["id"],
+        pool_id=allocation["pool_id"],
+        ip_address=allocation["ip_address"],
+        client_id=allocation["client_id"],
+        client_name=allocation["client_name"],
+        allocation_type=allocation["allocation_type"],
+        allocation_strategy=allocation["allocation_strategy"],
+        assigned_at=allocation["assigned_at"],
+        last_seen=allocation["last_seen"],
+        is_active=True,
+        network_interface=None,
+        binding_status="unbound"
+    )
+
+# IP Pool Endpoints
+@app.post("/pools/", response_model=IPPoolResponse, status_code=status.HTTP_201_CREATED)
+def create_ip_pool(pool_data: IPPoolCreate):
+    """Create a new IP pool"""
+    allocator = get_journal_allocator()
+    success, message, pool_id = allocator.create_pool(
+        pool_data.name,
+        pool_data.cidr,
+        reserved_ranges=pool_data.reserved_ranges,
+        quarantine_seconds=pool_data.quarantine_seconds
+    )
+    if not success:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message)
+    logger.info(f"Created IP pool: {pool_data.name} ({pool_data.cidr})")
+    return _pool_response(allocator.get_pool(pool_id))
+
+@app.get("/pools/", response_model=List[IPPoolResponse])
+def list_ip_pools(skip: int = 0, limit: int = 100):
+    """List all IP pools"""
+    pools = get_journal_allocator().list_pools()
+    return [_pool_response(pool) for pool in pools[skip:skip + limit]]
+
+@app.get("/pools/{pool_id}", response_model=IPPoolResponse)
+def get_ip_pool(pool_id: int):
+    """Get a specific IP pool"""
+    pool = get_journal_allocator().get_pool(pool_id)
+    if pool is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Pool {pool_id} not found")
+    return _pool_response(pool)
+
+@app.delete("/pools/{pool_id}", response_model=OperationResult)
+def delete_ip_pool(pool_id: int):
+    """Delete an IP pool"""
+    success, message = get_journal_allocator().delete_pool(pool_id)
+    if not success:
+        code = status.HTTP_404_NOT_FOUND if message.endswith("not found") else status.HTTP_400_BAD_REQUEST
+        raise HTTPException(status_code=code, detail=message)
+    return OperationResult(success=True, message=message)
+
+@app.get("/pools/{pool_id}/utilization", response_model=IPPoolUtilization)
+def get_pool_utilization(pool_id: int):
+    """Get IP pool utilization statistics"""
+    try:
+        return IPPoolUtilization(**get_journal_allocator().get_pool_utilization(pool_id))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+# IP Allocation Endpoints
+@app.post("/allocations/", response_model=IPAllocationResult, status_code=status.HTTP_201_CREATED)
+def allocate_ip(allocation_data: IPAllocationCreate):
+    """Allocate the next available IP address"""
+    allocator = get_journal_allocator()
+    success, message, ip_address = allocator.allocate_next_ip(
+        allocation_data.pool_id,
+        client_id=allocation_data.client_id,
+        client_name=allocation_data.client_name,
+        strategy=allocation_data.allocation_strategy,
+        lease_duration=allocation_data.lease_duration
+    )
+    allocation_id = None
+    if success:
+        allocation = allocator.find_allocation(allocation_data.pool_id, ip_address)
+        allocation_id = allocation["id"] if allocation else None
+    return IPAllocationResult(
+        success=success,
+        message=message,
+        ip_address=ip_address,
+        allocation_id=allocation_id,
+        lease_id=allocation_id
+    )
+
+@app.post("/reservations/", response_model=OperationResult, status_code=status.HTTP_201_CREATED)
+def reserve_specific_ip(reservation_data: IPReservationCreate):
+    """Reserve a specific IP address"""
+    success, message = get_journal_allocator().reserve_specific_ip(
+        reservation_data.pool_id,
+        reservation_data.ip_address,
+        client_id=reservation_data.client_id,
+        client_name=reservation_data.client_name,
+        lease_duration=reservation_data.lease_duration
+    )
+    return OperationResult(success=success, message=message)
+
+@app.get("/allocations/", response_model=List[IPAllocationResponse])
+def list_allocations(pool_id: Optional[int] = None, skip: int = 0, limit: int = 100):
+    """List active IP allocations"""
+    allocations = get_journal_allocator().list_allocations(pool_id)
+    return [_allocation_response(allocation) for allocation in allocations[skip:skip + limit]]
+
+@app.delete("/allocations/{allocation_id}", response_model=OperationResult)
+def deallocate_ip(allocation_id: int):
+    """Deallocate an IP address"""
+    success, message = get_journal_allocator().deallocate_ip(allocation_id)
+    return OperationResult(success=success, message=message)
+
+# Lease Management Endpoints
+@app.post("/leases/renew", response_model=OperationResult)
+def renew_lease(renewal_data: LeaseRenewalRequest):
+    """Renew an IP lease; leases share their allocation's ID"""
+    success, message = get_journal_allocator().renew_lease(
+        renewal_data.lease_id,
+        renewal_data.extension_seconds
+    )
+    return OperationResult(success=success, message=message)
+
+@app.post("/leases/cleanup", response_model=OperationResult)
+def cleanup_expired_leases():
+    """Release the allocations whose leases have ended"""
+    cleaned_count = get_journal_allocator().cleanup_expired_leases()
+    return OperationResult(success=True, message=f"Cleaned up {cleaned_count} expired leases")
+
+# Journal Endpoints
+@app.post("/journal/compact", response_model=OperationResult)
+def compact_journal():
+    """Write the current state to the journal snapshot and start a new journal"""
+    result = get_journal_allocator().compact()
+    return OperationResult(
+        success=True,
+        message=f"Compacted {result['records']} records into generation {result['generation']}",
+        data=result
+    )
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics from in-memory registries"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health")
+def health_check():
+    """Health check endpoint"""
+    allocator = get_journal_allocator()
+    return {
+        "status": "healthy" if allocator.failed is None else "read-only",
+        "timestamp": datetime.utcnow().isoformat(),
+        "service": "BlackzAllocator Edge API",
+        "journal": {"path": allocator.path, "generation": allocator.generation, "records": allocator.records}
+    }
@@ -1,18 +1,42 @@
-from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, joinedload, selectinload
+from typing import List, Optional, Tuple
+import asyncio
+import base64
+import binascii
 import json
+import os
 from datetime import datetime, timedelta
 import logging
 
-from database import get_db, IPPool, IPAllocation, IPLease, AllocationLog
+from database import (
+    get_db, get_read_db, get_settings, IPPool, IPAllocation, IPLease, IPAllocationHistory, IPLeaseHistory, AllocationLog
+)
+from database.models import address_to_int, network_bounds
+from database.queries import ACTIVE_ALLOCATION_BY_ADDRESS, ACTIVE_ALLOCATION_IDS_BY_ADDRESS, POOL_BY_ID
+from database.sharding import count_rows, page, seek
+from core.archive import DEFAULT_CHUNK_SIZE as ARCHIVE_CHUNK_SIZE, archive_released
 from core.ip_allocator import IPAllocator
+from core.bulk_import import (
+    BulkImporter, BulkImportError, LineSplitter, RecordParser, DEFAULT_CHUNK_SIZE, IMPORT_KINDS, feed_line
+)
+from core.export import EXPORT_TABLES, buffered, export_lines, gzipped
+from core.forecast import forecaster
+from core.group_commit import GroupCommitter
+from core.instrumentation import instrumentation
+from core.metrics import REGISTRY
+from core.pool_index import invalidate_pool_index
+from core.snapshot import SnapshotError, create_snapshot, load_snapshot
 from network.interface_manager import NetworkInterfaceManager
+from .middleware import RequestMetricsMiddleware
 from .schemas import (
-    IPPoolCreate, IPPoolUpdate, IPPoolResponse, IPPoolUtilization,
+    IPPoolCreate, IPPoolUpdate, IPPoolResponse, IPPoolUtilization, IPPoolFragmentation, IPPoolGap, IPPoolForecast,
+    ReservedRangeResponse,
     IPAllocationCreate, IPReservationCreate, IPAllocationResponse, IPAllocationResult,
-    IPLeaseResponse, LeaseRenewalRequest,
+    IPLeaseResponse, LeaseRenewalRequest, IPAllocationHistoryResponse, IPLeaseHistoryResponse,
     NetworkInterfaceResponse, IPBindingRequest, IPBindingResult,
     ConnectivityTestRequest, ConnectivityTestResult,
     OperationResult, SystemStats, ErrorResponse
@@ -31,6 +55,9 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Cursor of the next page of a list route
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -38,24 +65,91 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
 # Global network interface manager
 network_manager = NetworkInterfaceManager()
 
 # Background task for lease cleanup
 def cleanup_expired_leases_task():
-    """Background task to clean up expired leases"""
+    """Background task to clean up expired leases and archive long-released allocations"""
     try:
         from database import get_db_session
         db = get_db_session()
         allocator = IPAllocator(db)
         cleaned_count = allocator.cleanup_expired_leases()
         logger.info(f"Cleaned up {cleaned_count} expired leases")
+        # Keep the live tables down to what is in use
+        archive_released(db, get_settings().archive_after_seconds)
         db.close()
     except Exception as e:
         logger.error(f"Error cleaning up expired leases: {e}")
 
+# Pool index snapshot, loaded at startup and rewritten at shutdown when configured
+SNAPSHOT_PATH = get_settings().snapshot_path
+
+@app.on_event("startup")
+async def load_index_snapshot():
+    """Warm the pool indexes from the snapshot file"""
+    if not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        return
+    from database import get_db_session
+    db = get_db_session()
+    try:
+        load_snapshot(db, SNAPSHOT_PATH)
+    except SnapshotError as e:
+        # Indexes are rebuilt from the database on first use instead
+        logger.warning(f"Ignoring snapshot {SNAPSHOT_PATH}: {e}")
+    finally:
+        db.close()
+
+def save_index_snapshot():
+    """Write the pool indexes to the snapshot file"""
+    if not SNAPSHOT_PATH:
+        return
+    from database import get_db_session
+    db = get_db_session()
+    try:
+        # Rebuilt from the database: cached indexes miss what the CLI and
+        # other processes wrote, and those log entries are before the LSN
+        result = create_snapshot(db, SNAPSHOT_PATH)
+        logger.info(f"Wrote snapshot {SNAPSHOT_PATH}: {result}")
+    except Exception as e:
+        logger.error(f"Error writing snapshot: {e}")
+    finally:
+        db.close()
+
+# Shared-transaction allocation, started at startup when enabled
+group_committer: Optional[GroupCommitter] = None
+
+@app.on_event("startup")
+async def start_group_committer():
+    global group_committer
+    settings = get_settings()
+    if not settings.group_commit:
+        return
+    group_committer = GroupCommitter(
+        max_batch=settings.group_commit_max_batch,
+        max_wait=settings.group_commit_window_ms / 1000
+    )
+    group_committer.start()
+
+def stop_group_committer():
+    global group_committer
+    if group_committer is not None:
+        group_committer.stop()
+        group_committer = None
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the group committer, then write the snapshot"""
+    # Handlers run in registration order; the committer's last batch has to
+    # be committed or released before the snapshot reads the pools
+    stop_group_committer()
+    save_index_snapshot()
+
 # IP Pool Management Endpoints
 @app.post("/pools/", response_model=IPPoolResponse, status_code=status.HTTP_201_CREATED)
 async def create_ip_pool(pool_data: IPPoolCreate, db: Session = Depends(get_db)):
@@ -76,12 +170,16 @@ async def create_ip_pool(pool_data: IPPoolCreate, db: Session = Depends(get_db))
             description=pool_data.description,
             gateway=pool_data.gateway,
             dns_servers=json.dumps(pool_data.dns_servers) if pool_data.dns_servers else None,
-            reserved_ranges=json.dumps(pool_data.reserved_ranges) if pool_data.reserved_ranges else None
+            reserved_ranges=json.dumps(pool_data.reserved_ranges) if pool_data.reserved_ranges else None,
+            quarantine_seconds=pool_data.quarantine_seconds
         )
         
         db.add(pool)
         db.commit()
         db.refresh(pool)
+        # SQLite may reuse the ID of a deleted pool
+        invalidate_pool_index(pool.id)
+        forecaster.forget(pool.id)
         
         logger.info(f"Created IP pool: {pool.name} ({pool.cidr})")
         return pool
@@ -94,25 +192,84 @@ async def create_ip_pool(pool_data: IPPoolCreate, db: Session = Depends(get_db))
             detail=str(e)
         )
 
+def _cidr_bounds(cidr: str) -> Tuple[int, int]:
+    """Parse a CIDR query parameter into integer bounds"""
+    try:
+        return network_bounds(cidr)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid CIDR: {e}"
+        )
+
+def _encode_cursor(row, keys: List) -> str:
+    """Get the opaque cursor of the rows following a row"""
+    position = json.dumps({key.key: getattr(row, key.key) for key in keys}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, keys: List) -> List[int]:
+    """Parse a cursor query parameter into the key values to continue after"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = [position[key.key] for key in keys]
+        if len(position) == len(keys) and all(type(value) is int for value in values):
+            return values
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        pass
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid cursor, or one from a list in another order"
+    )
+
+def _list_page(query, keys: List, skip: int, limit: int, cursor: Optional[str], response: Response) -> List:
+    """
+    Get one page of a list route, by cursor or by offset
+
+    Without skip, pages are cut by key from an index (see seek()), and a full
+    page sets X-Next-Cursor to the cursor of the next one. skip keeps paging
+    by offset for older clients, in the same order.
+    """
+    if cursor and skip:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either skip or cursor"
+        )
+    if skip:
+        return page(query.order_by(*keys), skip, limit, keys[0])
+    rows = seek(query, keys, _decode_cursor(cursor, keys) if cursor else None, limit)
+    if rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = _encode_cursor(rows[-1], keys)
+    return rows
+
 @app.get("/pools/", response_model=List[IPPoolResponse])
 async def list_ip_pools(
+    response: Response,
     active_only: bool = False,
+    cidr: Optional[str] = Query(None, description="Only pools overlapping this range"),
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    db: Session = Depends(get_read_db)
 ):
     """List all IP pools"""
-    query = db.query(IPPool)
+    # Reserved ranges and DNS servers of the listed pools in one SELECT each per 500 pools
+    query = db.query(IPPool).options(
+        selectinload(IPPool.reserved_range_rows),
+        selectinload(IPPool.dns_server_rows)
+    )
     if active_only:
         query = query.filter(IPPool.is_active == True)
+    if cidr:
+        start_int, end_int = _cidr_bounds(cidr)
+        query = query.filter(IPPool.start_int <= end_int, IPPool.end_int >= start_int)
     
-    pools = query.offset(skip).limit(limit).all()
+    pools = _list_page(query, [IPPool.id], skip, limit, cursor, response)
     return pools
 
 @app.get("/pools/{pool_id}", response_model=IPPoolResponse)
-async def get_ip_pool(pool_id: int, db: Session = Depends(get_db)):
+async def get_ip_pool(pool_id: int, db: Session = Depends(get_read_db)):
     """Get a specific IP pool"""
-    pool = db.query(IPPool).filter(IPPool.id == pool_id).first()
+    pool = db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
     if not pool:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -127,7 +284,7 @@ async def update_ip_pool(
     db: Session = Depends(get_db)
 ):
     """Update an IP pool"""
-    pool = db.query(IPPool).filter(IPPool.id == pool_id).first()
+    pool = db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
     if not pool:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -164,7 +321,13 @@ async def update_ip_pool(
 @app.delete("/pools/{pool_id}", response_model=OperationResult)
 async def delete_ip_pool(pool_id: int, db: Session = Depends(get_db)):
     """Delete an IP pool"""
-    pool = db.query(IPPool).filter(IPPool.id == pool_id).first()
+    # Everything the delete cascades to, loaded up front instead of row by row
+    pool = db.query(IPPool).options(
+        selectinload(IPPool.allocations).joinedload(IPAllocation.lease),
+        selectinload(IPPool.leases),
+        selectinload(IPPool.reserved_range_rows),
+        selectinload(IPPool.dns_server_rows)
+    ).filter(IPPool.id == pool_id).first()
     if not pool:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -186,6 +349,8 @@ async def delete_ip_pool(pool_id: int, db: Session = Depends(get_db)):
         
         db.delete(pool)
         db.commit()
+        invalidate_pool_index(pool_id)
+        forecaster.forget(pool_id)
         
         logger.info(f"Deleted IP pool: {pool.name}")
         return OperationResult(success=True, message=f"Pool '{pool.name}' deleted successfully")
@@ -203,6 +368,7 @@ async def delete_ip_pool(pool_id: int, db: Session = Depends(get_db)):
 @app.get("/pools/{pool_id}/utilization", response_model=IPPoolUtilization)
 async def get_pool_utilization(pool_id: int, db: Session = Depends(get_db)):
     """Get IP pool utilization statistics"""
+    # Reads the primary: a pool index built here is shared with the writers
     try:
         allocator = IPAllocator(db)
         utilization = allocator.get_pool_utilization(pool_id)
@@ -219,33 +385,114 @@ async def get_pool_utilization(pool_id: int, db: Session = Depends(get_db)):
             detail=str(e)
         )
 
+@app.get("/pools/{pool_id}/fragmentation", response_model=IPPoolFragmentation)
+async def get_pool_fragmentation(pool_id: int, db: Session = Depends(get_db)):
+    """Get free-run and fragmentation statistics for an IP pool"""
+    try:
+        allocator = IPAllocator(db)
+        fragmentation = allocator.get_pool_fragmentation(pool_id)
+        return IPPoolFragmentation(**fragmentation)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error getting pool fragmentation: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/pools/{pool_id}/gaps", response_model=List[IPPoolGap])
+async def get_pool_gaps(
+    pool_id: int,
+    min_size: int = Query(1, ge=1, description="Smallest gap to report"),
+    limit: int = Query(100, ge=1, le=10000),
+    db: Session = Depends(get_read_db)
+):
+    """Get the runs of addresses between active allocations and reserved ranges"""
+    try:
+        allocator = IPAllocator(db)
+        return [IPPoolGap(**gap) for gap in allocator.find_free_gaps(pool_id, min_size, limit)]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error finding pool gaps: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/pools/{pool_id}/forecast", response_model=IPPoolForecast)
+async def get_pool_forecast(pool_id: int, db: Session = Depends(get_db)):
+    """Get the allocation rate and projected exhaustion time of an IP pool"""
+    pool = db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
+    if not pool:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Pool {pool_id} not found"
+        )
+    
+    try:
+        return IPPoolForecast(**forecaster.forecast(db, pool))
+    except Exception as e:
+        logger.error(f"Error forecasting pool: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/reserved-ranges/", response_model=List[ReservedRangeResponse])
+async def find_reserved_ranges(
+    ip_address: str = Query(..., description="Address to look up"),
+    pool_id: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Get the reserved ranges containing an address, across all pools unless one is given"""
+    try:
+        allocator = IPAllocator(db)
+        return [ReservedRangeResponse(**row) for row in allocator.find_reserved_ranges(ip_address, pool_id)]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
 # IP Allocation Endpoints
 @app.post("/allocations/", response_model=IPAllocationResult, status_code=status.HTTP_201_CREATED)
 async def allocate_ip(allocation_data: IPAllocationCreate, db: Session = Depends(get_db)):
     """Allocate the next available IP address"""
     try:
-        allocator = IPAllocator(db)
-        success, message, ip_address = allocator.allocate_next_ip(
+        request = dict(
             pool_id=allocation_data.pool_id,
             client_id=allocation_data.client_id,
             client_name=allocation_data.client_name,
             strategy=allocation_data.allocation_strategy,
             lease_duration=allocation_data.lease_duration
         )
+        if group_committer is not None:
+            success, message, ip_address = await asyncio.wrap_future(group_committer.submit(**request))
+        else:
+            success, message, ip_address = IPAllocator(db).allocate_next_ip(**request)
         
         allocation_id = None
+        lease_id = None
         if success and ip_address:
-            # Get the allocation ID
-            allocation = db.query(IPAllocation).filter(
-                IPAllocation.ip_address == ip_address,
-                IPAllocation.pool_id == allocation_data.pool_id,
-                IPAllocation.is_active == True
+            # Get the allocation and lease IDs, as plain columns
+            ids = db.execute(
+                ACTIVE_ALLOCATION_IDS_BY_ADDRESS,
+                {"pool_id": allocation_data.pool_id, "ip_address": ip_address}
             ).first()
-            if allocation:
-                allocation_id = allocation.id
+            if ids:
+                allocation_id, lease_id = ids.allocation_id, ids.lease_id
                 
                 # Bind to network interface if specified
                 if allocation_data.network_interface:
+                    allocation = db.get(IPAllocation, allocation_id)
                     bind_success, bind_message = network_manager.bind_ip_to_interface(
                         allocation_data.network_interface,
                         ip_address
@@ -264,7 +511,8 @@ async def allocate_ip(allocation_data: IPAllocationCreate, db: Session = Depends
             success=success,
             message=message,
             ip_address=ip_address,
-            allocation_id=allocation_id
+            allocation_id=allocation_id,
+            lease_id=lease_id
         )
         
     except Exception as e:
@@ -295,11 +543,10 @@ async def reserve_specific_ip(reservation_data: IPReservationCreate, db: Session
             )
             if bind_success:
                 # Update allocation record
-                allocation = db.query(IPAllocation).filter(
-                    IPAllocation.ip_address == reservation_data.ip_address,
-                    IPAllocation.pool_id == reservation_data.pool_id,
-                    IPAllocation.is_active == True
-                ).first()
+                allocation = db.execute(
+                    ACTIVE_ALLOCATION_BY_ADDRESS,
+                    {"pool_id": reservation_data.pool_id, "ip_address": reservation_data.ip_address}
+                ).scalar()
                 if allocation:
                     allocation.network_interface = reservation_data.network_interface
                     allocation.binding_status = "bound"
@@ -319,11 +566,14 @@ async def reserve_specific_ip(reservation_data: IPReservationCreate, db: Session
 
 @app.get("/allocations/", response_model=List[IPAllocationResponse])
 async def list_allocations(
+    response: Response,
     pool_id: Optional[int] = None,
     active_only: bool = True,
+    cidr: Optional[str] = Query(None, description="Only addresses in this range, in address order"),
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    db: Session = Depends(get_read_db)
 ):
     """List IP allocations"""
     query = db.query(IPAllocation)
@@ -332,8 +582,16 @@ async def list_allocations(
         query = query.filter(IPAllocation.pool_id == pool_id)
     if active_only:
         query = query.filter(IPAllocation.is_active == True)
+    if cidr:
+        start_int, end_int = _cidr_bounds(cidr)
+        query = query.filter(IPAllocation.ip_int.between(start_int, end_int))
     
-    allocations = query.offset(skip).limit(limit).all()
+    # Address order where an index has it: in a range, or among a pool's active allocations
+    if cidr or (pool_id and active_only):
+        keys = [IPAllocation.ip_int, IPAllocation.id]
+    else:
+        keys = [IPAllocation.id]
+    allocations = _list_page(query, keys, skip, limit, cursor, response)
     return allocations
 
 @app.delete("/allocations/{allocation_id}", response_model=OperationResult)
@@ -343,7 +601,7 @@ async def deallocate_ip(allocation_id: int, db: Session = Depends(get_db)):
         allocator = IPAllocator(db)
         
         # Get allocation details for network unbinding
-        allocation = db.query(IPAllocation).filter(IPAllocation.id == allocation_id).first()
+        allocation = db.get(IPAllocation, allocation_id)
         if allocation and allocation.network_interface and allocation.binding_status == "bound":
             # Unbind from network interface
             unbind_success, unbind_message = network_manager.unbind_ip_from_interface(
@@ -367,11 +625,13 @@ async def deallocate_ip(allocation_id: int, db: Session = Depends(get_db)):
 # Lease Management Endpoints
 @app.get("/leases/", response_model=List[IPLeaseResponse])
 async def list_leases(
+    response: Response,
     pool_id: Optional[int] = None,
     active_only: bool = True,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    db: Session = Depends(get_read_db)
 ):
     """List IP leases"""
     query = db.query(IPLease)
@@ -381,16 +641,16 @@ async def list_leases(
     if active_only:
         query = query.filter(IPLease.is_expired == False)
     
-    leases = query.offset(skip).limit(limit).all()
+    leases = _list_page(query, [IPLease.id], skip, limit, cursor, response)
     
     # Add time remaining to each lease
+    now = datetime.utcnow()
     result = []
     for lease in leases:
-        lease_dict = IPLeaseResponse.from_orm(lease).dict()
+        lease_response = IPLeaseResponse.model_validate(lease)
         if not lease.is_expired:
-            time_remaining = lease.lease_end - datetime.utcnow()
-            lease_dict['time_remaining_seconds'] = max(0, int(time_remaining.total_seconds()))
-        result.append(IPLeaseResponse(**lease_dict))
+            lease_response.time_remaining_seconds = max(0, int((lease.lease_end - now).total_seconds()))
+        result.append(lease_response)
     
     return result
 
@@ -421,6 +681,77 @@ async def cleanup_expired_leases(background_tasks: BackgroundTasks):
         message="Expired lease cleanup task scheduled"
     )
 
+# History Endpoints
+@app.post("/history/archive", response_model=OperationResult)
+async def archive_released_allocations(
+    older_than_seconds: Optional[int] = Query(None, ge=0, description="Defaults to the archive_after_seconds setting"),
+    pool_id: Optional[int] = None,
+    chunk_size: int = Query(ARCHIVE_CHUNK_SIZE, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """Move released allocations and their leases to the history tables"""
+    if older_than_seconds is None:
+        older_than_seconds = get_settings().archive_after_seconds
+    try:
+        summary = archive_released(db, older_than_seconds, chunk_size, pool_id)
+        return OperationResult(
+            success=True,
+            message=f"Archived {summary['allocations']} allocations and {summary['leases']} leases",
+            data=summary
+        )
+    except Exception as e:
+        logger.error(f"Error archiving allocations: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/history/allocations", response_model=List[IPAllocationHistoryResponse])
+async def list_allocation_history(
+    pool_id: Optional[int] = None,
+    ip_address: Optional[str] = None,
+    client_id: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db)
+):
+    """List archived allocations, most recently archived first"""
+    query = db.query(IPAllocationHistory)
+    
+    if pool_id:
+        query = query.filter(IPAllocationHistory.pool_id == pool_id)
+    if ip_address:
+        ip_int = address_to_int(ip_address)
+        if ip_int is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid IP address: {ip_address}"
+            )
+        query = query.filter(IPAllocationHistory.ip_int == ip_int)
+    if client_id:
+        query = query.filter(IPAllocationHistory.client_id == client_id)
+    
+    # Across shards, whose history IDs overlap, by archive time instead
+    return page(query.order_by(IPAllocationHistory.id.desc()), skip, limit, IPAllocationHistory.archived_at, descending=True)
+
+@app.get("/history/leases", response_model=List[IPLeaseHistoryResponse])
+async def list_lease_history(
+    pool_id: Optional[int] = None,
+    allocation_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db)
+):
+    """List leases of archived allocations, most recently archived first"""
+    query = db.query(IPLeaseHistory)
+    
+    if pool_id:
+        query = query.filter(IPLeaseHistory.pool_id == pool_id)
+    if allocation_id:
+        query = query.filter(IPLeaseHistory.allocation_id == allocation_id)
+    
+    return page(query.order_by(IPLeaseHistory.id.desc()), skip, limit, IPLeaseHistory.archived_at, descending=True)
+
 # Network Interface Management Endpoints
 @app.get("/interfaces/", response_model=List[NetworkInterfaceResponse])
 async def list_network_interfaces():
@@ -521,19 +852,118 @@ async def ping_ip(ip_address: str):
             detail=str(e)
         )
 
+# Export Endpoints
+@app.get("/export/{kind}")
+async def export_records(
+    kind: str,
+    pool_id: Optional[int] = None,
+    active_only: bool = False,
+    after_id: Optional[int] = Query(None, ge=0, description="Only export rows with a higher ID"),
+    gzip: bool = False
+):
+    """
+    Stream allocations, leases or allocation logs as NDJSON
+    
+    Rows are read from a server-side cursor and written out as they are
+    fetched, in ID order, so exports of any size use constant memory.
+    """
+    if kind not in EXPORT_TABLES:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown export '{kind}', expected one of: {', '.join(EXPORT_TABLES)}"
+        )
+    
+    body = buffered(export_lines(kind, pool_id=pool_id, active_only=active_only, after_id=after_id))
+    filename = f"{kind}-{datetime.utcnow():%Y%m%dT%H%M%S}.ndjson"
+    if gzip:
+        return StreamingResponse(
+            gzipped(body),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'}
+        )
+    return StreamingResponse(
+        body,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Bulk Import Endpoints
+@app.post("/import/{kind}", response_model=OperationResult)
+async def bulk_import(
+    kind: str,
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=100000),
+    skip_bytes: int = Query(0, ge=0, description="Resume after this many bytes of an earlier upload"),
+    db: Session = Depends(get_db)
+):
+    """
+    Import pools or allocations from a CSV or JSONL request body
+    
+    The body is parsed as it arrives and committed in chunks. If an upload
+    fails part way, send the same file again with skip_bytes set to the
+    committed_bytes of the last successful chunk.
+    """
+    if kind not in IMPORT_KINDS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown import kind '{kind}'"
+        )
+    
+    importer = BulkImporter(db, kind, chunk_size=chunk_size, source="upload")
+    parser = RecordParser(format)
+    splitter = LineSplitter()
+    
+    def consume(lines):
+        for line, end in lines:
+            if end <= skip_bytes:
+                # Already imported; only the CSV header is still needed
+                if format == "csv" and parser.header is None:
+                    parser.parse(line)
+                importer.skip(end)
+            else:
+                feed_line(importer, parser, line, end)
+    
+    try:
+        # Parsing and committing block, so each chunk runs in the threadpool
+        # while the event loop keeps serving other requests
+        async for chunk in request.stream():
+            await run_in_threadpool(consume, splitter.push(chunk))
+        await run_in_threadpool(consume, splitter.close())
+        summary = await run_in_threadpool(importer.finish)
+    except BulkImportError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error importing {kind}: {e}")
+        return OperationResult(
+            success=False,
+            message=f"Import stopped: {e}",
+            data=importer.summary()
+        )
+    
+    logger.info(f"Imported {summary['imported']} {kind}, rejected {summary['rejected']}")
+    return OperationResult(
+        success=True,
+        message=f"Imported {summary['imported']} {kind}, rejected {summary['rejected']}",
+        data=summary
+    )
+
 # System Statistics and Monitoring
 @app.get("/stats/system", response_model=SystemStats)
-async def get_system_stats(db: Session = Depends(get_db)):
+async def get_system_stats(db: Session = Depends(get_read_db)):
     """Get system statistics"""
     try:
-        # Get database statistics
-        total_pools = db.query(IPPool).count()
-        active_pools = db.query(IPPool).filter(IPPool.is_active == True).count()
-        total_allocations = db.query(IPAllocation).count()
-        active_allocations = db.query(IPAllocation).filter(IPAllocation.is_active == True).count()
-        total_leases = db.query(IPLease).count()
-        active_leases = db.query(IPLease).filter(IPLease.is_expired == False).count()
-        expired_leases = db.query(IPLease).filter(IPLease.is_expired == True).count()
+        # Get database statistics, added up over all shards
+        total_pools = count_rows(db.query(IPPool))
+        active_pools = count_rows(db.query(IPPool).filter(IPPool.is_active == True))
+        total_allocations = count_rows(db.query(IPAllocation))
+        active_allocations = count_rows(db.query(IPAllocation).filter(IPAllocation.is_active == True))
+        total_leases = count_rows(db.query(IPLease))
+        active_leases = count_rows(db.query(IPLease).filter(IPLease.is_expired == False))
+        expired_leases = count_rows(db.query(IPLease).filter(IPLease.is_expired == True))
         
         # Get interface statistics
         interfaces = network_manager.get_network_interfaces()
@@ -559,6 +989,34 @@ async def get_system_stats(db: Session = Depends(get_db)):
             detail=str(e)
         )
 
+@app.get("/stats/forecast", response_model=List[IPPoolForecast])
+async def get_forecast_summary(active_only: bool = True, db: Session = Depends(get_db)):
+    """Get exhaustion forecasts for all pools, most urgent first"""
+    try:
+        query = db.query(IPPool)
+        if active_only:
+            query = query.filter(IPPool.is_active == True)
+        return [IPPoolForecast(**item) for item in forecaster.summary(db, query.all())]
+    except Exception as e:
+        logger.error(f"Error forecasting pools: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/stats/instrumentation")
+async def get_instrumentation_stats(reset: bool = False):
+    """Get allocator phase timings and SQL statement counts (enable with BLACKZ_INSTRUMENTATION=1)"""
+    snapshot = instrumentation.snapshot()
+    if reset:
+        instrumentation.reset()
+    return snapshot
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics from in-memory registries; scraping runs no queries"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Health Check
 @app.get("/health")
 async def health_check():
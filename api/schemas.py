@@ -14,6 +14,7 @@ class IPPoolCreate(BaseModel):
         default_factory=list, 
         description="Reserved IP ranges [{'start': '192.168.1.1', 'end': '192.168.1.10'}]"
     )
+    quarantine_seconds: int = Field(default=0, ge=0, description="Seconds a released IP is held back before reuse")
     
     @validator('cidr')
     def validate_cidr(cls, v):
@@ -64,6 +65,7 @@ class IPPoolUpdate(BaseModel):
     gateway: Optional[str] = None
     dns_servers: Optional[List[str]] = None
     reserved_ranges: Optional[List[Dict[str, str]]] = None
+    quarantine_seconds: Optional[int] = Field(None, ge=0)
     is_active: Optional[bool] = None
     
     @validator('gateway')
@@ -84,6 +86,7 @@ class IPPoolResponse(BaseModel):
     gateway: Optional[str]
     dns_servers: Optional[str]  # JSON string
     reserved_ranges: Optional[str]  # JSON string
+    quarantine_seconds: Optional[int] = 0
     created_at: datetime
     updated_at: datetime
     is_active: bool
@@ -98,9 +101,45 @@ class IPPoolUtilization(BaseModel):
     usable_ips: int
     reserved_ips: int
     allocated_ips: int
+    quarantined_ips: int = 0
     available_ips: int
     utilization_percent: float
 
+class IPPoolFragmentation(BaseModel):
+    pool_id: int
+    pool_name: str
+    cidr: str
+    free_ips: int
+    free_runs: int
+    largest_free_run: int
+    average_free_run: float
+    fragmentation_index: float = Field(..., description="1 - largest free run / free IPs; 0 when all free IPs are contiguous")
+    run_length_histogram: Dict[str, int] = Field(..., description="Number of free runs per run length bucket")
+
+class IPPoolGap(BaseModel):
+    start_ip: str
+    end_ip: str
+    size: int
+
+class ReservedRangeResponse(BaseModel):
+    pool_id: int
+    start: str
+    end: str
+    size: int
+
+class IPPoolForecast(BaseModel):
+    pool_id: int
+    pool_name: str
+    cidr: str
+    available_ips: int
+    allocated_ips: int
+    utilization_percent: float
+    net_rate_per_hour: Dict[str, float] = Field(..., description="Smoothed net allocations per hour, per smoothing horizon")
+    projected_rate_per_hour: float
+    hours_to_exhaustion: Optional[float] = None
+    exhausts_at: Optional[datetime] = None
+    status: str = Field(..., description="exhausted, critical, warning, ok or stable")
+
 # IP Allocation Schemas
 class IPAllocationCreate(BaseModel):
     pool_id: int = Field(..., description="Pool ID to allocate from")
@@ -112,7 +151,7 @@ class IPAllocationCreate(BaseModel):
     
     @validator('allocation_strategy')
     def validate_strategy(cls, v):
-        valid_strategies = ['first_fit', 'random', 'sequential', 'load_balanced']
+        valid_strategies = ['first_fit', 'random', 'sequential', 'load_balanced', 'hash']
         if v not in valid_strategies:
             raise ValueError(f'Invalid strategy. Must be one of: {valid_strategies}')
         return v
@@ -150,11 +189,31 @@ class IPAllocationResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class IPAllocationHistoryResponse(BaseModel):
+    id: int
+    allocation_id: int
+    pool_id: int
+    ip_address: str
+    client_id: Optional[str]
+    client_name: Optional[str]
+    allocation_type: Optional[str]
+    allocation_strategy: Optional[str]
+    assigned_at: Optional[datetime]
+    last_seen: Optional[datetime]
+    released_at: Optional[datetime]
+    network_interface: Optional[str]
+    binding_status: Optional[str]
+    archived_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 class IPAllocationResult(BaseModel):
     success: bool
     message: str
     ip_address: Optional[str] = None
     allocation_id: Optional[int] = None
+    lease_id: Optional[int] = None
 
 # IP Lease Schemas
 class IPLeaseResponse(BaseModel):
@@ -173,6 +232,22 @@ class IPLeaseResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class IPLeaseHistoryResponse(BaseModel):
+    id: int
+    lease_id: int
+    pool_id: int
+    allocation_id: int
+    lease_start: Optional[datetime]
+    lease_duration: Optional[int]
+    lease_end: Optional[datetime]
+    renewal_count: Optional[int]
+    max_renewals: Optional[int]
+    auto_renew: Optional[bool]
+    archived_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 class LeaseRenewalRequest(BaseModel):
     lease_id: int
     extension_seconds: int = Field(default=86400, gt=0, description="Extension time in seconds")
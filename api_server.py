@@ -17,24 +17,37 @@ def main():
     """Start the API server"""
     print("Starting BlackzAllocator API Server...")
     
-    # Initialize database
+    # Load and validate settings before anything touches the database
     try:
-        from database import init_database
-        init_database()
-        print("Database initialized successfully")
-    except Exception as e:
-        print(f"Database initialization error: {e}")
+        from database.settings import get_settings
+        settings = get_settings()
+    except ValueError as e:
+        print(f"Configuration error: {e}")
         return
     
-    # Import the FastAPI app
-    from api.main import app
+    if settings.storage_engine == "journal":
+        # Pools and allocations live in the journal, no database is opened
+        from api.edge import app
+        print(f"Serving allocations from journal {settings.journal_path}")
+    else:
+        # Initialize database
+        try:
+            from database import init_database
+            init_database()
+            print("Database initialized successfully")
+        except Exception as e:
+            print(f"Database initialization error: {e}")
+            return
+        
+        # Import the FastAPI app
+        from api.main import app
     
     # Start the server
     try:
         uvicorn.run(
             app,
-            host="127.0.0.1",  # Changed from 0.0.0.0 to 127.0.0.1 for localhost access
-            port=8000,
+            host=settings.api_host,  # 127.0.0.1 by default for localhost access
+            port=settings.api_port,
             log_level="info",
             reload=False,  # Set to True for development
             access_log=True
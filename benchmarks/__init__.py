@@ -0,0 +1,5 @@
+"""
+BlackzAllocator benchmarks and analysis tools
+
+Each module is runnable on its own, e.g. `python -m benchmarks.probe_lengths`.
+"""
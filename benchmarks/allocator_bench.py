@@ -0,0 +1,313 @@
+"""
+Allocation engine microbenchmarks
+
+Builds pools of several sizes in a temporary SQLite database, pre-fills them
+to several levels and times the IPAllocator operations against them. Results
+are printed as a table and can be written as JSON and compared against an
+earlier run to catch regressions.
+
+    python -m benchmarks.allocator_bench
+    python -m benchmarks.allocator_bench --prefixes 24 20 --fills 50 90 --output run.json
+    python -m benchmarks.allocator_bench --baseline run.json
+"""
+
+import argparse
+import ipaddress
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import sessionmaker
+
+from core.ip_allocator import IPAllocator
+from core.pool_index import get_pool_index, invalidate_pool_index
+from database.models import Base, IPPool, IPAllocation, IPLease
+
+DEFAULT_PREFIXES = [24, 20, 16, 12]
+DEFAULT_FILLS = [10, 50, 90, 99]
+INSERT_CHUNK = 50000
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except Exception:
+        return None
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summarize latencies given in seconds as milliseconds"""
+    ordered = sorted(samples)
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000
+    return {
+        "n": len(ordered),
+        "p50_ms": round(pct(50), 4),
+        "p99_ms": round(pct(99), 4),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 4)
+    }
+
+def prefill(session, pool: IPPool, fill: int, rng: random.Random) -> int:
+    """Bulk insert active allocations and leases until the pool reaches the fill level"""
+    network = ipaddress.IPv4Network(pool.cidr)
+    first = int(network.network_address) + 1
+    size = network.num_addresses - 2
+    count = size * fill // 100
+    offsets = sorted(rng.sample(range(size), count))
+    now = datetime.utcnow()
+    lease_end = now + timedelta(days=1)
+
+    for start in range(0, count, INSERT_CHUNK):
+        chunk = offsets[start:start + INSERT_CHUNK]
+        session.execute(insert(IPAllocation), [
+            {
+                "id": start + n + 1,
+                "pool_id": pool.id,
+                "ip_address": str(ipaddress.IPv4Address(first + offset)),
+                "client_id": f"prefill-{start + n}",
+                "allocation_type": "dynamic",
+                "allocation_strategy": "first_fit",
+                "assigned_at": now,
+                "last_seen": now,
+                "is_active": True,
+                "binding_status": "unbound"
+            }
+            for n, offset in enumerate(chunk)
+        ])
+        session.execute(insert(IPLease), [
+            {
+                "pool_id": pool.id,
+                "allocation_id": start + n + 1,
+                "lease_start": now,
+                "lease_duration": 86400,
+                "lease_end": lease_end,
+                "renewal_count": 0,
+                "max_renewals": 3,
+                "is_expired": False,
+                "auto_renew": True
+            }
+            for n in range(len(chunk))
+        ])
+        session.commit()
+    return count
+
+def bench_pool(prefix: int, fill: int, iterations: int, strategies: List[str], seed: int) -> List[Dict]:
+    """Run every operation against one pool size and fill level"""
+    rng = random.Random(seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        session = Session()
+        # Every temporary database starts again at pool ID 1
+        invalidate_pool_index()
+
+        try:
+            cidr = f"10.0.0.0/{prefix}"
+            pool = IPPool(name=f"bench_{prefix}", cidr=cidr)
+            session.add(pool)
+            session.commit()
+
+            started = time.perf_counter()
+            prefilled = prefill(session, pool, fill, rng)
+            prefill_seconds = time.perf_counter() - started
+            allocator = IPAllocator(session)
+
+            def record(operation, strategy, samples, **extra):
+                row = {
+                    "prefix": prefix,
+                    "fill_percent": fill,
+                    "operation": operation,
+                    "strategy": strategy,
+                    "prefilled": prefilled
+                }
+                row.update(summarize(samples))
+                row.update(extra)
+                results.append(row)
+
+            # First call builds the pool index from the database
+            started = time.perf_counter()
+            allocator.get_pool_utilization(pool.id)
+            cold_ms = round((time.perf_counter() - started) * 1000, 3)
+
+            # allocate_next_ip per strategy; each allocation is released again
+            # so the fill level stays put
+            dealloc_samples = []
+            for strategy in strategies:
+                alloc_samples = []
+                for n in range(iterations):
+                    started = time.perf_counter()
+                    success, message, ip_address = allocator.allocate_next_ip(
+                        pool.id, client_id=f"bench-{strategy}-{n}", strategy=strategy
+                    )
+                    alloc_samples.append(time.perf_counter() - started)
+                    if not success:
+                        raise RuntimeError(f"allocate_next_ip failed: {message}")
+                    allocation = session.query(IPAllocation).filter(
+                        IPAllocation.pool_id == pool.id,
+                        IPAllocation.ip_address == ip_address,
+                        IPAllocation.is_active == True
+                    ).first()
+                    started = time.perf_counter()
+                    allocator.deallocate_ip(allocation.id)
+                    dealloc_samples.append(time.perf_counter() - started)
+                record("allocate_next_ip", strategy, alloc_samples)
+            record("deallocate_ip", "-", dealloc_samples)
+
+            # reserve_specific_ip on random free addresses
+            reserve_samples = []
+            for n in range(iterations):
+                index = get_pool_index(session, pool)
+                ip_address = index.address(index.nth_free(rng.randrange(index.free_count)))
+                started = time.perf_counter()
+                success, message = allocator.reserve_specific_ip(pool.id, ip_address, client_id=f"reserve-{n}")
+                reserve_samples.append(time.perf_counter() - started)
+                if not success:
+                    raise RuntimeError(f"reserve_specific_ip failed: {message}")
+                allocation = session.query(IPAllocation).filter(
+                    IPAllocation.pool_id == pool.id,
+                    IPAllocation.ip_address == ip_address,
+                    IPAllocation.is_active == True
+                ).first()
+                allocator.deallocate_ip(allocation.id)
+            record("reserve_specific_ip", "-", reserve_samples)
+
+            utilization_samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                allocator.get_pool_utilization(pool.id)
+                utilization_samples.append(time.perf_counter() - started)
+            record("get_pool_utilization", "-", utilization_samples, cold_ms=cold_ms)
+
+            # cleanup_expired_leases: expire a batch of leases, time the sweep,
+            # then reactivate the batch
+            batch = max(1, min(50, prefilled // 10))
+            cleanup_samples = []
+            for _ in range(max(1, iterations // 20)):
+                allocation_ids = rng.sample(range(1, prefilled + 1), min(batch, prefilled)) if prefilled else []
+                past = datetime.utcnow() - timedelta(seconds=1)
+                session.execute(
+                    update(IPLease).where(IPLease.allocation_id.in_(allocation_ids)).values(lease_end=past)
+                )
+                session.commit()
+                started = time.perf_counter()
+                allocator.cleanup_expired_leases()
+                cleanup_samples.append(time.perf_counter() - started)
+                session.execute(
+                    update(IPAllocation).where(IPAllocation.id.in_(allocation_ids)).values(is_active=True)
+                )
+                session.execute(
+                    update(IPLease).where(IPLease.allocation_id.in_(allocation_ids)).values(
+                        is_expired=False, lease_end=datetime.utcnow() + timedelta(days=1)
+                    )
+                )
+                session.commit()
+                invalidate_pool_index(pool.id)
+            record("cleanup_expired_leases", "-", cleanup_samples, batch=batch)
+
+            for row in results:
+                row["prefill_seconds"] = round(prefill_seconds, 2)
+                row["peak_rss_mb"] = peak_rss_mb()
+        finally:
+            session.close()
+            engine.dispose()
+            invalidate_pool_index()
+    return results
+
+def compare(results: List[Dict], baseline_path: str, tolerance: float) -> List[str]:
+    """List operations whose p50 regressed by more than the tolerance against a baseline run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    key = lambda row: (row["prefix"], row["fill_percent"], row["operation"], row["strategy"])
+    previous = {key(row): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        old = previous.get(key(row))
+        if old and old["p50_ms"] > 0 and row["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append(
+                f"/{row['prefix']} {row['fill_percent']}% {row['operation']} ({row['strategy']}): "
+                f"p50 {old['p50_ms']:.3f} -> {row['p50_ms']:.3f} ms"
+            )
+    return regressions
+
+def print_table(results: List[Dict]):
+    print(f"{'Pool':<6} {'Fill':>5} {'Operation':<24} {'Strategy':<14} {'N':>5} "
+          f"{'p50 ms':>10} {'p99 ms':>10} {'RSS MB':>8}")
+    print("-" * 90)
+    for row in results:
+        print(f"/{row['prefix']:<5} {row['fill_percent']:>4}% {row['operation']:<24} {row['strategy']:<14} "
+              f"{row['n']:>5} {row['p50_ms']:>10.3f} {row['p99_ms']:>10.3f} {row['peak_rss_mb'] or 0:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='IPAllocator microbenchmarks')
+    parser.add_argument('--prefixes', type=int, nargs='+', default=DEFAULT_PREFIXES, help='Pool prefix lengths')
+    parser.add_argument('--fills', type=int, nargs='+', default=DEFAULT_FILLS, help='Fill levels in percent')
+    parser.add_argument('--strategies', nargs='+', default=list(IPAllocator.STRATEGIES), help='Strategies to time')
+    parser.add_argument('--iterations', type=int, default=100, help='Timed calls per operation')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p50 slowdown vs baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    for strategy in args.strategies:
+        if strategy not in IPAllocator.STRATEGIES:
+            parser.error(f"Unknown strategy '{strategy}'")
+    for fill in args.fills:
+        if not 0 <= fill < 100:
+            parser.error('--fills must be in [0, 100)')
+
+    results = []
+    for prefix in args.prefixes:
+        for fill in args.fills:
+            print(f"Benchmarking /{prefix} at {fill}%...", file=sys.stderr)
+            results.extend(bench_pool(prefix, fill, args.iterations, args.strategies, args.seed))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results
+    }
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    else:
+        print()
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+End-to-end load generator for the BlackzAllocator API
+
+Drives the API with many concurrent virtual clients issuing a weighted mix
+of allocate, renew, deallocate, list and utilization calls, then reports
+throughput, latency histograms and error rates per endpoint.
+
+    # In-process against api.main.app, on a scratch database
+    python -m benchmarks.api_load --scenario benchmarks/scenarios/mixed.json
+
+    # Against a running server (python api_server.py)
+    python -m benchmarks.api_load --url http://127.0.0.1:8000 --scenario my_traffic.json
+
+Scenario files are JSON. Top-level keys are defaults for every phase, and
+each entry of "phases" runs in order and may override any of them:
+
+    {
+        "name": "prod-shape",
+        "virtual_clients": 20,            # concurrent clients
+        "think_time_ms": [0, 20],         # random pause between a client's calls
+        "pools": [{"name": "load_a", "cidr": "10.60.0.0/22"}],
+        "mix": {"allocate": 35, "renew": 25, "deallocate": 20, "list": 10, "utilization": 10},
+        "allocate": {"strategy": "first_fit", "lease_duration": 3600},
+        "list": {"limit": 100},
+        "phases": [
+            {"name": "steady", "duration_seconds": 60},
+            {"name": "storm", "duration_seconds": 10, "virtual_clients": 200, "mix": {"allocate": 1}}
+        ]
+    }
+
+Pools are created if no pool of that name exists. A scenario without
+"phases" runs once for "duration_seconds" (default 10).
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+OPERATIONS = ["allocate", "renew", "deallocate", "list", "utilization"]
+
+# Latency histogram bucket upper bounds in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+DEFAULT_SCENARIO = {
+    "name": "default",
+    "duration_seconds": 10,
+    "virtual_clients": 10,
+    "think_time_ms": [0, 10],
+    "pools": [{"name": "load_default", "cidr": "10.60.0.0/22"}],
+    "mix": {"allocate": 35, "renew": 25, "deallocate": 20, "list": 10, "utilization": 10},
+    "allocate": {"strategy": "first_fit", "lease_duration": 3600},
+    "list": {"limit": 100}
+}
+
+class EndpointStats:
+    """Latency and outcome counters for one operation"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.errors = 0      # transport errors and HTTP status >= 400
+        self.rejected = 0    # HTTP success but {"success": false}
+
+    def record(self, seconds: float):
+        self.latencies.append(seconds)
+        ms = seconds * 1000
+        for position, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[position] += 1
+                return
+        self.buckets[-1] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, object]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        def pct(p):
+            return round(ordered[min(count - 1, int(count * p / 100))] * 1000, 3) if count else None
+        histogram = {f"<={bound}ms": n for bound, n in zip(BUCKETS_MS, self.buckets)}
+        histogram[f">{BUCKETS_MS[-1]}ms"] = self.buckets[-1]
+        return {
+            "requests": count,
+            "throughput_rps": round(count / elapsed, 2) if elapsed else 0,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "error_rate": round(self.errors / count, 4) if count else 0,
+            "p50_ms": pct(50),
+            "p90_ms": pct(90),
+            "p99_ms": pct(99),
+            "max_ms": round(ordered[-1] * 1000, 3) if count else None,
+            "histogram": histogram
+        }
+
+class VirtualClient:
+    """One simulated client holding its own allocations"""
+
+    def __init__(self, number: int, http, pool_ids: List[int], stats: Dict[str, EndpointStats], rng: random.Random):
+        self.number = number
+        self.http = http
+        self.pool_ids = pool_ids
+        self.stats = stats
+        self.rng = rng
+        self.held: List[Dict[str, int]] = []
+        self.counter = 0
+
+    async def call(self, operation: str, method: str, url: str, **kwargs) -> Optional[dict]:
+        stats = self.stats[operation]
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except Exception:
+            stats.record(time.perf_counter() - started)
+            stats.errors += 1
+            return None
+        stats.record(time.perf_counter() - started)
+        if response.status_code >= 400:
+            stats.errors += 1
+            return None
+        body = response.json()
+        if isinstance(body, dict) and body.get("success") is False:
+            stats.rejected += 1
+        return body
+
+    async def step(self, phase: Dict):
+        operation = self.rng.choices(
+            list(phase["mix"]), weights=list(phase["mix"].values())
+        )[0]
+        # Renew and deallocate need something to act on
+        if operation in ("renew", "deallocate") and not self.held:
+            operation = "allocate"
+
+        pool_id = self.rng.choice(self.pool_ids)
+        if operation == "allocate":
+            self.counter += 1
+            settings = phase.get("allocate", {})
+            body = await self.call("allocate", "POST", "/allocations/", json={
+                "pool_id": pool_id,
+                "client_id": f"vc{self.number}-{self.counter}",
+                "allocation_strategy": settings.get("strategy", "first_fit"),
+                "lease_duration": settings.get("lease_duration", 3600)
+            })
+            if body and body.get("success"):
+                self.held.append({"allocation_id": body["allocation_id"], "lease_id": body.get("lease_id")})
+        elif operation == "renew":
+            held = self.rng.choice(self.held)
+            if held.get("lease_id") is None:
+                return
+            await self.call("renew", "POST", "/leases/renew", json={
+                "lease_id": held["lease_id"],
+                "extension_seconds": phase.get("allocate", {}).get("lease_duration", 3600)
+            })
+        elif operation == "deallocate":
+            held = self.held.pop(self.rng.randrange(len(self.held)))
+            await self.call("deallocate", "DELETE", f"/allocations/{held['allocation_id']}")
+        elif operation == "list":
+            limit = phase.get("list", {}).get("limit", 100)
+            await self.call("list", "GET", f"/allocations/?pool_id={pool_id}&limit={limit}")
+        elif operation == "utilization":
+            await self.call("utilization", "GET", f"/pools/{pool_id}/utilization")
+
+    async def run(self, phase: Dict, deadline: float):
+        low, high = phase.get("think_time_ms", [0, 0])
+        while time.perf_counter() < deadline:
+            await self.step(phase)
+            if high > 0:
+                await asyncio.sleep(self.rng.uniform(low, high) / 1000)
+            else:
+                # Let other clients run even without think time
+                await asyncio.sleep(0)
+
+def load_scenario(path: Optional[str]) -> Dict:
+    scenario = dict(DEFAULT_SCENARIO)
+    if path:
+        with open(path) as f:
+            scenario.update(json.load(f))
+    phases = scenario.pop("phases", None) or [{}]
+    resolved = []
+    for number, overrides in enumerate(phases):
+        phase = {key: value for key, value in scenario.items() if key != "pools"}
+        phase.update(overrides)
+        phase.setdefault("name", f"phase_{number + 1}")
+        for operation in phase["mix"]:
+            if operation not in OPERATIONS:
+                raise ValueError(f"Unknown operation '{operation}' in mix; expected one of {OPERATIONS}")
+        resolved.append(phase)
+    scenario["phases"] = resolved
+    return scenario
+
+async def ensure_pools(http, pools: List[Dict]) -> List[int]:
+    """Find or create the scenario's pools and return their IDs"""
+    response = await http.get("/pools/?limit=1000")
+    response.raise_for_status()
+    existing = {pool["name"]: pool["id"] for pool in response.json()}
+    pool_ids = []
+    for pool in pools:
+        if pool["name"] in existing:
+            pool_ids.append(existing[pool["name"]])
+            continue
+        response = await http.post("/pools/", json=pool)
+        response.raise_for_status()
+        pool_ids.append(response.json()["id"])
+    return pool_ids
+
+async def run_scenario(http, scenario: Dict, seed: int, keep: bool) -> Dict:
+    pool_ids = await ensure_pools(http, scenario["pools"])
+    rng = random.Random(seed)
+    clients: List[VirtualClient] = []
+    report = {"scenario": scenario.get("name"), "phases": []}
+
+    for phase in scenario["phases"]:
+        stats = {operation: EndpointStats() for operation in OPERATIONS}
+        # Clients persist across phases so held allocations carry over
+        while len(clients) < phase["virtual_clients"]:
+            clients.append(VirtualClient(len(clients), http, pool_ids, stats, random.Random(rng.random())))
+        active = clients[:phase["virtual_clients"]]
+        for client in active:
+            client.stats = stats
+
+        print(f"Running phase '{phase['name']}': {len(active)} clients for "
+              f"{phase['duration_seconds']}s", file=sys.stderr)
+        started = time.perf_counter()
+        deadline = started + phase["duration_seconds"]
+        await asyncio.gather(*(client.run(phase, deadline) for client in active))
+        elapsed = time.perf_counter() - started
+
+        total = sum(len(s.latencies) for s in stats.values())
+        report["phases"].append({
+            "name": phase["name"],
+            "virtual_clients": len(active),
+            "elapsed_seconds": round(elapsed, 2),
+            "total_requests": total,
+            "throughput_rps": round(total / elapsed, 2) if elapsed else 0,
+            "endpoints": {
+                operation: s.summary(elapsed) for operation, s in stats.items() if s.latencies
+            }
+        })
+
+    if not keep:
+        for client in clients:
+            for held in client.held:
+                await http.delete(f"/allocations/{held['allocation_id']}")
+    return report
+
+def print_report(report: Dict):
+    for phase in report["phases"]:
+        print(f"\nPhase '{phase['name']}': {phase['total_requests']} requests in "
+              f"{phase['elapsed_seconds']}s ({phase['throughput_rps']} req/s, "
+              f"{phase['virtual_clients']} clients)")
+        print(f"{'Endpoint':<12} {'Requests':>9} {'req/s':>8} {'Errors':>7} {'Rejected':>9} "
+              f"{'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        print("-" * 90)
+        for operation, s in phase["endpoints"].items():
+            print(f"{operation:<12} {s['requests']:>9} {s['throughput_rps']:>8} {s['errors']:>7} "
+                  f"{s['rejected']:>9} {s['p50_ms']:>9} {s['p90_ms']:>9} {s['p99_ms']:>9} {s['max_ms']:>9}")
+
+async def main_async(args) -> Dict:
+    try:
+        import httpx
+    except ImportError:
+        print("The load generator needs httpx: pip install httpx", file=sys.stderr)
+        sys.exit(1)
+
+    scenario = load_scenario(args.scenario)
+    if args.duration:
+        for phase in scenario["phases"]:
+            phase["duration_seconds"] = args.duration
+    if args.clients:
+        for phase in scenario["phases"]:
+            phase["virtual_clients"] = args.clients
+
+    # httpx logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=30) as http:
+            return await run_scenario(http, scenario, args.seed, args.keep)
+
+    # In-process: run the app against a scratch database in a temporary directory
+    workdir = tempfile.mkdtemp(prefix="blackz_load_")
+    os.chdir(workdir)
+    print(f"Using scratch database in {workdir}", file=sys.stderr)
+    from api.main import app
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30) as http:
+        return await run_scenario(http, scenario, args.seed, args.keep)
+
+def main():
+    parser = argparse.ArgumentParser(description='BlackzAllocator API load generator')
+    parser.add_argument('--scenario', help='Scenario JSON file (defaults to a built-in mixed scenario)')
+    parser.add_argument('--url', help='Base URL of a running API server; omit to drive api.main.app in-process')
+    parser.add_argument('--duration', type=float, help='Override every phase duration in seconds')
+    parser.add_argument('--clients', type=int, help='Override every phase client count')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--keep', action='store_true', help='Keep allocations made during the run')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    # Resolve paths before an in-process run changes directory
+    if args.scenario:
+        args.scenario = os.path.abspath(args.scenario)
+    output = os.path.abspath(args.output) if args.output else None
+
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Prebuilt statement benchmark
+
+Times the Python CPU of the hot lookups two ways against a scratch SQLite
+database:
+
+    query     built through the ORM Query API on every call, as the
+              allocator and API did before
+    prebuilt  the module-level statements of database.queries, executed
+              with bound parameters
+
+Both hit SQLAlchemy's compiled cache; the prebuilt statements also skip
+building the Query and its options, and the column lookups skip creating
+ORM objects. Reports CPU microseconds per call (time.process_time, so time
+spent waiting on SQLite I/O is left out) and the share saved.
+
+    python -m benchmarks.compiled_statements
+    python -m benchmarks.compiled_statements --calls 20000 --output statements.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, joinedload, sessionmaker
+
+from core.ip_allocator import IPAllocator
+from core.pool_index import invalidate_pool_index
+from database.models import Base, IPPool, PoolReservedRange, IPAllocation, IPLease
+from database.queries import (
+    POOL_BY_ID, RESERVED_ADDRESS_COUNT, ACTIVE_ALLOCATION_COUNT, ALLOCATION_WITH_LEASE,
+    LEASE_WITH_ALLOCATION, ACTIVE_ALLOCATION_IDS_BY_ADDRESS
+)
+
+def seed(db: Session, allocations: int) -> Dict:
+    """Create a pool with some allocations and return the values the lookups use"""
+    pool = IPPool(name="bench", cidr="10.0.0.0/16", reserved_ranges='[{"start": "10.0.0.1", "end": "10.0.0.9"}]')
+    db.add(pool)
+    db.commit()
+    allocator = IPAllocator(db)
+    for n in range(allocations):
+        allocator.allocate_next_ip(pool.id, client_id=f"c{n}")
+    allocation = db.query(IPAllocation).filter(IPAllocation.pool_id == pool.id).order_by(IPAllocation.id.desc()).first()
+    return {
+        "pool_id": pool.id,
+        "allocation_id": allocation.id,
+        "lease_id": allocation.lease.id,
+        "ip_address": allocation.ip_address
+    }
+
+def cases(fixture: Dict) -> List[Tuple[str, Callable, Callable]]:
+    """Get (name, query, prebuilt) pairs of the same lookup"""
+    pool_id = fixture["pool_id"]
+    allocation_id = fixture["allocation_id"]
+    lease_id = fixture["lease_id"]
+    ip_address = fixture["ip_address"]
+
+    def lookup_query(db):
+        allocation = db.query(IPAllocation).options(joinedload(IPAllocation.lease)).filter(
+            IPAllocation.ip_address == ip_address,
+            IPAllocation.pool_id == pool_id,
+            IPAllocation.is_active == True
+        ).first()
+        return allocation.id, allocation.lease.id
+
+    return [
+        ("pool by id",
+         lambda db: db.query(IPPool).filter(IPPool.id == pool_id).first(),
+         lambda db: db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()),
+        ("reserved count",
+         lambda db: db.query(
+             func.coalesce(func.sum(PoolReservedRange.end_int - PoolReservedRange.start_int + 1), 0)
+         ).filter(PoolReservedRange.pool_id == pool_id).scalar(),
+         lambda db: db.execute(RESERVED_ADDRESS_COUNT, {"pool_id": pool_id}).scalar()),
+        ("active allocation count",
+         lambda db: db.query(IPAllocation).filter(IPAllocation.pool_id == pool_id, IPAllocation.is_active == True).count(),
+         lambda db: db.execute(ACTIVE_ALLOCATION_COUNT, {"pool_id": pool_id}).scalar()),
+        ("allocation with lease",
+         lambda db: db.query(IPAllocation).options(joinedload(IPAllocation.lease)).filter(
+             IPAllocation.id == allocation_id).first(),
+         lambda db: db.execute(ALLOCATION_WITH_LEASE, {"allocation_id": allocation_id}).scalar()),
+        ("lease with allocation",
+         lambda db: db.query(IPLease).options(joinedload(IPLease.allocation)).filter(IPLease.id == lease_id).first(),
+         lambda db: db.execute(LEASE_WITH_ALLOCATION, {"lease_id": lease_id}).scalar()),
+        ("allocation ids by address",
+         lookup_query,
+         lambda db: tuple(db.execute(
+             ACTIVE_ALLOCATION_IDS_BY_ADDRESS, {"pool_id": pool_id, "ip_address": ip_address}
+         ).first()))
+    ]
+
+def cpu_per_call(Session, lookup: Callable, calls: int) -> float:
+    """Get the CPU microseconds of one lookup in a fresh session, as a request would run it"""
+    for _ in range(min(calls, 100)):
+        db = Session()
+        lookup(db)
+        db.close()
+    started = time.process_time()
+    for _ in range(calls):
+        db = Session()
+        lookup(db)
+        db.close()
+    return (time.process_time() - started) / calls * 1e6
+
+def run(calls: int, allocations: int) -> List[Dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Every scratch database starts again at pool ID 1
+        invalidate_pool_index()
+        try:
+            db = Session()
+            fixture = seed(db, allocations)
+            db.close()
+            for name, query, prebuilt in cases(fixture):
+                print(f"Benchmarking {name}...", file=sys.stderr)
+                db = Session()
+                if query(db) != prebuilt(db):
+                    raise RuntimeError(f"{name}: the two lookups disagree")
+                db.close()
+                before = cpu_per_call(Session, query, calls)
+                after = cpu_per_call(Session, prebuilt, calls)
+                results.append({
+                    "lookup": name,
+                    "query_us": round(before, 1),
+                    "prebuilt_us": round(after, 1),
+                    "saved_percent": round((before - after) / before * 100, 1) if before else 0.0
+                })
+        finally:
+            engine.dispose()
+            invalidate_pool_index()
+    return results
+
+def print_table(results: List[Dict]):
+    print(f"{'Lookup':<26} {'Query us':>9} {'Prebuilt us':>12} {'Saved':>7}")
+    print("-" * 57)
+    for result in results:
+        print(f"{result['lookup']:<26} {result['query_us']:>9.1f} {result['prebuilt_us']:>12.1f} "
+              f"{result['saved_percent']:>6.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the CPU cost of Query lookups and prebuilt statements')
+    parser.add_argument('--calls', type=int, default=5000, help='Timed calls per lookup and form')
+    parser.add_argument('--allocations', type=int, default=500, help='Allocations in the scratch pool')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    results = run(args.calls, args.allocations)
+    print_table(results)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "calls": args.calls,
+                "allocations": args.allocations
+            },
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
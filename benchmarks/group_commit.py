@@ -0,0 +1,175 @@
+"""
+Group commit benchmark
+
+Simulates a boot storm: many client threads allocate addresses at once
+against a scratch database, first each with its own IPAllocator and
+transaction, then through a GroupCommitter sharing transactions. Reports
+allocations per second, caller latency and the batch sizes reached.
+
+Durability settings decide how much a commit costs, so run it with the
+SQLite profile used in production; "default" fsyncs on every commit.
+
+    python -m benchmarks.group_commit
+    python -m benchmarks.group_commit --profile default --clients 64 --allocations 50 --output group.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core import metrics
+from core.group_commit import GroupCommitter
+from core.ip_allocator import IPAllocator
+from core.pool_index import invalidate_pool_index
+from database.models import Base, IPPool
+from database.sqlite_profile import SQLITE_PROFILES, apply_sqlite_profile, sqlite_pragmas
+from .allocator_bench import summarize
+
+MODES = ("direct", "group")
+
+def _batch_sizes() -> Dict[str, float]:
+    """Count and sum of the batch size histogram so far"""
+    histogram = metrics.group_commit_batch_size.histograms.get(())
+    if histogram is None:
+        return {"batches": 0, "allocations": 0}
+    return {"batches": histogram.count, "allocations": histogram.sum}
+
+def bench_mode(mode: str, profile: str, clients: int, allocations: int, max_batch: int, max_wait: float) -> Dict:
+    """Let every client allocate its addresses against a fresh database"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmpdir, 'bench.db')}",
+            connect_args={"check_same_thread": False},
+            pool_size=clients + 2
+        )
+        apply_sqlite_profile(engine, sqlite_pragmas(profile))
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Every scratch database starts again at pool ID 1
+        invalidate_pool_index()
+
+        committer = None
+        try:
+            session = Session()
+            pool = IPPool(name="storm", cidr="10.0.0.0/12")
+            session.add(pool)
+            session.commit()
+            pool_id = pool.id
+            session.close()
+
+            if mode == "group":
+                committer = GroupCommitter(Session, max_batch=max_batch, max_wait=max_wait)
+                committer.start()
+            before = _batch_sizes()
+
+            latencies: List[List[float]] = [[] for _ in range(clients)]
+            failures = [0] * clients
+            start = threading.Barrier(clients + 1)
+
+            def client(number: int):
+                session = None if committer else Session()
+                allocator = IPAllocator(session) if session else None
+                start.wait()
+                try:
+                    for n in range(allocations):
+                        started = time.perf_counter()
+                        if committer:
+                            success, _, _ = committer.allocate_next_ip(pool_id, client_id=f"c{number}-{n}")
+                        else:
+                            success, _, _ = allocator.allocate_next_ip(pool_id, client_id=f"c{number}-{n}")
+                        latencies[number].append(time.perf_counter() - started)
+                        if not success:
+                            failures[number] += 1
+                finally:
+                    if session:
+                        session.close()
+
+            threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(clients)]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            after = _batch_sizes()
+        finally:
+            if committer:
+                committer.stop()
+            engine.dispose()
+            invalidate_pool_index()
+
+    total = clients * allocations
+    result = {
+        "mode": mode,
+        "allocations": total,
+        "failures": sum(failures),
+        "seconds": round(elapsed, 3),
+        "allocations_per_second": round(total / elapsed, 1)
+    }
+    result.update(summarize([value for values in latencies for value in values]))
+    if mode == "group":
+        batches = after["batches"] - before["batches"]
+        result["batches"] = batches
+        result["mean_batch"] = round((after["allocations"] - before["allocations"]) / batches, 1) if batches else 0
+    return result
+
+def print_table(results: List[Dict]):
+    print(f"{'Mode':<8} {'Allocs':>7} {'Allocs/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'Batches':>8} {'Mean':>6} {'Failed':>7}")
+    print("-" * 72)
+    for result in results:
+        print(f"{result['mode']:<8} {result['allocations']:>7} {result['allocations_per_second']:>10.1f} "
+              f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result.get('batches', '-'):>8} "
+              f"{result.get('mean_batch', '-'):>6} {result['failures']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-allocation commits with group commits')
+    parser.add_argument('--profile', default='tuned', help='SQLite profile')
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent client threads')
+    parser.add_argument('--allocations', type=int, default=25, help='Allocations per client')
+    parser.add_argument('--max-batch', type=int, default=64, help='Most allocations per group commit')
+    parser.add_argument('--window-ms', type=float, default=2.0, help='Group commit window')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    if args.profile not in SQLITE_PROFILES:
+        parser.error(f"Unknown profile '{args.profile}'")
+
+    results = []
+    for mode in MODES:
+        print(f"Benchmarking {mode} commits...", file=sys.stderr)
+        results.append(bench_mode(
+            mode, args.profile, args.clients, args.allocations, args.max_batch, args.window_ms / 1000
+        ))
+    print_table(results)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "profile": args.profile,
+                "clients": args.clients,
+                "allocations": args.allocations,
+                "max_batch": args.max_batch,
+                "window_ms": args.window_ms
+            },
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Journal storage engine benchmark
+
+Compares the SQLite backend (IPAllocator) with the allocation journal
+(JournalAllocator) on two counts:
+
+    throughput  concurrent client threads allocating from a /12 pool,
+                reported as allocations per second and caller latency
+    recovery    a writer process is killed mid-run after filling a pool,
+                then a fresh process times opening the store until its first
+                allocation succeeds; the journal is timed both replaying
+                every event and starting from a compacted snapshot
+
+    python -m benchmarks.journal_engine
+    python -m benchmarks.journal_engine --clients 16 --allocations 500 --recovery-allocations 50000 --output journal.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.ip_allocator import IPAllocator
+from core.journal import JournalAllocator
+from core.pool_index import invalidate_pool_index
+from database.models import Base, IPPool
+from database.sqlite_profile import SQLITE_PROFILES, apply_sqlite_profile, sqlite_pragmas
+from .allocator_bench import summarize
+
+ENGINES = ("sqlite", "journal")
+RECOVERY_CASES = ("sqlite", "journal replay", "journal snapshot")
+POOL_CIDR = "10.0.0.0/12"
+NEVER_COMPACT = 2 ** 31
+
+class Store:
+    """One engine opened on a scratch directory, with its pool"""
+
+    def __init__(self, engine: str, path: str, profile: str, fsync: bool, connections: int = 4):
+        self.engine = engine
+        self.sql_engine = None
+        self.journal = None
+        if engine == "sqlite":
+            self.sql_engine = create_engine(
+                f"sqlite:///{os.path.join(path, 'bench.db')}",
+                connect_args={"check_same_thread": False},
+                pool_size=connections
+            )
+            apply_sqlite_profile(self.sql_engine, sqlite_pragmas(profile))
+            Base.metadata.create_all(bind=self.sql_engine)
+            self.Session = sessionmaker(autocommit=False, autoflush=False, bind=self.sql_engine)
+        else:
+            self.journal = JournalAllocator(os.path.join(path, "bench.journal"), fsync=fsync, compact_every=NEVER_COMPACT)
+
+    def create_pool(self) -> int:
+        if self.journal:
+            return self.journal.create_pool("bench", POOL_CIDR)[2]
+        session = self.Session()
+        try:
+            pool = IPPool(name="bench", cidr=POOL_CIDR)
+            session.add(pool)
+            session.commit()
+            return pool.id
+        finally:
+            session.close()
+
+    def allocator(self):
+        """Get an allocator for one client thread, and the session to close afterwards"""
+        if self.journal:
+            return self.journal, None
+        session = self.Session()
+        return IPAllocator(session), session
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+        else:
+            self.sql_engine.dispose()
+
+def bench_throughput(engine: str, profile: str, fsync: bool, clients: int, allocations: int) -> Dict:
+    """Let every client allocate its addresses against a fresh store"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Every scratch database starts again at pool ID 1
+        invalidate_pool_index()
+        store = Store(engine, tmpdir, profile, fsync, connections=clients + 2)
+        try:
+            pool_id = store.create_pool()
+            latencies: List[List[float]] = [[] for _ in range(clients)]
+            failures = [0] * clients
+            start = threading.Barrier(clients + 1)
+
+            def client(number: int):
+                allocator, session = store.allocator()
+                start.wait()
+                try:
+                    for n in range(allocations):
+                        started = time.perf_counter()
+                        success, _, _ = allocator.allocate_next_ip(pool_id, client_id=f"c{number}-{n}")
+                        latencies[number].append(time.perf_counter() - started)
+                        if not success:
+                            failures[number] += 1
+                finally:
+                    if session:
+                        session.close()
+
+            threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(clients)]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            store.close()
+            invalidate_pool_index()
+
+    total = clients * allocations
+    result = {
+        "engine": engine,
+        "allocations": total,
+        "failures": sum(failures),
+        "seconds": round(elapsed, 3),
+        "allocations_per_second": round(total / elapsed, 1)
+    }
+    result.update(summarize([value for values in latencies for value in values]))
+    return result
+
+def child_load(engine: str, path: str, profile: str, fsync: bool, allocations: int, compact: bool):
+    """Fill a pool, report that on stdout, then keep allocating until killed"""
+    store = Store(engine, path, profile, fsync)
+    pool_id = store.create_pool()
+    allocator, _ = store.allocator()
+    for n in range(allocations):
+        allocator.allocate_next_ip(pool_id, client_id=f"c{n}")
+    if compact:
+        store.journal.compact()
+    print("ready", flush=True)
+    n = allocations
+    while True:
+        allocator.allocate_next_ip(pool_id, client_id=f"c{n}")
+        n += 1
+
+def child_recover(engine: str, path: str, profile: str, fsync: bool):
+    """Open a crashed store and time it until the first allocation succeeds"""
+    started = time.perf_counter()
+    store = Store(engine, path, profile, fsync)
+    allocator, session = store.allocator()
+    success, message, _ = allocator.allocate_next_ip(1, client_id="after-crash")
+    elapsed = time.perf_counter() - started
+    if not success:
+        raise SystemExit(f"Allocation after recovery failed: {message}")
+    result = {"seconds": round(elapsed, 3)}
+    if store.journal:
+        result.update({
+            "snapshot_records": store.journal.recovery["snapshot_records"],
+            "replayed": store.journal.recovery["replayed"],
+            "truncated_bytes": store.journal.recovery["truncated_bytes"]
+        })
+    if session:
+        session.close()
+    store.close()
+    print(json.dumps(result))
+
+def bench_recovery(case: str, profile: str, fsync: bool, allocations: int) -> Dict:
+    """Kill a writer mid-run and time the next process to its first allocation"""
+    engine = "sqlite" if case == "sqlite" else "journal"
+    common = ["--engine", engine, "--profile", profile, "--journal-fsync" if fsync else "--no-journal-fsync"]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        writer = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.journal_engine", "--child-load", tmpdir,
+             "--recovery-allocations", str(allocations), *common]
+            + (["--compact"] if case == "journal snapshot" else []),
+            stdout=subprocess.PIPE, text=True
+        )
+        try:
+            if writer.stdout.readline().strip() != "ready":
+                raise RuntimeError(f"Writer for {case} did not start")
+            # Let it get into the middle of more writes before pulling the plug
+            time.sleep(0.2)
+        finally:
+            writer.kill()
+            writer.wait()
+
+        recovered = subprocess.run(
+            [sys.executable, "-m", "benchmarks.journal_engine", "--child-recover", tmpdir, *common],
+            capture_output=True, text=True
+        )
+        if recovered.returncode != 0:
+            raise RuntimeError(f"Recovery for {case} failed:\n{recovered.stderr.strip()}")
+        files = {name: os.path.getsize(os.path.join(tmpdir, name)) for name in os.listdir(tmpdir)}
+
+    result = {"case": case, "allocations": allocations, "bytes": sum(files.values())}
+    result.update(json.loads(recovered.stdout.strip().splitlines()[-1]))
+    return result
+
+def check_bounds():
+    """Check that values too large for the journal fail the request instead of raising"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        allocator = JournalAllocator(os.path.join(tmpdir, "bounds.journal"), fsync=False)
+        try:
+            _, _, pool_id = allocator.create_pool("bounds", "10.0.0.0/29")
+            success, message, _ = allocator.allocate_next_ip(pool_id, client_id="huge", lease_duration=2 ** 32)
+            if success:
+                raise RuntimeError("Allocation with a lease_duration of 2**32 succeeded")
+            if allocator.get_pool_utilization(pool_id)["allocated_ips"]:
+                raise RuntimeError(f"Failed allocation left an address allocated: {message}")
+            _, _, ip_address = allocator.allocate_next_ip(pool_id, client_id="renew")
+            allocation = allocator.find_allocation(pool_id, ip_address)
+            success, message = allocator.renew_lease(allocation["id"], extension_seconds=10 ** 12)
+            if success:
+                raise RuntimeError("Renewal by 10**12 seconds succeeded")
+            if allocator.get_allocation(allocation["id"])["renewal_count"]:
+                raise RuntimeError(f"Failed renewal was applied: {message}")
+        finally:
+            allocator.close()
+
+def print_tables(throughput: List[Dict], recovery: List[Dict]):
+    print(f"{'Engine':<10} {'Allocs':>7} {'Allocs/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'Failed':>7}")
+    print("-" * 56)
+    for result in throughput:
+        print(f"{result['engine']:<10} {result['allocations']:>7} {result['allocations_per_second']:>10.1f} "
+              f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['failures']:>7}")
+    print()
+    print(f"{'Recovery':<18} {'Allocs':>7} {'Seconds':>9} {'Replayed':>9} {'Bytes':>11}")
+    print("-" * 58)
+    for result in recovery:
+        print(f"{result['case']:<18} {result['allocations']:>7} {result['seconds']:>9.3f} "
+              f"{result.get('replayed', '-'):>9} {result['bytes']:>11}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the SQLite backend with the allocation journal')
+    parser.add_argument('--profile', default='tuned', help='SQLite profile')
+    parser.add_argument('--journal-fsync', action=argparse.BooleanOptionalAction, default=True,
+                        help='Sync the journal before acknowledging each change')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--allocations', type=int, default=250, help='Allocations per client')
+    parser.add_argument('--recovery-allocations', type=int, default=5000,
+                        help='Allocations written before the crash')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    # Internal: the writer and recovery processes
+    parser.add_argument('--child-load', help=argparse.SUPPRESS)
+    parser.add_argument('--child-recover', help=argparse.SUPPRESS)
+    parser.add_argument('--engine', choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument('--compact', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile not in SQLITE_PROFILES:
+        parser.error(f"Unknown profile '{args.profile}'")
+    if args.child_load:
+        child_load(args.engine, args.child_load, args.profile, args.journal_fsync,
+                   args.recovery_allocations, args.compact)
+        return
+    if args.child_recover:
+        child_recover(args.engine, args.child_recover, args.profile, args.journal_fsync)
+        return
+
+    check_bounds()
+    throughput = []
+    for engine in ENGINES:
+        print(f"Benchmarking {engine} throughput...", file=sys.stderr)
+        throughput.append(bench_throughput(engine, args.profile, args.journal_fsync, args.clients, args.allocations))
+    recovery = []
+    for case in RECOVERY_CASES:
+        print(f"Benchmarking {case} recovery...", file=sys.stderr)
+        recovery.append(bench_recovery(case, args.profile, args.journal_fsync, args.recovery_allocations))
+    print_tables(throughput, recovery)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "profile": args.profile,
+                "journal_fsync": args.journal_fsync,
+                "clients": args.clients,
+                "allocations": args.allocations,
+                "recovery_allocations": args.recovery_allocations
+            },
+            "throughput": throughput,
+            "recovery": recovery
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
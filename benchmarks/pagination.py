@@ -0,0 +1,157 @@
+"""
+Pagination benchmark
+
+Fills a scratch database with one pool of allocations, then times fetching
+one page at increasing depths of the two allocation lists the API serves:
+
+    all     GET /allocations/?active_only=false, in ID order
+    pool    GET /allocations/?pool_id=..., active ones in address order
+
+each by offset (skip) and by cursor, through the same helpers as the API.
+An offset page reads and throws away every row before it, so its time grows
+with the depth; a cursor page starts from an index range and should not.
+
+    python -m benchmarks.pagination
+    python -m benchmarks.pagination --rows 1000000 --page-size 1000 --output pages.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, IPPool, IPAllocation
+from database.sharding import page, seek
+from database.sqlite_profile import apply_sqlite_profile, sqlite_pragmas
+from .allocator_bench import summarize
+
+DEPTHS = (0.0, 0.25, 0.5, 0.75, 1.0)
+BATCH = 50000
+
+def fill(Session, rows: int) -> int:
+    """Create a /8 pool with rows active allocations, inserted in bulk"""
+    db = Session()
+    try:
+        pool = IPPool(name="bench", cidr="10.0.0.0/8")
+        db.add(pool)
+        db.commit()
+        first = int.from_bytes(bytes([10, 0, 0, 1]), "big")
+        for start in range(0, rows, BATCH):
+            batch = []
+            for n in range(start, min(rows, start + BATCH)):
+                ip_int = first + n
+                batch.append({
+                    "pool_id": pool.id,
+                    "ip_address": f"{ip_int >> 24}.{(ip_int >> 16) & 255}.{(ip_int >> 8) & 255}.{ip_int & 255}",
+                    "ip_int": ip_int,
+                    "is_active": True
+                })
+            db.execute(insert(IPAllocation.__table__), batch)
+        db.commit()
+        return pool.id
+    finally:
+        db.close()
+
+def bench_list(Session, name: str, pool_id: int, rows: int, page_size: int, repeat: int) -> List[Dict]:
+    """Time one page at each depth, by offset and by cursor"""
+    if name == "pool":
+        keys = [IPAllocation.ip_int, IPAllocation.id]
+    else:
+        keys = [IPAllocation.id]
+
+    def make_query(db):
+        query = db.query(IPAllocation)
+        if name == "pool":
+            query = query.filter(IPAllocation.pool_id == pool_id, IPAllocation.is_active == True)
+        return query
+
+    results = []
+    for depth in DEPTHS:
+        skip = min(int(rows * depth), max(0, rows - page_size))
+        db = Session()
+        try:
+            # The cursor a client walking the list would hold at this depth, not timed
+            after = None
+            if skip:
+                last = make_query(db).order_by(*keys).offset(skip - 1).limit(1).one()
+                after = [getattr(last, key.key) for key in keys]
+            timings = {"offset": [], "cursor": []}
+            for _ in range(repeat):
+                started = time.perf_counter()
+                by_offset = page(make_query(db).order_by(*keys), skip, page_size, keys[0])
+                timings["offset"].append(time.perf_counter() - started)
+                db.expunge_all()
+                started = time.perf_counter()
+                by_cursor = seek(make_query(db), keys, after, page_size)
+                timings["cursor"].append(time.perf_counter() - started)
+                db.expunge_all()
+            if [row.id for row in by_offset] != [row.id for row in by_cursor]:
+                raise RuntimeError(f"{name}: offset and cursor pages differ at {skip}")
+        finally:
+            db.close()
+        for mode, values in timings.items():
+            result = {"list": name, "mode": mode, "skip": skip}
+            result.update(summarize(values))
+            results.append(result)
+    return results
+
+def print_table(results: List[Dict]):
+    print(f"{'List':<6} {'Mode':<7} {'Skip':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    print("-" * 44)
+    for result in results:
+        print(f"{result['list']:<6} {result['mode']:<7} {result['skip']:>9} "
+              f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare offset and cursor pages at increasing depth')
+    parser.add_argument('--rows', type=int, default=200000, help='Allocations in the scratch pool')
+    parser.add_argument('--page-size', type=int, default=1000, help='Rows per page')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed fetches per page and mode')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    if args.rows < args.page_size:
+        parser.error("--rows must be at least --page-size")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+        apply_sqlite_profile(engine, sqlite_pragmas("tuned"))
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        try:
+            print(f"Inserting {args.rows} allocations...", file=sys.stderr)
+            pool_id = fill(Session, args.rows)
+            for name in ("all", "pool"):
+                print(f"Benchmarking {name} pages...", file=sys.stderr)
+                results.extend(bench_list(Session, name, pool_id, args.rows, args.page_size, args.repeat))
+        finally:
+            engine.dispose()
+    print_table(results)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "rows": args.rows,
+                "page_size": args.page_size,
+                "repeat": args.repeat
+            },
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
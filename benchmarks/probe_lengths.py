@@ -0,0 +1,106 @@
+"""
+Probe-length analysis for the hash allocation strategy
+
+Fills an in-memory pool index to the requested level and reports how many
+offsets the hash strategy has to probe to place new clients.
+
+    python -m benchmarks.probe_lengths --cidr 10.0.0.0/20 --fill 0.9
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+from typing import Dict, List
+
+from core.ip_allocator import HashStrategy
+from core.pool_index import PoolIndex
+
+def fill_index(index: PoolIndex, fill: float, mode: str, rng: random.Random):
+    """Allocate addresses until the index reaches the fill level"""
+    target = int(index.size * fill)
+    if mode == "hash":
+        client = 0
+        while index.allocated_count < target:
+            offset, _ = HashStrategy.probe(index, f"fill-{client}")
+            index.mark_allocated(index.address(offset))
+            client += 1
+    elif mode == "random":
+        for offset in rng.sample(range(index.size), target):
+            index.mark_allocated(index.address(offset))
+    else:
+        for offset in range(target):
+            index.mark_allocated(index.address(offset))
+
+def percentile(values: List[int], pct: float) -> int:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def analyze(cidr: str, fill: float, samples: int, mode: str, seed: int) -> Dict[str, object]:
+    """Measure the probe-length distribution for new clients at a fill level"""
+    rng = random.Random(seed)
+    index = PoolIndex(cidr)
+    fill_index(index, fill, mode, rng)
+
+    lengths = []
+    for n in range(samples):
+        offset, probes = HashStrategy.probe(index, f"probe-{seed}-{n}")
+        if offset is None:
+            break
+        lengths.append(probes)
+
+    buckets: Dict[int, int] = {}
+    for length in lengths:
+        bucket = 1
+        while bucket < length:
+            bucket *= 2
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    histogram = {f"<={bucket}": buckets[bucket] for bucket in sorted(buckets)}
+
+    return {
+        "cidr": cidr,
+        "pool_size": index.size,
+        "fill_mode": mode,
+        "fill_percent": round(index.allocated_count / index.size * 100, 2),
+        "samples": len(lengths),
+        "min": min(lengths) if lengths else None,
+        "mean": round(statistics.mean(lengths), 2) if lengths else None,
+        "p50": percentile(lengths, 50) if lengths else None,
+        "p90": percentile(lengths, 90) if lengths else None,
+        "p99": percentile(lengths, 99) if lengths else None,
+        "max": max(lengths) if lengths else None,
+        "histogram": histogram
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Hash strategy probe-length analysis')
+    parser.add_argument('--cidr', default='10.0.0.0/20', help='Pool CIDR to simulate')
+    parser.add_argument('--fill', type=float, default=0.9, help='Fill level between 0 and 1')
+    parser.add_argument('--samples', type=int, default=10000, help='Number of new clients to place')
+    parser.add_argument('--fill-mode', default='hash', choices=['hash', 'random', 'sequential'],
+                        help='How existing allocations are laid out')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--json', action='store_true', help='Print JSON only')
+    args = parser.parse_args()
+
+    if not 0 <= args.fill < 1:
+        parser.error('--fill must be in [0, 1)')
+
+    result = analyze(args.cidr, args.fill, args.samples, args.fill_mode, args.seed)
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"Pool {result['cidr']} ({result['pool_size']} hosts), "
+          f"{result['fill_percent']}% full ({result['fill_mode']} layout)")
+    print(f"Samples: {result['samples']}")
+    print(f"Probe length  min={result['min']} mean={result['mean']} p50={result['p50']} "
+          f"p90={result['p90']} p99={result['p99']} max={result['max']}")
+    print("-" * 40)
+    for bucket, count in result['histogram'].items():
+        print(f"{bucket:>10} {count:>8} {count / max(1, result['samples']) * 100:6.2f}%")
+
+if __name__ == "__main__":
+    main()
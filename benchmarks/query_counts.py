@@ -0,0 +1,323 @@
+"""
+SQL statement counts of the API routes
+
+Calls each database-backed route of api.main.app against two scratch
+databases, one seeded with a few rows and one with many, and counts the SQL
+statements each call issues. A route whose count grows with the number of
+rows loads a relationship once per row (an N+1 pattern) instead of with an
+eager loader.
+
+Every route of the app is either called or listed in EXEMPT with the reason
+it is not. Exits with status 1 if any route's statement count depends on the
+row count, or a route is neither called nor exempt, so it can gate CI.
+
+    python -m benchmarks.query_counts
+    python -m benchmarks.query_counts --small 5 --large 200 --verbose
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from core.archive import archive_released
+from core.forecast import forecaster
+from core.ip_allocator import IPAllocator
+from core.pool_index import invalidate_pool_index
+from database import get_db, get_read_db
+from database.models import Base, IPPool, IPAllocation, IPLease
+
+class Fixture:
+    """IDs of the seeded rows a route call needs"""
+
+    def __init__(self, pool_id: int, empty_pool_id: int, archived_pool_id: int, allocation_id: int, lease_id: int):
+        self.pool_id = pool_id
+        self.empty_pool_id = empty_pool_id
+        self.archived_pool_id = archived_pool_id
+        self.allocation_id = allocation_id
+        self.lease_id = lease_id
+
+# selectinload puts at most 500 parent keys in one IN list, so a page of more
+# rows adds a statement per relationship and 500 rows by design
+MAX_PAGE = 500
+
+def _page(rows: int) -> int:
+    """A page size holding every seeded row, up to MAX_PAGE"""
+    return min(rows + 10, MAX_PAGE)
+
+def call_create_pool(client: TestClient, fixture: Fixture, rows: int):
+    return client.post("/pools/", json={
+        "name": "created", "cidr": "10.90.0.0/24",
+        "reserved_ranges": [{"start": "10.90.0.1", "end": "10.90.0.9"}], "dns_servers": ["1.1.1.1"]
+    })
+
+def call_list_pools(client: TestClient, fixture: Fixture, rows: int):
+    return client.get("/pools/", params={"limit": _page(rows)})
+
+def call_get_pool(client: TestClient, fixture: Fixture, rows: int):
+    return client.get(f"/pools/{fixture.pool_id}")
+
+def call_update_pool(client: TestClient, fixture: Fixture, rows: int):
+    # Past the seeded allocations, which fill the pool from its start
+    return client.put(f"/pools/{fixture.pool_id}", json={
+        "description": "updated", "dns_servers": ["9.9.9.9"],
+        "reserved_ranges": [{"start": "10.70.15.200", "end": "10.70.15.210"}]
+    })
+
+def call_list_allocations(client: TestClient, fixture: Fixture, rows: int):
+    return client.get("/allocations/", params={"pool_id": fixture.pool_id, "limit": _page(rows)})
+
+def call_list_leases(client: TestClient, fixture: Fixture, rows: int):
+    return client.get("/leases/", params={"pool_id": fixture.pool_id, "limit": _page(rows)})
+
+def call_allocate(client: TestClient, fixture: Fixture, rows: int):
+    return client.post("/allocations/", json={
+        "pool_id": fixture.pool_id, "client_id": "count-check", "allocation_strategy": "first_fit"
+    })
+
+def call_reserve(client: TestClient, fixture: Fixture, rows: int):
+    return client.post("/reservations/", json={
+        "pool_id": fixture.pool_id, "ip_address": "10.70.15.100", "client_id": "count-check"
+    })
+
+def call_deallocate(client: TestClient, fixture: Fixture, rows: int):
+    return client.delete(f"/allocations/{fixture.allocation_id}")
+
+def call_renew(client: TestClient, fixture: Fixture, rows: int):
+    return client.post("/leases/renew", json={"lease_id": fixture.lease_id, "extension_seconds": 3600})
+
+def call_utilization(client: TestClient, fixture: Fixture, rows: int):
+    return client.get(f"/pools/{fixture.pool_id}/utilization")
+
+def call_fragmentation(client: TestClient, fixture: Fixture, rows: int):
+    return client.get(f"/pools/{fixture.pool_id}/fragmentation")
+
+def call_gaps(client: TestClient, fixture: Fixture, rows: int):
+    return client.get(f"/pools/{fixture.pool_id}/gaps", params={"limit": _page(rows)})
+
+def call_forecast(client: TestClient, fixture: Fixture, rows: int):
+    return client.get(f"/pools/{fixture.pool_id}/forecast")
+
+def call_reserved_ranges(client: TestClient, fixture: Fixture, rows: int):
+    # Across all pools; the first extra pool reserves .1 to .9
+    return client.get("/reserved-ranges/", params={"ip_address": "10.100.0.5"})
+
+def call_allocation_history(client: TestClient, fixture: Fixture, rows: int):
+    return client.get("/history/allocations", params={"pool_id": fixture.archived_pool_id, "limit": _page(rows)})
+
+def call_lease_history(client: TestClient, fixture: Fixture, rows: int):
+    return client.get("/history/leases", params={"pool_id": fixture.archived_pool_id, "limit": _page(rows)})
+
+def call_system_stats(client: TestClient, fixture: Fixture, rows: int):
+    return client.get("/stats/system")
+
+def call_delete_pool(client: TestClient, fixture: Fixture, rows: int):
+    # A pool whose allocations were all released, with their leases still there
+    return client.delete(f"/pools/{fixture.empty_pool_id}")
+
+# (name, call); each call gets a freshly seeded database
+ROUTES: List[Tuple[str, Callable]] = [
+    ("POST /pools/", call_create_pool),
+    ("GET /pools/", call_list_pools),
+    ("GET /pools/{id}", call_get_pool),
+    ("PUT /pools/{id}", call_update_pool),
+    ("GET /allocations/", call_list_allocations),
+    ("GET /leases/", call_list_leases),
+    ("POST /allocations/", call_allocate),
+    ("POST /reservations/", call_reserve),
+    ("DELETE /allocations/{id}", call_deallocate),
+    ("POST /leases/renew", call_renew),
+    ("GET /pools/{id}/utilization", call_utilization),
+    ("GET /pools/{id}/fragmentation", call_fragmentation),
+    ("GET /pools/{id}/gaps", call_gaps),
+    ("GET /pools/{id}/forecast", call_forecast),
+    ("GET /reserved-ranges/", call_reserved_ranges),
+    ("GET /history/allocations", call_allocation_history),
+    ("GET /history/leases", call_lease_history),
+    ("GET /stats/system", call_system_stats),
+    ("DELETE /pools/{id}", call_delete_pool)
+]
+
+# Routes not called, and why
+EXEMPT: Dict[str, str] = {
+    "POST /leases/cleanup": "runs the lease cleanup, checked on its own below",
+    "POST /history/archive": "moves released rows in chunks, one batch of statements per chunk",
+    "GET /stats/forecast": "forecasts every pool, building each pool's index and rates on first use",
+    "GET /export/{kind}": "streams a table in pages, one statement per page",
+    "POST /import/{kind}": "inserts the uploaded rows in chunks, one batch of statements per chunk",
+    "GET /metrics": "pool gauges come from the cached pool indexes and counters, not the database",
+    "GET /stats/instrumentation": "no database",
+    "GET /interfaces/": "no database",
+    "POST /interfaces/bind": "no database, changes host interfaces",
+    "POST /interfaces/unbind": "no database, changes host interfaces",
+    "POST /connectivity/test": "no database, sends packets",
+    "GET /connectivity/ping/{ip_address}": "no database, sends packets",
+    "GET /health": "one fixed statement",
+    "GET /": "no database"
+}
+
+def _route_name(route: APIRoute) -> List[str]:
+    path = route.path.replace("{pool_id}", "{id}").replace("{allocation_id}", "{id}")
+    return [f"{method} {path}" for method in sorted(route.methods)]
+
+def unchecked_routes(app) -> List[str]:
+    """Get the routes of the app that are neither called nor exempt"""
+    known = {name for name, _ in ROUTES} | set(EXEMPT)
+    names = [name for route in app.routes if isinstance(route, APIRoute) for name in _route_name(route)]
+    return [name for name in names if name not in known]
+
+def seed(Session, rows: int) -> Fixture:
+    """
+    Create rows pools with reserved ranges and DNS servers, one pool with
+    rows leased allocations of which half are expired, one pool whose rows
+    allocations were all released, and one whose rows allocations were
+    released and archived
+    """
+    db = Session()
+    try:
+        for n in range(rows):
+            db.add(IPPool(
+                name=f"extra-{n}", cidr=f"10.{100 + n // 256}.{n % 256}.0/24",
+                reserved_ranges=[{"start": f"10.{100 + n // 256}.{n % 256}.1", "end": f"10.{100 + n // 256}.{n % 256}.9"}],
+                dns_servers=["1.1.1.1", "8.8.8.8"]
+            ))
+        pool = IPPool(name="counted", cidr="10.70.0.0/20", reserved_ranges=[{"start": "10.70.0.1", "end": "10.70.0.9"}])
+        empty = IPPool(name="released", cidr="10.80.0.0/20")
+        archived = IPPool(name="archived", cidr="10.85.0.0/20")
+        db.add_all([pool, empty, archived])
+        db.commit()
+
+        allocator = IPAllocator(db)
+        for n in range(rows):
+            allocator.allocate_next_ip(pool.id, client_id=f"active-{n}", strategy="first_fit", lease_duration=3600)
+            allocator.allocate_next_ip(empty.id, client_id=f"released-{n}", strategy="first_fit", lease_duration=3600)
+            allocator.allocate_next_ip(archived.id, client_id=f"archived-{n}", strategy="first_fit", lease_duration=3600)
+        for allocation in db.query(IPAllocation).filter(IPAllocation.pool_id.in_([empty.id, archived.id])).all():
+            allocator.deallocate_ip(allocation.id)
+        archive_released(db, 0, pool_id=archived.id)
+        for lease in db.query(IPLease).filter(IPLease.pool_id == pool.id).order_by(IPLease.id).limit(rows // 2).all():
+            lease.lease_end = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+
+        allocation = db.query(IPAllocation).filter(
+            IPAllocation.pool_id == pool.id, IPAllocation.is_active == True
+        ).order_by(IPAllocation.id.desc()).first()
+        return Fixture(pool.id, empty.id, archived.id, allocation.id, allocation.lease.id)
+    finally:
+        db.close()
+
+def _engine(path: str):
+    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+def _reset_caches():
+    # Every scratch database starts again at pool ID 1
+    invalidate_pool_index()
+    forecaster.forget()
+
+def count_statements(rows: int) -> Dict[str, int]:
+    """
+    Call every route, and the lease cleanup, on a database seeded with rows rows
+
+    The database is seeded once and copied for each call, so every call
+    starts from the same rows.
+
+    Returns: Statements issued per route
+    """
+    from api.main import app
+
+    counts: Dict[str, int] = {}
+    calls = ROUTES + [("lease cleanup", None)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        template = os.path.join(tmpdir, "seeded.db")
+        engine = _engine(template)
+        Base.metadata.create_all(bind=engine)
+        _reset_caches()
+        try:
+            fixture = seed(sessionmaker(autocommit=False, autoflush=False, bind=engine), rows)
+        finally:
+            engine.dispose()
+
+        for name, call in calls:
+            path = os.path.join(tmpdir, "counts.db")
+            shutil.copyfile(template, path)
+            engine = _engine(path)
+            Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            _reset_caches()
+
+            def override_get_db():
+                db = Session()
+                try:
+                    yield db
+                finally:
+                    db.close()
+
+            statements: List[str] = []
+
+            def _count(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            app.dependency_overrides[get_db] = override_get_db
+            app.dependency_overrides[get_read_db] = override_get_db
+            try:
+                event.listen(engine, "before_cursor_execute", _count)
+                if call is None:
+                    # Runs as a background task with its own session
+                    db = Session()
+                    try:
+                        IPAllocator(db).cleanup_expired_leases()
+                    finally:
+                        db.close()
+                else:
+                    with TestClient(app) as client:
+                        response = call(client, fixture, rows)
+                    if response.status_code >= 400:
+                        raise RuntimeError(f"{name} failed with {response.status_code}: {response.text}")
+                event.remove(engine, "before_cursor_execute", _count)
+            finally:
+                app.dependency_overrides.pop(get_db, None)
+                app.dependency_overrides.pop(get_read_db, None)
+                engine.dispose()
+                _reset_caches()
+                os.remove(path)
+            counts[name] = len(statements)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if a route issues more SQL statements for more rows')
+    parser.add_argument('--small', type=int, default=3, help='Rows to seed the small database with')
+    parser.add_argument('--large', type=int, default=1000, help='Rows to seed the large database with')
+    parser.add_argument('--verbose', action='store_true', help='Print every route, not only failing ones')
+    args = parser.parse_args()
+
+    # httpx logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    from api.main import app
+    unchecked = unchecked_routes(app)
+
+    small = count_statements(args.small)
+    large = count_statements(args.large)
+    failures = [name for name in small if large[name] != small[name]]
+
+    print(f"{'Route':<30} {args.small:>8} rows {args.large:>8} rows")
+    print("-" * 60)
+    for name in small:
+        if args.verbose or name in failures:
+            marker = "  grows" if name in failures else ""
+            print(f"{name:<30} {small[name]:>13} {large[name]:>13}{marker}")
+    print(f"{len(small)} routes checked, {len(failures)} issue more statements for more rows")
+    for name in unchecked:
+        print(f"{name} is neither called nor in EXEMPT")
+    sys.exit(1 if failures or unchecked else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Query plan check for the hot query shapes
+
+Runs the allocator's hot paths against a scratch SQLite database, captures
+every SELECT they issue and runs EXPLAIN QUERY PLAN on it. A statement whose
+plan walks a whole table or index (a SCAN step) is a regression: it only
+stays fast while the table is small. The planner runs without ANALYZE
+statistics, so it assumes large tables, as in production.
+
+Exits with status 1 if any hot statement scans, so it can gate CI.
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --verbose
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from core.archive import archive_released
+from core.forecast import forecaster
+from core.ip_allocator import IPAllocator
+from core.pool_index import PoolIndex, build_pool_index, invalidate_pool_index
+from core.snapshot import replay_logs
+from database.models import Base, IPPool, IPAllocation, IPLease, IPAllocationHistory, IPLeaseHistory
+from database.queries import ACTIVE_ALLOCATION_IDS_BY_ADDRESS
+from database.sharding import seek
+
+def _first_active(db: Session, pool_id: int) -> IPAllocation:
+    return db.query(IPAllocation).filter(
+        IPAllocation.pool_id == pool_id,
+        IPAllocation.is_active == True
+    ).order_by(IPAllocation.id).first()
+
+def path_build_index(db: Session, pool_id: int):
+    invalidate_pool_index(pool_id)
+    build_pool_index(db, db.get(IPPool, pool_id))
+
+def path_allocate(db: Session, pool_id: int):
+    IPAllocator(db).allocate_next_ip(pool_id, client_id="plan-check")
+
+def path_allocation_lookup(db: Session, pool_id: int):
+    # The lookup api/main.py does after allocating or reserving
+    allocation = _first_active(db, pool_id)
+    db.execute(
+        ACTIVE_ALLOCATION_IDS_BY_ADDRESS,
+        {"pool_id": pool_id, "ip_address": allocation.ip_address}
+    ).first()
+
+def path_deallocate(db: Session, pool_id: int):
+    IPAllocator(db).deallocate_ip(_first_active(db, pool_id).id)
+
+def path_renew(db: Session, pool_id: int):
+    lease_id = db.query(IPLease.id).filter(IPLease.pool_id == pool_id, IPLease.is_expired == False).limit(1).scalar()
+    IPAllocator(db).renew_lease(lease_id, 3600)
+
+def path_cleanup(db: Session, pool_id: int):
+    IPAllocator(db).cleanup_expired_leases()
+
+def path_utilization(db: Session, pool_id: int):
+    IPAllocator(db).get_pool_utilization(pool_id)
+
+def path_free_gaps(db: Session, pool_id: int):
+    IPAllocator(db).find_free_gaps(pool_id)
+
+def path_reserved_lookup(db: Session, pool_id: int):
+    allocator = IPAllocator(db)
+    allocator.find_reserved_ranges("10.40.0.5")
+    allocator.find_reserved_ranges("10.40.0.5", pool_id)
+
+def path_list_allocations(db: Session, pool_id: int):
+    # GET /allocations?pool_id=...&active_only=true, the first page and the one after its cursor
+    query = db.query(IPAllocation).filter(
+        IPAllocation.pool_id == pool_id,
+        IPAllocation.is_active == True
+    )
+    keys = [IPAllocation.ip_int, IPAllocation.id]
+    last = seek(query, keys, None, 2)[-1]
+    seek(query, keys, [last.ip_int, last.id], 100)
+
+def path_list_leases(db: Session, pool_id: int):
+    # GET /leases?pool_id=...&active_only=true, the first page and the one after its cursor
+    query = db.query(IPLease).filter(
+        IPLease.pool_id == pool_id,
+        IPLease.is_expired == False
+    )
+    last = seek(query, [IPLease.id], None, 2)[-1]
+    seek(query, [IPLease.id], [last.id], 100)
+
+def path_forecast_seed(db: Session, pool_id: int):
+    forecaster.forget(pool_id)
+    forecaster.rates(db, pool_id)
+
+def path_snapshot_replay(db: Session, pool_id: int):
+    # A private empty index, as a snapshot taken before any log entry would restore
+    replay_logs(db, {pool_id: PoolIndex(db.get(IPPool, pool_id).cidr, pool_id=pool_id)}, 0)
+
+def path_archive(db: Session, pool_id: int):
+    archive_released(db, 0, chunk_size=2)
+
+def path_history(db: Session, pool_id: int):
+    # GET /history/allocations?pool_id=... and /history/leases?allocation_id=...
+    entry = db.query(IPAllocationHistory).filter(
+        IPAllocationHistory.pool_id == pool_id
+    ).order_by(IPAllocationHistory.id.desc()).offset(0).limit(100).all()[0]
+    db.query(IPLeaseHistory).filter(
+        IPLeaseHistory.allocation_id == entry.allocation_id
+    ).order_by(IPLeaseHistory.id.desc()).offset(0).limit(100).all()
+
+HOT_PATHS: List[Tuple[str, Callable[[Session, int], None]]] = [
+    ("build_pool_index", path_build_index),
+    ("allocate_next_ip", path_allocate),
+    ("allocation_lookup", path_allocation_lookup),
+    ("deallocate_ip", path_deallocate),
+    ("renew_lease", path_renew),
+    ("cleanup_expired_leases", path_cleanup),
+    ("pool_utilization", path_utilization),
+    ("find_free_gaps", path_free_gaps),
+    ("reserved_lookup", path_reserved_lookup),
+    ("list_allocations", path_list_allocations),
+    ("list_leases", path_list_leases),
+    ("forecast_seed", path_forecast_seed),
+    ("snapshot_replay", path_snapshot_replay),
+    ("archive_released", path_archive),
+    ("history", path_history)
+]
+
+def seed(Session, allocations: int) -> int:
+    """Create a pool with active, released and expired allocations"""
+    db = Session()
+    try:
+        pool = IPPool(
+            name="plans", cidr="10.40.0.0/22", quarantine_seconds=300,
+            reserved_ranges=[{"start": "10.40.0.1", "end": "10.40.0.9"}]
+        )
+        db.add(pool)
+        db.commit()
+        allocator = IPAllocator(db)
+        for n in range(allocations):
+            allocator.allocate_next_ip(pool.id, client_id=f"seed-{n}", lease_duration=3600)
+        # Release a few so the quarantine and forecast read the log, and expire a few more
+        for allocation in db.query(IPAllocation).filter(IPAllocation.pool_id == pool.id).limit(5).all():
+            allocator.deallocate_ip(allocation.id)
+        for lease in db.query(IPLease).filter(IPLease.is_expired == False).limit(5).all():
+            lease.lease_end = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+        return pool.id
+    finally:
+        db.close()
+
+def is_scan(detail: str) -> bool:
+    """Whether a plan step walks a whole table, or a whole index of one
+
+    Scans of subqueries and constant rows are fine, they only walk rows an
+    earlier step has already narrowed down.
+    """
+    words = detail.split()
+    if len(words) < 2 or words[0] != "SCAN":
+        return False
+    # "SCAN TABLE name" before SQLite 3.36, "SCAN name" after
+    name = words[2] if words[1] == "TABLE" and len(words) > 2 else words[1]
+    return name in Base.metadata.tables
+
+def check(allocations: int = 50) -> List[Dict]:
+    """
+    Run every hot path and explain the SELECTs it issues
+
+    Returns: One entry per distinct statement with its plan and scan steps
+    """
+    results: List[Dict] = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmpdir, 'plans.db')}",
+            connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        invalidate_pool_index()
+        forecaster.forget()
+
+        captured: List[Tuple[str, object]] = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                captured.append((statement, parameters))
+
+        try:
+            pool_id = seed(Session, allocations)
+            for name, path in HOT_PATHS:
+                captured.clear()
+                db = Session()
+                try:
+                    path(db, pool_id)
+                finally:
+                    db.close()
+
+                seen = set()
+                raw = engine.raw_connection()
+                try:
+                    cursor = raw.cursor()
+                    for statement, parameters in captured:
+                        if statement in seen:
+                            continue
+                        seen.add(statement)
+                        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                        plan = [row[3] for row in cursor.fetchall()]
+                        results.append({
+                            "path": name,
+                            "statement": " ".join(statement.split()),
+                            "plan": plan,
+                            "scans": [step for step in plan if is_scan(step)]
+                        })
+                    cursor.close()
+                finally:
+                    raw.close()
+        finally:
+            engine.dispose()
+            invalidate_pool_index()
+            forecaster.forget()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if a hot query plan scans a table')
+    parser.add_argument('--allocations', type=int, default=50, help='Allocations to seed the scratch pool with')
+    parser.add_argument('--verbose', action='store_true', help='Print every plan, not only scans')
+    args = parser.parse_args()
+
+    results = check(args.allocations)
+    failures = [result for result in results if result["scans"]]
+    for result in results:
+        if not (args.verbose or result["scans"]):
+            continue
+        marker = "SCAN" if result["scans"] else "ok"
+        print(f"[{marker}] {result['path']}: {result['statement']}")
+        for step in result["plan"]:
+            print(f"        {step}")
+
+    paths = {result["path"] for result in results}
+    print(f"{len(results)} statements from {len(paths)} hot paths explained, {len(failures)} scanning")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Read routing benchmark
+
+Writer threads allocate addresses while reader threads page through the
+allocations and count them, the way dashboards poll the list and stats
+routes. Two setups are compared on the same small connection pool size:
+
+    shared  readers and writers take sessions from one pool, as before
+    split   readers take sessions from a pool of query_only connections of
+            their own, as get_read_db() does
+
+Reports allocations per second and writer latency, and reads per second.
+
+    python -m benchmarks.read_routing
+    python -m benchmarks.read_routing --writers 4 --readers 16 --connections 4 --output reads.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.ip_allocator import IPAllocator
+from core.pool_index import invalidate_pool_index
+from database.models import Base, IPPool, IPAllocation
+from database.sqlite_profile import SQLITE_PROFILES, apply_sqlite_profile, sqlite_pragmas
+from .allocator_bench import summarize
+
+MODES = ("shared", "split")
+
+def _engine(path: str, profile: str, connections: int, read_only: bool = False):
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False},
+        pool_size=connections,
+        max_overflow=0
+    )
+    pragmas = sqlite_pragmas(profile)
+    if read_only:
+        pragmas = {name: value for name, value in pragmas.items() if name != "journal_mode"}
+        pragmas["query_only"] = "ON"
+    apply_sqlite_profile(engine, pragmas)
+    return engine
+
+def bench_mode(mode: str, profile: str, writers: int, readers: int, connections: int,
+               allocations: int, page_size: int) -> Dict:
+    """Run writers and readers side by side against a fresh database"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bench.db")
+        engines = [_engine(path, profile, connections)]
+        Base.metadata.create_all(bind=engines[0])
+        if mode == "split":
+            engines.append(_engine(path, profile, connections, read_only=True))
+        WriteSession = sessionmaker(autocommit=False, autoflush=False, bind=engines[0])
+        ReadSession = sessionmaker(autocommit=False, autoflush=False, bind=engines[-1])
+        # Every scratch database starts again at pool ID 1
+        invalidate_pool_index()
+
+        try:
+            session = WriteSession()
+            pool = IPPool(name="bench", cidr="10.0.0.0/12")
+            session.add(pool)
+            session.commit()
+            pool_id = pool.id
+            session.close()
+
+            latencies: List[List[float]] = [[] for _ in range(writers)]
+            failures = [0] * writers
+            reads = [0] * readers
+            done = threading.Event()
+            start = threading.Barrier(writers + readers + 1)
+
+            def writer(number: int):
+                start.wait()
+                for n in range(allocations):
+                    session = WriteSession()
+                    try:
+                        started = time.perf_counter()
+                        success, _, _ = IPAllocator(session).allocate_next_ip(pool_id, client_id=f"w{number}-{n}")
+                        latencies[number].append(time.perf_counter() - started)
+                        if not success:
+                            failures[number] += 1
+                    finally:
+                        session.close()
+
+            def reader(number: int):
+                start.wait()
+                while not done.is_set():
+                    session = ReadSession()
+                    try:
+                        query = session.query(IPAllocation).filter(IPAllocation.pool_id == pool_id)
+                        query.count()
+                        query.order_by(IPAllocation.id.desc()).limit(page_size).all()
+                        reads[number] += 1
+                    finally:
+                        session.close()
+
+            writer_threads = [threading.Thread(target=writer, args=(n,), daemon=True) for n in range(writers)]
+            reader_threads = [threading.Thread(target=reader, args=(n,), daemon=True) for n in range(readers)]
+            for thread in writer_threads + reader_threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in writer_threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            done.set()
+            for thread in reader_threads:
+                thread.join()
+        finally:
+            for engine in engines:
+                engine.dispose()
+            invalidate_pool_index()
+
+    total = writers * allocations
+    result = {
+        "mode": mode,
+        "allocations": total,
+        "failures": sum(failures),
+        "seconds": round(elapsed, 3),
+        "allocations_per_second": round(total / elapsed, 1),
+        "reads_per_second": round(sum(reads) / elapsed, 1)
+    }
+    result.update(summarize([value for values in latencies for value in values]))
+    return result
+
+def print_table(results: List[Dict]):
+    print(f"{'Mode':<8} {'Allocs':>7} {'Allocs/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'Reads/s':>9} {'Failed':>7}")
+    print("-" * 64)
+    for result in results:
+        print(f"{result['mode']:<8} {result['allocations']:>7} {result['allocations_per_second']:>10.1f} "
+              f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['reads_per_second']:>9.1f} "
+              f"{result['failures']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare shared and separate connection pools for reads')
+    parser.add_argument('--profile', default='tuned', help='SQLite profile')
+    parser.add_argument('--writers', type=int, default=4, help='Concurrent allocating threads')
+    parser.add_argument('--readers', type=int, default=8, help='Concurrent reading threads')
+    parser.add_argument('--connections', type=int, default=4, help='Connections per pool')
+    parser.add_argument('--allocations', type=int, default=200, help='Allocations per writer')
+    parser.add_argument('--page-size', type=int, default=100, help='Allocations per page read')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    if args.profile not in SQLITE_PROFILES:
+        parser.error(f"Unknown profile '{args.profile}'")
+
+    results = []
+    for mode in MODES:
+        print(f"Benchmarking {mode} pool...", file=sys.stderr)
+        results.append(bench_mode(mode, args.profile, args.writers, args.readers, args.connections,
+                                  args.allocations, args.page_size))
+    print_table(results)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "profile": args.profile,
+                "writers": args.writers,
+                "readers": args.readers,
+                "connections": args.connections,
+                "allocations": args.allocations,
+                "page_size": args.page_size
+            },
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
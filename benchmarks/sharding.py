@@ -0,0 +1,155 @@
+"""
+Sharding benchmark
+
+Client threads allocate addresses from several pools at once, each client in
+its own pool, against scratch databases split over 1, 2, 4... SQLite files.
+With one file every commit waits for the same database lock; with more, the
+pools on different shards commit side by side. Reports allocations per
+second and caller latency for each number of shards.
+
+Commits that wait for the disk are where shards pay off, so the "default"
+profile, which fsyncs on every commit, is used unless another is given.
+
+    python -m benchmarks.sharding
+    python -m benchmarks.sharding --shards 1 2 4 8 --clients 16 --allocations 100 --output shards.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.ip_allocator import IPAllocator
+from core.pool_index import invalidate_pool_index
+from database.models import Base, IPPool
+from database.sharding import sharded_sessionmaker
+from database.sqlite_profile import SQLITE_PROFILES, apply_sqlite_profile, sqlite_pragmas
+from .allocator_bench import summarize
+
+def bench_shards(shards: int, profile: str, clients: int, allocations: int) -> Dict:
+    """Let every client allocate its addresses from its own pool in a fresh set of shards"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engines = []
+        for number in range(shards):
+            engine = create_engine(
+                f"sqlite:///{os.path.join(tmpdir, f'bench.shard{number}.db')}",
+                connect_args={"check_same_thread": False},
+                pool_size=clients + 2
+            )
+            apply_sqlite_profile(engine, sqlite_pragmas(profile))
+            Base.metadata.create_all(bind=engine)
+            engines.append(engine)
+        if shards == 1:
+            # What an unsharded server runs
+            Session = sessionmaker(autocommit=False, autoflush=False, bind=engines[0])
+        else:
+            Session = sharded_sessionmaker(engines, autoflush=False)
+        # Every scratch database starts again at pool ID 1
+        invalidate_pool_index()
+
+        try:
+            session = Session()
+            pools = [IPPool(name=f"bench-{n}", cidr=f"10.{n}.0.0/16") for n in range(clients)]
+            session.add_all(pools)
+            session.commit()
+            pool_ids = [pool.id for pool in pools]
+            session.close()
+
+            latencies: List[List[float]] = [[] for _ in range(clients)]
+            failures = [0] * clients
+            start = threading.Barrier(clients + 1)
+
+            def client(number: int):
+                session = Session()
+                allocator = IPAllocator(session)
+                start.wait()
+                try:
+                    for n in range(allocations):
+                        started = time.perf_counter()
+                        success, _, _ = allocator.allocate_next_ip(pool_ids[number], client_id=f"c{number}-{n}")
+                        latencies[number].append(time.perf_counter() - started)
+                        if not success:
+                            failures[number] += 1
+                finally:
+                    session.close()
+
+            threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(clients)]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            for engine in engines:
+                engine.dispose()
+            invalidate_pool_index()
+
+    total = clients * allocations
+    result = {
+        "shards": shards,
+        "allocations": total,
+        "failures": sum(failures),
+        "seconds": round(elapsed, 3),
+        "allocations_per_second": round(total / elapsed, 1)
+    }
+    result.update(summarize([value for values in latencies for value in values]))
+    return result
+
+def print_table(results: List[Dict]):
+    baseline = results[0]["allocations_per_second"]
+    print(f"{'Shards':>6} {'Allocs':>7} {'Allocs/s':>10} {'Speedup':>8} {'p50 ms':>9} {'p99 ms':>9} {'Failed':>7}")
+    print("-" * 62)
+    for result in results:
+        speedup = result["allocations_per_second"] / baseline if baseline else 0.0
+        print(f"{result['shards']:>6} {result['allocations']:>7} {result['allocations_per_second']:>10.1f} "
+              f"{speedup:>7.2f}x {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['failures']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure allocation throughput against the number of shards')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='Numbers of shards to compare')
+    parser.add_argument('--profile', default='default', help='SQLite profile')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent client threads, one pool each')
+    parser.add_argument('--allocations', type=int, default=100, help='Allocations per client')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    if args.profile not in SQLITE_PROFILES:
+        parser.error(f"Unknown profile '{args.profile}'")
+    if min(args.shards) < 1:
+        parser.error("Shard counts must be at least 1")
+
+    results = []
+    for shards in args.shards:
+        print(f"Benchmarking {shards} shard(s)...", file=sys.stderr)
+        results.append(bench_shards(shards, args.profile, args.clients, args.allocations))
+    print_table(results)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "profile": args.profile,
+                "clients": args.clients,
+                "allocations": args.allocations
+            },
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+SQLite connection profile benchmark
+
+Runs concurrent writer and reader threads against a scratch database once
+per SQLite profile and compares throughput, latency and lock errors.
+Writers allocate and release addresses through IPAllocator; readers run
+utilization and allocation list queries.
+
+    python -m benchmarks.sqlite_profile
+    python -m benchmarks.sqlite_profile --writers 8 --readers 8 --seconds 10 --output sqlite.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from core.ip_allocator import IPAllocator
+from core.pool_index import invalidate_pool_index
+from database.models import Base, IPPool, IPAllocation
+from database.sqlite_profile import SQLITE_PROFILES, apply_sqlite_profile, sqlite_pragmas
+from .allocator_bench import summarize
+
+class Worker(threading.Thread):
+    """Repeats one kind of operation until told to stop"""
+
+    def __init__(self, kind: str, Session, pool_id: int, stop: threading.Event, number: int):
+        super().__init__(daemon=True)
+        self.kind = kind
+        self.Session = Session
+        self.pool_id = pool_id
+        self.stop = stop
+        self.number = number
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+
+    def run(self):
+        session = self.Session()
+        allocator = IPAllocator(session)
+        n = 0
+        try:
+            while not self.stop.is_set():
+                n += 1
+                started = time.perf_counter()
+                try:
+                    if self.kind == "write":
+                        self.write(session, allocator, n)
+                    else:
+                        self.read(session, allocator)
+                except OperationalError as e:
+                    session.rollback()
+                    message = str(e.orig) if e.orig is not None else str(e)
+                    self.errors[message] = self.errors.get(message, 0) + 1
+                    continue
+                self.latencies.append(time.perf_counter() - started)
+        finally:
+            session.close()
+
+    def write(self, session, allocator: IPAllocator, n: int):
+        success, message, ip_address = allocator.allocate_next_ip(
+            self.pool_id, client_id=f"w{self.number}-{n}", lease_duration=3600
+        )
+        if not success:
+            # The allocator swallows database errors into its message
+            raise OperationalError("allocate", {}, Exception(message))
+        allocation_id = session.query(IPAllocation.id).filter(
+            IPAllocation.pool_id == self.pool_id,
+            IPAllocation.ip_address == ip_address,
+            IPAllocation.is_active == True
+        ).scalar()
+        success, message = allocator.deallocate_ip(allocation_id)
+        if not success:
+            raise OperationalError("deallocate", {}, Exception(message))
+
+    def read(self, session, allocator: IPAllocator):
+        allocator.get_pool_utilization(self.pool_id)
+        session.query(IPAllocation).filter(IPAllocation.pool_id == self.pool_id).limit(100).all()
+        # End the read transaction so WAL checkpoints are not held back
+        session.commit()
+
+def bench_profile(profile: str, writers: int, readers: int, seconds: float) -> Dict:
+    """Run the workload against a fresh database using one profile"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmpdir, 'bench.db')}",
+            connect_args={"check_same_thread": False},
+            pool_size=writers + readers + 1
+        )
+        pragmas = sqlite_pragmas(profile)
+        apply_sqlite_profile(engine, pragmas)
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Every scratch database starts again at pool ID 1
+        invalidate_pool_index()
+
+        try:
+            session = Session()
+            pool = IPPool(name="bench", cidr="10.0.0.0/16")
+            session.add(pool)
+            session.commit()
+            pool_id = pool.id
+            session.close()
+
+            stop = threading.Event()
+            workers = [Worker("write", Session, pool_id, stop, n) for n in range(writers)]
+            workers += [Worker("read", Session, pool_id, stop, n) for n in range(readers)]
+            for worker in workers:
+                worker.start()
+            time.sleep(seconds)
+            stop.set()
+            for worker in workers:
+                worker.join()
+        finally:
+            engine.dispose()
+            invalidate_pool_index()
+
+    result = {"profile": profile, "pragmas": pragmas}
+    for kind in ("write", "read"):
+        group = [worker for worker in workers if worker.kind == kind]
+        latencies = [value for worker in group for value in worker.latencies]
+        errors: Dict[str, int] = {}
+        for worker in group:
+            for message, count in worker.errors.items():
+                errors[message] = errors.get(message, 0) + count
+        entry = {"ops": len(latencies), "ops_per_second": round(len(latencies) / seconds, 1), "errors": errors}
+        if latencies:
+            entry.update(summarize(latencies))
+        result[kind] = entry
+    return result
+
+def print_table(results: List[Dict]):
+    print(f"{'Profile':<10} {'Kind':<6} {'Ops':>7} {'Ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'Errors':>7}")
+    print("-" * 64)
+    for result in results:
+        for kind in ("write", "read"):
+            entry = result[kind]
+            print(f"{result['profile']:<10} {kind:<6} {entry['ops']:>7} {entry['ops_per_second']:>9.1f} "
+                  f"{entry.get('p50_ms', 0):>9.3f} {entry.get('p99_ms', 0):>9.3f} {sum(entry['errors'].values()):>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare SQLite connection profiles under concurrent load')
+    parser.add_argument('--profiles', nargs='+', default=list(SQLITE_PROFILES), help='Profiles to compare')
+    parser.add_argument('--writers', type=int, default=4, help='Writer threads')
+    parser.add_argument('--readers', type=int, default=4, help='Reader threads')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Duration per profile')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        if profile not in SQLITE_PROFILES:
+            parser.error(f"Unknown profile '{profile}'")
+
+    results = []
+    for profile in args.profiles:
+        print(f"Benchmarking profile '{profile}'...", file=sys.stderr)
+        results.append(bench_profile(profile, args.writers, args.readers, args.seconds))
+
+    print_table(results)
+    for result in results:
+        for kind in ("write", "read"):
+            for message, count in result[kind]["errors"].items():
+                print(f"  {result['profile']} {kind}: {count} x {message}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "writers": args.writers,
+            "readers": args.readers,
+            "seconds": args.seconds
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Startup time of the entry points
+
+Starts each entry point in a fresh interpreter, in an empty scratch working
+directory, and reports wall-clock time and any files it left behind. Importing
+an entry point must not touch the database, so the import cases should leave
+the directory empty; the "ready" cases also initialize the database, once
+against a new file and once against one whose schema is already current.
+
+    python -m benchmarks.startup_time
+    python -m benchmarks.startup_time --repeat 10 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, arguments after the interpreter, needs tkinter, database file to start from)
+CASES = [
+    ("api_server import", ["-c", "import api_server; import api.main"], False, None),
+    ("api_server ready, new db", ["-c", "import api_server; import api.main; "
+                                        "from database import init_database; init_database()"], False, None),
+    ("api_server ready, existing db", ["-c", "import api_server; import api.main; "
+                                             "from database import init_database; init_database()"], False, "current"),
+    ("cli_main --help", [os.path.join(ROOT, "cli_main.py"), "--help"], False, None),
+    ("gui_main import", ["-c", "import gui_main; import gui.main_window"], True, None),
+    ("start_gui_simple import", ["-c", "import start_gui_simple; import gui.main_window"], True, None)
+]
+
+def has_tkinter() -> bool:
+    try:
+        import tkinter
+        return True
+    except ImportError:
+        return False
+
+def prepare_database(workdir: str, env: Dict[str, str]):
+    """Create a database with a current schema in the working directory"""
+    subprocess.run(
+        [sys.executable, "-c", "from database import init_database; init_database()"],
+        cwd=workdir, env=env, check=True, capture_output=True
+    )
+
+def run_case(args: List[str], start_from: Optional[str], env: Dict[str, str]) -> Dict:
+    """Start one entry point once"""
+    with tempfile.TemporaryDirectory() as workdir:
+        if start_from == "current":
+            prepare_database(workdir, env)
+        before = set(os.listdir(workdir))
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable] + args, cwd=workdir, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        created = sorted(set(os.listdir(workdir)) - before)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{result.stderr.strip()}")
+    return {"seconds": elapsed, "created": created}
+
+def bench(repeat: int) -> List[Dict]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    # Relative to the scratch directory, whatever the caller configured
+    env["BLACKZ_DATABASE_URL"] = "sqlite:///./blackz_allocator.db"
+    env.pop("BLACKZ_CONFIG", None)
+
+    tk_available = has_tkinter()
+    results = []
+    for name, args, needs_tk, start_from in CASES:
+        if needs_tk and not tk_available:
+            results.append({"case": name, "skipped": "tkinter not available"})
+            continue
+        print(f"Timing {name}...", file=sys.stderr)
+        runs = [run_case(args, start_from, env) for _ in range(repeat)]
+        seconds = [run["seconds"] for run in runs]
+        results.append({
+            "case": name,
+            "runs": repeat,
+            "mean_ms": round(statistics.mean(seconds) * 1000, 1),
+            "min_ms": round(min(seconds) * 1000, 1),
+            "max_ms": round(max(seconds) * 1000, 1),
+            "created": sorted({path for run in runs for path in run["created"]})
+        })
+    return results
+
+def print_table(results: List[Dict]):
+    print(f"{'Case':<32} {'Mean ms':>9} {'Min ms':>9} {'Max ms':>9}  Files created")
+    print("-" * 80)
+    for result in results:
+        if "skipped" in result:
+            print(f"{result['case']:<32} skipped: {result['skipped']}")
+            continue
+        created = ", ".join(result["created"]) or "-"
+        print(f"{result['case']:<32} {result['mean_ms']:>9.1f} {result['min_ms']:>9.1f} {result['max_ms']:>9.1f}  {created}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the startup of the API server, CLI and GUIs')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per case')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    results = bench(args.repeat)
+    print_table(results)
+
+    # Only initializing the database may create files
+    stray = [result["case"] for result in results if "ready" not in result["case"] and result.get("created")]
+    if stray:
+        print(f"\nFiles created without initializing the database by: {', '.join(stray)}")
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat
+            },
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    sys.exit(1 if stray else 0)
+
+if __name__ == "__main__":
+    main()
@@ -44,6 +44,14 @@ class BlackzAllocatorCLI:
             print("Make sure the API server is running (python api_server.py)")
             return None
     
+    def api_running(self):
+        """Whether the API server answers at the configured URL"""
+        try:
+            requests.get(f"{self.api_base}/health", timeout=2)
+            return True
+        except requests.exceptions.RequestException:
+            return False
+    
     def list_pools(self):
         """List all IP pools"""
         pools = self.api_request('GET', '/pools/')
@@ -171,10 +179,83 @@ class BlackzAllocatorCLI:
             print(f"Ping test to {ip_address}: {status}")
         else:
             print(f"Failed to test connectivity to {ip_address}")
+    
+    def import_file(self, path, kind, fmt=None, chunk_size=5000, checkpoint=None, restart=False):
+        """Bulk import pools or allocations straight into the local database"""
+        from database import get_db_session
+        from core.bulk_import import import_file
+        
+        checkpoint = checkpoint or f"{path}.checkpoint"
+        db = get_db_session()
+        try:
+            summary = import_file(
+                db, path, kind,
+                fmt=fmt,
+                chunk_size=chunk_size,
+                checkpoint_path=checkpoint,
+                resume=not restart
+            )
+        finally:
+            db.close()
+        
+        print(f"✓ Imported {summary['imported']} {kind} in {summary['chunks']} chunks, "
+              f"rejected {summary['rejected']}")
+        for error in summary['errors']:
+            print(f"  ✗ {error}")
+        print(f"Progress saved to {checkpoint}")
+    
+    def create_snapshot(self, path):
+        """Write a pool index snapshot straight from the local database"""
+        from database import get_db_session
+        from core.snapshot import create_snapshot
+        
+        db = get_db_session()
+        try:
+            result = create_snapshot(db, path)
+            print(f"✓ Wrote snapshot {result['path']}: {result['pools']} pools, "
+                  f"LSN {result['lsn']}, {result['bytes']} bytes in {result['seconds']}s")
+        finally:
+            db.close()
+    
+    def verify_snapshot(self, path):
+        """Check a pool index snapshot against the local database"""
+        from database import get_db_session
+        from core.snapshot import SnapshotError, verify_snapshot
+        
+        db = get_db_session()
+        try:
+            report = verify_snapshot(db, path)
+        except SnapshotError as e:
+            print(f"✗ Invalid snapshot {path}: {e}")
+            return False
+        finally:
+            db.close()
+        
+        print(f"Snapshot {report['path']} (LSN {report['lsn']}, created {report['created_at']})")
+        print(f"Pools: {report['pools']}, log entries replayed: {report['replayed']}")
+        for error in report['errors']:
+            print(f"  ✗ {error}")
+        print("✓ Snapshot matches the database" if report['ok'] else "✗ Snapshot does not match the database")
+        return report['ok']
+    
+    def archive(self, older_than, pool_id=None, chunk_size=1000):
+        """Move long-released allocations and their leases to the history tables of the local database"""
+        from database import get_db_session
+        from core.archive import archive_released
+        
+        db = get_db_session()
+        try:
+            summary = archive_released(db, older_than, chunk_size, pool_id)
+        finally:
+            db.close()
+        
+        print(f"✓ Archived {summary['allocations']} allocations and {summary['leases']} leases "
+              f"in {summary['chunks']} chunks")
 
 def main():
     parser = argparse.ArgumentParser(description='BlackzAllocator CLI')
-    parser.add_argument('--api-url', default='http://localhost:8000', help='API server URL')
+    parser.add_argument('--api-url', help='API server URL (default: from settings)')
+    parser.add_argument('--config', help='Config file (JSON or INI), overrides BLACKZ_CONFIG')
     
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
     
@@ -204,7 +285,7 @@ def main():
     allocate_parser.add_argument('pool_id', type=int, help='Pool ID')
     allocate_parser.add_argument('--client-id', help='Client identifier')
     allocate_parser.add_argument('--strategy', default='first_fit', 
-                                choices=['first_fit', 'random', 'sequential', 'load_balanced'],
+                                choices=['first_fit', 'random', 'sequential', 'load_balanced', 'hash'],
                                 help='Allocation strategy')
     
     reserve_parser = alloc_subparsers.add_parser('reserve', help='Reserve specific IP')
@@ -221,13 +302,52 @@ def main():
     ping_parser = subparsers.add_parser('ping', help='Test connectivity')
     ping_parser.add_argument('ip_address', help='IP address to ping')
     
+    # Bulk import, run against the local database
+    import_parser = subparsers.add_parser('import', help='Bulk import from CSV or JSONL')
+    import_parser.add_argument('kind', choices=['pools', 'allocations'], help='What the file contains')
+    import_parser.add_argument('path', help='CSV or JSONL file')
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format (default: from extension)')
+    import_parser.add_argument('--chunk-size', type=int, default=5000, help='Records per transaction')
+    import_parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint)')
+    import_parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+    
+    # Snapshot commands, run against the local database
+    snapshot_parser = subparsers.add_parser('snapshot', help='Pool index snapshots')
+    snapshot_subparsers = snapshot_parser.add_subparsers(dest='snapshot_action')
+    
+    for action, help_text in [('create', 'Create snapshot'), ('verify', 'Verify snapshot against the database')]:
+        action_parser = snapshot_subparsers.add_parser(action, help=help_text)
+        action_parser.add_argument('--path', help='Snapshot file (default: snapshot_path setting)')
+    
+    # Archiving, run against the local database
+    archive_parser = subparsers.add_parser('archive', help='Move long-released allocations to the history tables')
+    archive_parser.add_argument('--older-than', type=int,
+                                help='Seconds since release (default: archive_after_seconds setting)')
+    archive_parser.add_argument('--pool-id', type=int, help='Only archive this pool')
+    archive_parser.add_argument('--chunk-size', type=int, default=1000, help='Allocations per transaction')
+    
     args = parser.parse_args()
     
     if not args.command:
         parser.print_help()
         return
     
-    cli = BlackzAllocatorCLI(args.api_url)
+    # Settings are read on first use, so the config path must be set before that
+    if args.config:
+        os.environ['BLACKZ_CONFIG'] = args.config
+    try:
+        from database.settings import get_settings
+        settings = get_settings()
+    except ValueError as e:
+        print(f"Configuration error: {e}")
+        sys.exit(2)
+    
+    cli = BlackzAllocatorCLI(args.api_url or settings.api_url)
+    
+    # The server keeps pool state in memory, so sharded files take direct writes only while it is down
+    if args.command in ('import', 'archive') and settings.shards > 1 and cli.api_running():
+        print(f"Error: '{args.command}' writes to the shards directly, stop the API server at {cli.api_base} first")
+        sys.exit(2)
     
     try:
         if args.command == 'pools':
@@ -253,6 +373,23 @@ def main():
         
         elif args.command == 'ping':
             cli.ping_test(args.ip_address)
+        
+        elif args.command == 'import':
+            cli.import_file(args.path, args.kind, args.format, args.chunk_size, args.checkpoint, args.restart)
+        
+        elif args.command == 'snapshot':
+            if not args.path:
+                from core.snapshot import DEFAULT_SNAPSHOT_PATH
+                args.path = settings.snapshot_path or DEFAULT_SNAPSHOT_PATH
+            if args.snapshot_action == 'create':
+                cli.create_snapshot(args.path)
+            elif args.snapshot_action == 'verify':
+                if not cli.verify_snapshot(args.path):
+                    sys.exit(1)
+        
+        elif args.command == 'archive':
+            older_than = args.older_than if args.older_than is not None else settings.archive_after_seconds
+            cli.archive(older_than, args.pool_id, args.chunk_size)
     
     except KeyboardInterrupt:
         print("\nOperation cancelled by user")
@@ -1,4 +1,6 @@
-from .ip_allocator import IPAllocator, AllocationStrategy, FirstFitStrategy, RandomStrategy, SequentialStrategy, LoadBalancedStrategy
+from .ip_allocator import IPAllocator, AllocationStrategy, FirstFitStrategy, RandomStrategy, SequentialStrategy, LoadBalancedStrategy, HashStrategy
+from .instrumentation import instrumentation, Histogram
+from .pool_index import PoolIndex, get_pool_index, invalidate_pool_index
 
 __all__ = [
     'IPAllocator',
@@ -6,5 +8,11 @@ __all__ = [
     'FirstFitStrategy',
     'RandomStrategy',
     'SequentialStrategy', 
-    'LoadBalancedStrategy'
+    'LoadBalancedStrategy',
+    'HashStrategy',
+    'PoolIndex',
+    'get_pool_index',
+    'invalidate_pool_index',
+    'instrumentation',
+    'Histogram'
 ] 
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Archiving of released allocations and their leases
+
+Deallocated and expired allocations stay in ip_allocations with is_active
+cleared, and their leases in ip_leases with is_expired set, so every live
+query wades through more dead rows as time goes by. The archiver moves
+allocations released longer ago than a threshold, together with their
+leases, into ip_allocations_history and ip_leases_history.
+
+Rows are moved in chunks, each in its own transaction: INSERT ... SELECT into
+the history table, then DELETE from the live one. An interrupted run leaves
+every row either live or archived, never both, and the next run carries on.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, insert, literal, select
+from sqlalchemy.orm import Session
+
+from database.models import IPAllocation, IPLease, IPAllocationHistory, IPLeaseHistory
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# History column <- live column
+_ALLOCATION_COLUMNS = [
+    ("allocation_id", IPAllocation.id),
+    ("pool_id", IPAllocation.pool_id),
+    ("ip_address", IPAllocation.ip_address),
+    ("ip_int", IPAllocation.ip_int),
+    ("client_id", IPAllocation.client_id),
+    ("client_name", IPAllocation.client_name),
+    ("allocation_type", IPAllocation.allocation_type),
+    ("allocation_strategy", IPAllocation.allocation_strategy),
+    ("assigned_at", IPAllocation.assigned_at),
+    ("last_seen", IPAllocation.last_seen),
+    ("released_at", IPAllocation.released_at),
+    ("network_interface", IPAllocation.network_interface),
+    ("binding_status", IPAllocation.binding_status)
+]
+_LEASE_COLUMNS = [
+    ("lease_id", IPLease.id),
+    ("pool_id", IPLease.pool_id),
+    ("allocation_id", IPLease.allocation_id),
+    ("lease_start", IPLease.lease_start),
+    ("lease_duration", IPLease.lease_duration),
+    ("lease_end", IPLease.lease_end),
+    ("renewal_count", IPLease.renewal_count),
+    ("max_renewals", IPLease.max_renewals),
+    ("auto_renew", IPLease.auto_renew)
+]
+
+def _copy(history, columns, where, archived_at: datetime):
+    names = [name for name, _ in columns] + ["archived_at"]
+    query = select(*[column for _, column in columns], literal(archived_at)).where(where)
+    return insert(history).from_select(names, query)
+
+def archive_released(
+    db: Session,
+    older_than_seconds: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pool_id: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Move allocations released more than older_than_seconds ago, and their
+    leases, to the history tables
+
+    Returns: Counts of archived allocations, leases and chunks
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+    due = select(IPAllocation.id).where(
+        IPAllocation.is_active == False,
+        IPAllocation.released_at < cutoff
+    )
+    if pool_id is not None:
+        due = due.where(IPAllocation.pool_id == pool_id)
+    due = due.order_by(IPAllocation.released_at).limit(chunk_size)
+
+    summary = {"allocations": 0, "leases": 0, "chunks": 0}
+    while True:
+        allocation_ids: List[int] = db.execute(due).scalars().all()
+        if not allocation_ids:
+            break
+        archived_at = datetime.utcnow()
+        try:
+            db.execute(_copy(
+                IPLeaseHistory, _LEASE_COLUMNS,
+                IPLease.allocation_id.in_(allocation_ids), archived_at
+            ))
+            db.execute(_copy(
+                IPAllocationHistory, _ALLOCATION_COLUMNS,
+                IPAllocation.id.in_(allocation_ids), archived_at
+            ))
+            leases = db.execute(
+                delete(IPLease).where(IPLease.allocation_id.in_(allocation_ids)),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+            allocations = db.execute(
+                delete(IPAllocation).where(IPAllocation.id.in_(allocation_ids)),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        summary["allocations"] += allocations
+        summary["leases"] += leases
+        summary["chunks"] += 1
+        metrics.archived_rows_total.inc(allocations, table="ip_allocations")
+        metrics.archived_rows_total.inc(leases, table="ip_leases")
+
+    if summary["chunks"]:
+        logger.info(
+            f"Archived {summary['allocations']} allocations and {summary['leases']} leases "
+            f"in {summary['chunks']} chunks"
+        )
+    return summary
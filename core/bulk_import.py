@@ -0,0 +1,563 @@
+"""
+Streaming bulk import of pools and allocations
+
+Records are read lazily from CSV (with a header row) or JSONL, validated and
+inserted in chunks, each chunk in one transaction with multi-row INSERT
+statements. Memory use depends on the chunk size and the pools involved,
+never on the length of the input.
+
+Allocation records take these fields:
+
+    pool_id or pool      pool ID or pool name
+    ip_address           address inside the pool
+    client_id            optional
+    client_name          optional
+    allocation_type      optional, defaults to "static"
+    lease_duration       optional, seconds; no lease is created when empty or 0
+    assigned_at          optional ISO timestamp
+
+Pool records take name, cidr, description, gateway, dns_servers,
+reserved_ranges and quarantine_seconds. In CSV, dns_servers is a list
+separated by semicolons and reserved_ranges a list of start-end ranges
+separated by semicolons.
+
+After each committed chunk the byte offset reached in the input can be
+written to a checkpoint file, from which an interrupted import resumes.
+"""
+
+import codecs
+import csv
+import ipaddress
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database.sharding import assign_ids, group_rows
+from database.models import IPPool, IPAllocation, IPLease, AllocationLog, PoolReservedRange, PoolDNSServer
+from . import metrics
+from .forecast import forecaster
+from .pool_index import PoolIndex, FREE, QUARANTINED, get_pool_index, invalidate_pool_index
+
+logger = logging.getLogger(__name__)
+
+IMPORT_KINDS = ("allocations", "pools")
+IMPORT_FORMATS = ("csv", "jsonl")
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+class BulkImportError(Exception):
+    """Raised for problems with the import as a whole rather than a single record"""
+
+def _blank(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def _text(value) -> Optional[str]:
+    return None if _blank(value) else str(value).strip()
+
+def _int(value, field: str) -> Optional[int]:
+    if _blank(value):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+
+def _address(value, field: str) -> str:
+    try:
+        return str(ipaddress.IPv4Address(str(value).strip()))
+    except (ipaddress.AddressValueError, ValueError):
+        raise ValueError(f"Invalid {field}: {value}")
+
+class BulkImporter:
+    """
+    Validates records and writes them in chunked bulk inserts
+
+    Drive it with feed() per record and finish() at the end, or run() over
+    an iterable of (record, end_offset) pairs. Addresses are checked with
+    integer math against the cached pool index, which also catches
+    duplicates within the input since every accepted address is held there.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        kind: str = "allocations",
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        checkpoint_path: Optional[str] = None,
+        source: Optional[str] = None,
+        start_offset: int = 0,
+        start_line: int = 0
+    ):
+        if kind not in IMPORT_KINDS:
+            raise BulkImportError(f"Unknown import kind '{kind}'")
+        self.db = db
+        self.kind = kind
+        self.chunk_size = max(1, chunk_size)
+        self.checkpoint_path = checkpoint_path
+        self.source = source
+        self.pending: List[Dict] = []
+        self.pools_by_name: Dict[str, IPPool] = {}
+        self.pools_by_id: Dict[int, IPPool] = {}
+        self.indexes: Dict[int, PoolIndex] = {}
+        self.now = datetime.utcnow()
+
+        self.line = start_line
+        self.offset = start_offset
+        self.committed_offset = start_offset
+        self.committed_line = start_line
+        self.imported = 0
+        self.rejected = 0
+        self.chunks = 0
+        self.errors: List[str] = []
+
+        for pool in db.query(IPPool).all():
+            self.pools_by_name[pool.name] = pool
+            self.pools_by_id[pool.id] = pool
+
+    def reject(self, message: str):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"line {self.line}: {message}")
+
+    def skip(self, end_offset: Optional[int] = None, error: Optional[str] = None):
+        """Account for an input line that holds no record, e.g. a header or an unparsable line"""
+        self.line += 1
+        if end_offset is not None:
+            self.offset = end_offset
+        if error:
+            self.reject(error)
+
+    def feed(self, record: Dict, end_offset: Optional[int] = None):
+        """Validate one record and queue it, writing a chunk when enough are queued"""
+        self.skip(end_offset)
+        try:
+            if self.kind == "pools":
+                row = self._pool_row(record)
+            else:
+                row = self._allocation_row(record)
+        except ValueError as e:
+            self.reject(str(e))
+        else:
+            self.pending.append(row)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def finish(self) -> Dict[str, object]:
+        """Write the last partial chunk and get the import summary"""
+        self.flush()
+        return self.summary()
+
+    def run(self, records: Iterable[Tuple[Dict, int]]) -> Dict[str, object]:
+        for record, end_offset in records:
+            self.feed(record, end_offset)
+        return self.finish()
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "kind": self.kind,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "chunks": self.chunks,
+            "lines": self.committed_line,
+            "committed_bytes": self.committed_offset,
+            "errors": self.errors
+        }
+
+    def _pool_index(self, pool: IPPool) -> PoolIndex:
+        index = self.indexes.get(pool.id)
+        if index is None:
+            index = self.indexes[pool.id] = get_pool_index(self.db, pool)
+        return index
+
+    def _allocation_row(self, record: Dict) -> Dict:
+        if not _blank(record.get("pool_id")):
+            pool = self.pools_by_id.get(_int(record["pool_id"], "pool_id"))
+        elif not _blank(record.get("pool")):
+            pool = self.pools_by_name.get(str(record["pool"]).strip())
+        else:
+            raise ValueError("pool_id or pool is required")
+        if pool is None:
+            raise ValueError(f"Unknown pool {record.get('pool_id') or record.get('pool')}")
+        if _blank(record.get("ip_address")):
+            raise ValueError("ip_address is required")
+        ip_address = _address(record["ip_address"], "ip_address")
+
+        lease_duration = _int(record.get("lease_duration"), "lease_duration")
+        if lease_duration is not None and lease_duration < 0:
+            raise ValueError("lease_duration must not be negative")
+        assigned_at = self.now
+        if not _blank(record.get("assigned_at")):
+            try:
+                assigned_at = datetime.fromisoformat(str(record["assigned_at"]).strip())
+            except ValueError:
+                raise ValueError(f"Invalid assigned_at: {record['assigned_at']}")
+
+        index = self._pool_index(pool)
+        with index.lock:
+            offset = index.offset(ip_address)
+            if offset is None:
+                raise ValueError(f"IP {ip_address} is not in pool range {pool.cidr}")
+            if index.state[offset] == QUARANTINED:
+                index.release_expired()
+            if index.state[offset] != FREE:
+                raise ValueError(f"IP {ip_address} is not available (allocated, reserved or quarantined)")
+            # Hold it until the chunk commits
+            index.mark_allocated(ip_address)
+
+        return {
+            "pool_id": pool.id,
+            "ip_address": ip_address,
+            "client_id": _text(record.get("client_id")),
+            "client_name": _text(record.get("client_name")),
+            "allocation_type": _text(record.get("allocation_type")) or "static",
+            "lease_duration": lease_duration,
+            "assigned_at": assigned_at
+        }
+
+    def _pool_row(self, record: Dict) -> Dict:
+        name = _text(record.get("name"))
+        if not name:
+            raise ValueError("name is required")
+        if name in self.pools_by_name:
+            raise ValueError(f"Pool with name '{name}' already exists")
+        try:
+            cidr = str(ipaddress.IPv4Network(str(record.get("cidr", "")).strip(), strict=False))
+        except (ipaddress.AddressValueError, ipaddress.NetmaskValueError, ValueError):
+            raise ValueError(f"Invalid CIDR notation: {record.get('cidr')}")
+
+        gateway = _address(record["gateway"], "gateway") if not _blank(record.get("gateway")) else None
+
+        dns_servers = record.get("dns_servers") or []
+        if isinstance(dns_servers, str):
+            dns_servers = [item for item in dns_servers.split(";") if item.strip()]
+        dns_servers = [_address(item, "DNS server IP") for item in dns_servers]
+
+        reserved_ranges = record.get("reserved_ranges") or []
+        if isinstance(reserved_ranges, str):
+            reserved_ranges = [
+                dict(zip(("start", "end"), item.split("-", 1)))
+                for item in reserved_ranges.split(";") if item.strip()
+            ]
+        ranges = []
+        for range_def in reserved_ranges:
+            if not isinstance(range_def, dict) or "start" not in range_def or "end" not in range_def:
+                raise ValueError("Reserved ranges need a start and an end")
+            start = _address(range_def["start"], "reserved range start")
+            end = _address(range_def["end"], "reserved range end")
+            if int(ipaddress.IPv4Address(start)) > int(ipaddress.IPv4Address(end)):
+                raise ValueError(f"Reserved range {start}-{end} is reversed")
+            ranges.append({"start": start, "end": end})
+
+        quarantine_seconds = _int(record.get("quarantine_seconds"), "quarantine_seconds") or 0
+        if quarantine_seconds < 0:
+            raise ValueError("quarantine_seconds must not be negative")
+
+        # Claim the name so a duplicate later in the input is rejected
+        self.pools_by_name[name] = None
+        return {
+            "name": name,
+            "cidr": cidr,
+            "description": _text(record.get("description")),
+            "gateway": gateway,
+            "dns_servers": dns_servers,
+            "reserved_ranges": ranges,
+            "reserved_version": 1 if ranges else 0,
+            "quarantine_seconds": quarantine_seconds,
+            "is_active": True,
+            "created_at": self.now,
+            "updated_at": self.now
+        }
+
+    def flush(self):
+        """Insert the queued records in one transaction and checkpoint the progress"""
+        rows, self.pending = self.pending, []
+        if rows:
+            try:
+                if self.kind == "pools":
+                    self._insert_pools(rows)
+                else:
+                    self._insert_allocations(rows)
+                self.db.commit()
+            except IntegrityError:
+                self.db.rollback()
+                if self.kind == "allocations":
+                    # An address allocated by a writer the cached indexes did not see
+                    for pool_id in {row["pool_id"] for row in rows}:
+                        invalidate_pool_index(pool_id)
+                        self.indexes.pop(pool_id, None)
+                raise
+            except Exception:
+                self.db.rollback()
+                if self.kind == "allocations":
+                    self._unhold(rows)
+                raise
+            self.imported += len(rows)
+            self.chunks += 1
+            if self.kind == "allocations":
+                per_pool: Dict[int, int] = {}
+                for row in rows:
+                    per_pool[row["pool_id"]] = per_pool.get(row["pool_id"], 0) + 1
+                for pool_id, count in per_pool.items():
+                    metrics.allocations_total.inc(count, pool_id=pool_id, strategy="import")
+                    forecaster.record(pool_id, count)
+        self.committed_offset = self.offset
+        self.committed_line = self.line
+        self.write_checkpoint()
+
+    def _insert(self, model, rows: List[Dict], key: str = "pool_id", returning: bool = False):
+        """
+        Insert rows with one statement per shard they belong to, by the pool ID in key
+
+        With returning, the ID of each new row is set in its dictionary.
+        """
+        # Core inserts on the table: ORM bulk inserts cannot be routed to shards
+        table = model.__table__
+        assign_ids(self.db, table, rows)
+        for group in group_rows(self.db, rows, key):
+            if returning:
+                result = self.db.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), group)
+                for row, row_id in zip(group, result.scalars().all()):
+                    row["id"] = row_id
+            else:
+                self.db.execute(insert(table), group)
+
+    def _insert_pools(self, rows: List[Dict]):
+        children = ("dns_servers", "reserved_ranges")
+        pool_rows = [{key: value for key, value in row.items() if key not in children} for row in rows]
+        self._insert(IPPool, pool_rows, key="id", returning=True)
+        pool_ids = [row["id"] for row in pool_rows]
+
+        ranges = [
+            {"pool_id": pool_id, "start_ip": item["start"], "end_ip": item["end"]}
+            for pool_id, row in zip(pool_ids, rows) for item in row["reserved_ranges"]
+        ]
+        if ranges:
+            self._insert(PoolReservedRange, ranges)
+        servers = [
+            {"pool_id": pool_id, "position": position, "address": address}
+            for pool_id, row in zip(pool_ids, rows) for position, address in enumerate(row["dns_servers"])
+        ]
+        if servers:
+            self._insert(PoolDNSServer, servers)
+
+        # SQLite may reuse the IDs of deleted pools
+        for pool_id in pool_ids:
+            invalidate_pool_index(pool_id)
+
+    def _insert_allocations(self, rows: List[Dict]):
+        allocation_rows = [
+            {
+                "pool_id": row["pool_id"],
+                "ip_address": row["ip_address"],
+                "client_id": row["client_id"],
+                "client_name": row["client_name"],
+                "allocation_type": row["allocation_type"],
+                "allocation_strategy": "import",
+                "assigned_at": row["assigned_at"],
+                "last_seen": row["assigned_at"],
+                "is_active": True,
+                "binding_status": "unbound"
+            }
+            for row in rows
+        ]
+        self._insert(IPAllocation, allocation_rows, returning=True)
+        allocation_ids = [row["id"] for row in allocation_rows]
+
+        leases = [
+            {
+                "pool_id": row["pool_id"],
+                "allocation_id": allocation_id,
+                "lease_start": self.now,
+                "lease_duration": row["lease_duration"],
+                "lease_end": self.now + timedelta(seconds=row["lease_duration"]),
+                "renewal_count": 0,
+                "max_renewals": 3,
+                "is_expired": False,
+                "auto_renew": True
+            }
+            for row, allocation_id in zip(rows, allocation_ids) if row["lease_duration"]
+        ]
+        if leases:
+            self._insert(IPLease, leases)
+
+        # One log entry per address keeps the audit trail and snapshot replay complete
+        self._insert(AllocationLog, [
+            {
+                "pool_id": row["pool_id"],
+                "ip_address": row["ip_address"],
+                "action": "import",
+                "client_id": row["client_id"],
+                "details": json.dumps({"allocation_id": allocation_id, "source": self.source}),
+                "success": True,
+                "timestamp": self.now
+            }
+            for row, allocation_id in zip(rows, allocation_ids)
+        ])
+
+    def _unhold(self, rows: List[Dict]):
+        for row in rows:
+            index = self.indexes.get(row["pool_id"])
+            if index is not None:
+                with index.lock:
+                    index.mark_free(row["ip_address"])
+
+    def write_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        checkpoint = {
+            "source": self.source,
+            "kind": self.kind,
+            "offset": self.committed_offset,
+            "line": self.committed_line,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "updated_at": datetime.utcnow().isoformat()
+        }
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+def read_checkpoint(path: str) -> Optional[Dict]:
+    """Load a checkpoint file, or None if there is none yet"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+class LineSplitter:
+    """Splits a byte stream arriving in arbitrary chunks into lines"""
+
+    def __init__(self):
+        self.buffer = b""
+        self.offset = 0
+
+    def push(self, chunk: bytes) -> Iterator[Tuple[bytes, int]]:
+        """Yield every line completed by the chunk, with the stream offset just past it"""
+        buffer = self.buffer + chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self.offset += end + 1 - start
+            yield buffer[start:end + 1], self.offset
+            start = end + 1
+        self.buffer = buffer[start:]
+
+    def close(self) -> Iterator[Tuple[bytes, int]]:
+        """Yield the last line if the stream did not end with a newline"""
+        if self.buffer:
+            self.offset += len(self.buffer)
+            yield self.buffer, self.offset
+            self.buffer = b""
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[Tuple[bytes, int]]:
+    """Split a byte stream into lines, yielding each with the offset just past it"""
+    splitter = LineSplitter()
+    for chunk in chunks:
+        yield from splitter.push(chunk)
+    yield from splitter.close()
+
+class RecordParser:
+    """
+    Turns lines of CSV or JSONL into record dictionaries
+
+    Works one line at a time so it can sit on top of a file or a network
+    stream. CSV fields must not contain line breaks.
+    """
+
+    def __init__(self, fmt: str, header: Optional[List[str]] = None):
+        if fmt not in IMPORT_FORMATS:
+            raise BulkImportError(f"Unknown import format '{fmt}'")
+        self.format = fmt
+        self.header = header
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+
+    def parse(self, line: bytes) -> Optional[Dict]:
+        """Parse one line; returns None for blank lines and the CSV header"""
+        text = self.decoder.decode(line).strip("\r\n")
+        if not text.strip():
+            return None
+        if self.format == "jsonl":
+            try:
+                record = json.loads(text)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON: {e.msg}")
+            if not isinstance(record, dict):
+                raise ValueError("Each JSONL line must be an object")
+            return record
+        values = next(csv.reader([text]))
+        if self.header is None:
+            self.header = [name.strip() for name in values]
+            return None
+        return dict(zip(self.header, values))
+
+def feed_line(importer: BulkImporter, parser: RecordParser, line: bytes, end_offset: int):
+    """Parse one input line and pass the record on to the importer"""
+    try:
+        record = parser.parse(line)
+    except ValueError as e:
+        importer.skip(end_offset, str(e))
+        return
+    if record is None:
+        importer.skip(end_offset)
+    else:
+        importer.feed(record, end_offset)
+
+def import_file(
+    db: Session,
+    path: str,
+    kind: str = "allocations",
+    fmt: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    checkpoint_path: Optional[str] = None,
+    resume: bool = True
+) -> Dict[str, object]:
+    """
+    Import a CSV or JSONL file, resuming from its checkpoint if there is one
+
+    The format defaults to the file extension.
+    """
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv")
+    parser = RecordParser(fmt)
+    checkpoint = read_checkpoint(checkpoint_path) if checkpoint_path and resume else None
+    start_offset = start_line = 0
+    if checkpoint:
+        if checkpoint.get("source") != os.path.abspath(path) or checkpoint.get("kind") != kind:
+            raise BulkImportError(f"Checkpoint {checkpoint_path} belongs to a different import")
+        start_offset, start_line = checkpoint["offset"], checkpoint["line"]
+
+    importer = BulkImporter(
+        db, kind,
+        chunk_size=chunk_size,
+        checkpoint_path=checkpoint_path,
+        source=os.path.abspath(path),
+        start_offset=start_offset,
+        start_line=start_line
+    )
+    with open(path, "rb") as f:
+        if start_offset and fmt == "csv":
+            # Header first, then skip what earlier runs already committed
+            parser.parse(f.readline())
+        f.seek(start_offset)
+
+        def read_chunks():
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    return
+                yield chunk
+
+        for line, end in iter_lines(read_chunks()):
+            feed_line(importer, parser, line, start_offset + end)
+
+    summary = importer.finish()
+    logger.info(f"Imported {path}: {summary['imported']} imported, {summary['rejected']} rejected")
+    return summary
@@ -0,0 +1,96 @@
+"""
+Streaming NDJSON export of allocations, leases, allocation logs and their history
+
+Rows are read through a server-side cursor in batches of plain column tuples
+(no ORM objects, so the session's identity map stays empty) and encoded one
+JSON object per line. Output is buffered into blocks and optionally gzipped
+on the fly, so memory stays flat however many rows are exported.
+"""
+
+import json
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import select
+
+from database.connection import get_read_db_session
+from database.models import IPAllocation, IPLease, IPAllocationHistory, IPLeaseHistory, AllocationLog
+
+EXPORT_TABLES = {
+    "allocations": IPAllocation.__table__,
+    "leases": IPLease.__table__,
+    "logs": AllocationLog.__table__,
+    "allocation_history": IPAllocationHistory.__table__,
+    "lease_history": IPLeaseHistory.__table__
+}
+DEFAULT_BATCH_SIZE = 1000
+BLOCK_SIZE = 64 * 1024
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+_encoder = json.JSONEncoder(default=_default, separators=(",", ":"))
+
+def export_lines(
+    kind: str,
+    pool_id: Optional[int] = None,
+    active_only: bool = False,
+    after_id: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[bytes]:
+    """
+    Yield the rows of one table as NDJSON lines in ID order
+
+    Uses its own session, which is closed when the generator finishes or is
+    closed, so it can outlive the request that started it.
+    """
+    table = EXPORT_TABLES[kind]
+    query = select(table).order_by(table.c.id)
+    if pool_id is not None:
+        query = query.where(table.c.pool_id == pool_id)
+    if after_id is not None:
+        query = query.where(table.c.id > after_id)
+    if active_only:
+        if kind == "allocations":
+            query = query.where(table.c.is_active == True)
+        elif kind == "leases":
+            query = query.where(table.c.is_expired == False)
+
+    db = get_read_db_session()
+    try:
+        result = db.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+        now = datetime.utcnow()
+        encode = _encoder.encode
+        for row in result.mappings():
+            record = dict(row)
+            if kind == "leases" and not record["is_expired"] and record["lease_end"]:
+                record["time_remaining_seconds"] = max(0, int((record["lease_end"] - now).total_seconds()))
+            yield (encode(record) + "\n").encode()
+    finally:
+        db.close()
+
+def buffered(chunks: Iterable[bytes], block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Join small chunks into blocks of about block_size bytes"""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= block_size:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b"".join(parts)
+
+def gzipped(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a byte stream into a gzip stream as it goes"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,206 @@
+"""
+Pool exhaustion forecasting
+
+Keeps an exponentially weighted net allocation rate per pool and horizon,
+updated by the allocator as addresses are allocated and released. The rate
+after events d_i at times t_i is sum(d_i * exp(-(t - t_i) / tau)) / tau, so
+each update is O(1) and the allocation log is never rescanned; it is only
+read once per pool, over a bounded recent window, to seed the rates.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database.models import IPPool, AllocationLog
+from .pool_index import get_pool_index
+
+# Smoothing time constants, in seconds
+FORECAST_HORIZONS = {"1h": 3600, "6h": 6 * 3600, "24h": 24 * 3600}
+# Log history read when a pool is first forecast, as a multiple of the longest horizon
+SEED_WINDOW_FACTOR = 3
+CRITICAL_HOURS = 24
+WARNING_HOURS = 7 * 24
+
+_ALLOCATE_ACTIONS = ("allocate", "reserve", "import")
+_RELEASE_ACTIONS = ("deallocate", "expire")
+_EPOCH = datetime(1970, 1, 1)
+
+def _to_epoch(value: datetime) -> float:
+    return (value - _EPOCH).total_seconds()
+
+class PoolRate:
+    """Exponentially weighted net allocation rates of one pool"""
+
+    __slots__ = ("values", "updated_at", "seeded_at", "allocations", "releases")
+
+    def __init__(self, at: float):
+        self.values = {name: 0.0 for name in FORECAST_HORIZONS}
+        self.updated_at = at
+        # When the log was read; earlier events are already in the values
+        self.seeded_at = at
+        self.allocations = 0
+        self.releases = 0
+
+    def add(self, delta: int, at: float):
+        """Add a net change of delta addresses at a time in epoch seconds"""
+        if delta > 0:
+            self.allocations += delta
+        else:
+            self.releases -= delta
+        if at >= self.updated_at:
+            elapsed = at - self.updated_at
+            for name, tau in FORECAST_HORIZONS.items():
+                self.values[name] = self.values[name] * math.exp(-elapsed / tau) + delta / tau
+            self.updated_at = at
+        else:
+            # Older event, e.g. a log entry read while seeding
+            age = self.updated_at - at
+            for name, tau in FORECAST_HORIZONS.items():
+                self.values[name] += delta / tau * math.exp(-age / tau)
+
+    def rates_per_hour(self, at: float) -> Dict[str, float]:
+        elapsed = max(0.0, at - self.updated_at)
+        return {
+            name: self.values[name] * math.exp(-elapsed / tau) * 3600
+            for name, tau in FORECAST_HORIZONS.items()
+        }
+
+class Forecaster:
+    """Per-pool allocation rates and time-to-exhaustion projections"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pools: Dict[int, PoolRate] = {}
+        # Events recorded while a pool's log is being read, as (delta, at)
+        self.seeding: Dict[int, List[Tuple[int, float]]] = {}
+
+    def record(self, pool_id: int, delta: int, at: Optional[float] = None):
+        """
+        Record committed allocations (positive delta) or releases (negative)
+
+        Pools that have not been forecast yet are skipped; their events are
+        picked up from the log when they are seeded. Events from before the
+        seed read the log are skipped too, as the log already had them.
+        """
+        if at is None:
+            at = time.time()
+        with self.lock:
+            rate = self.pools.get(pool_id)
+            if rate is not None:
+                if at >= rate.seeded_at:
+                    rate.add(delta, at)
+            elif pool_id in self.seeding:
+                self.seeding[pool_id].append((delta, at))
+
+    def forget(self, pool_id: Optional[int] = None):
+        """Drop the rates of one pool, or of all pools"""
+        with self.lock:
+            if pool_id is None:
+                self.pools.clear()
+            else:
+                self.pools.pop(pool_id, None)
+
+    def _seed(self, db: Session, pool_id: int, now: float) -> PoolRate:
+        window = SEED_WINDOW_FACTOR * max(FORECAST_HORIZONS.values())
+        rows = db.query(AllocationLog.action, AllocationLog.timestamp).filter(
+            AllocationLog.pool_id == pool_id,
+            AllocationLog.success == True,
+            AllocationLog.action.in_(_ALLOCATE_ACTIONS + _RELEASE_ACTIONS),
+            AllocationLog.timestamp >= datetime.utcnow() - timedelta(seconds=window)
+        ).yield_per(1000)
+        rate = PoolRate(now)
+        for row in rows:
+            rate.add(1 if row.action in _ALLOCATE_ACTIONS else -1, min(now, _to_epoch(row.timestamp)))
+        return rate
+
+    def rates(self, db: Session, pool_id: int) -> Dict[str, float]:
+        """
+        Get the net allocation rates of a pool in addresses per hour, seeding them on first use
+
+        The log is read outside the lock so record() does not wait for it;
+        events recorded meanwhile are kept aside and added once it is read.
+        """
+        with self.lock:
+            rate = self.pools.get(pool_id)
+            if rate is not None:
+                return rate.rates_per_hour(time.time())
+            self.seeding.setdefault(pool_id, [])
+        seeded_at = time.time()
+        try:
+            seeded = self._seed(db, pool_id, seeded_at)
+        except Exception:
+            with self.lock:
+                self.seeding.pop(pool_id, None)
+            raise
+        with self.lock:
+            for delta, at in self.seeding.pop(pool_id, []):
+                if at >= seeded_at:
+                    seeded.add(delta, at)
+            # Another request may have seeded the pool meanwhile
+            rate = self.pools.setdefault(pool_id, seeded)
+            return rate.rates_per_hour(time.time())
+
+    def forecast(self, db: Session, pool: IPPool) -> Dict[str, object]:
+        """
+        Project when a pool runs out of addresses
+
+        The projection uses the fastest of the smoothed net rates, so a burst
+        shows up straight away and a slow steady climb is not hidden by a
+        quiet last hour. Quarantined addresses count as available.
+        """
+        index = get_pool_index(db, pool)
+        with index.lock:
+            index.release_expired()
+            available = index.free_count + index.quarantined_count
+            allocated = index.allocated_count
+            usable = index.size - index.reserved_count
+
+        rates = self.rates(db, pool.id)
+        projected = max(rates.values())
+        hours = None
+        exhausts_at = None
+        if available <= 0:
+            hours = 0.0
+            status = "exhausted"
+        elif projected > 1e-9:
+            hours = available / projected
+            exhausts_at = datetime.utcnow() + timedelta(hours=hours)
+            if hours <= CRITICAL_HOURS:
+                status = "critical"
+            elif hours <= WARNING_HOURS:
+                status = "warning"
+            else:
+                status = "ok"
+        else:
+            status = "stable"
+
+        return {
+            "pool_id": pool.id,
+            "pool_name": pool.name,
+            "cidr": pool.cidr,
+            "available_ips": available,
+            "allocated_ips": allocated,
+            "utilization_percent": round(allocated / usable * 100, 2) if usable else 0.0,
+            "net_rate_per_hour": {name: round(value, 4) for name, value in rates.items()},
+            "projected_rate_per_hour": round(projected, 4),
+            "hours_to_exhaustion": round(hours, 2) if hours is not None else None,
+            "exhausts_at": exhausts_at,
+            "status": status
+        }
+
+    def summary(self, db: Session, pools: List[IPPool]) -> List[Dict[str, object]]:
+        """Forecast several pools, most urgent first"""
+        forecasts = [self.forecast(db, pool) for pool in pools]
+        forecasts.sort(key=lambda item: (
+            item["hours_to_exhaustion"] is None,
+            item["hours_to_exhaustion"] or 0.0,
+            -item["utilization_percent"]
+        ))
+        return forecasts
+
+forecaster = Forecaster()
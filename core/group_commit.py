@@ -0,0 +1,241 @@
+"""
+Group commit of allocations
+
+Every IPAllocator.allocate_next_ip() call commits on its own, so a burst of
+allocations costs one transaction, and with SQLite one fsync, per address.
+The GroupCommitter applies the allocations that arrive within a short
+window, up to a batch size, in one shared transaction:
+
+    committer = GroupCommitter(max_batch=64, max_wait=0.002)
+    committer.start()
+    success, message, ip_address = committer.allocate_next_ip(pool_id, client_id="aa:bb")
+    future = committer.submit(pool_id, client_id="cc:dd")   # or wait on a Future
+
+Each allocation runs in its own SAVEPOINT, so one that fails is rolled back
+alone and reported to its caller while the rest of the batch commits.
+Callers get their result only after the shared commit. If the commit
+itself fails, the batch is retried one allocation per transaction.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database.sharding import get_router
+
+from . import metrics
+from .forecast import forecaster
+from .instrumentation import instrumentation
+from .ip_allocator import IPAllocator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT = 0.002  # Seconds the first allocation of a batch waits for more
+
+class AllocationRequest:
+    """One queued allocate_next_ip() call"""
+
+    def __init__(self, pool_id: int, client_id: Optional[str], client_name: Optional[str],
+                 strategy: str, lease_duration: int):
+        self.pool_id = pool_id
+        self.client_id = client_id
+        self.client_name = client_name
+        self.strategy = strategy
+        self.lease_duration = lease_duration
+        self.future: Future = Future()
+        self.held_ip: Optional[str] = None
+        self.result: Optional[Tuple[bool, str, Optional[str]]] = None
+
+class GroupCommitter:
+    """Applies allocations from many callers in shared transactions on a background thread"""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_wait: float = DEFAULT_MAX_WAIT
+    ):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        if max_wait < 0:
+            raise ValueError("max_wait must not be negative")
+        if session_factory is None:
+            from database import get_db_session
+            session_factory = get_db_session
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: "queue.Queue[Optional[AllocationRequest]]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Apply what is queued, then stop the background thread"""
+        with self.lock:
+            if not self.running:
+                return
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+    def submit(
+        self,
+        pool_id: int,
+        client_id: Optional[str] = None,
+        client_name: Optional[str] = None,
+        strategy: str = "first_fit",
+        lease_duration: int = 86400
+    ) -> Future:
+        """
+        Queue an allocation
+
+        Returns: Future resolving to (success, message, ip_address) once the
+        allocation's transaction has committed
+        """
+        if not self.running:
+            raise RuntimeError("Group committer is not running")
+        request = AllocationRequest(pool_id, client_id, client_name, strategy, lease_duration)
+        self.queue.put(request)
+        return request.future
+
+    def allocate_next_ip(self, *args, **kwargs) -> Tuple[bool, str, Optional[str]]:
+        """Same as IPAllocator.allocate_next_ip(), applied in the next group commit"""
+        return self.submit(*args, **kwargs).result()
+
+    def _next_batch(self) -> Tuple[List[AllocationRequest], bool]:
+        """Wait for an allocation, then collect more until the window closes or the batch is full"""
+        first = self.queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if stopping:
+                # Drain what arrived before stop() so no caller waits forever
+                while True:
+                    try:
+                        request = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is not None:
+                        batch.append(request)
+            if not batch:
+                continue
+            try:
+                self._apply(batch)
+            except Exception as e:
+                logger.error(f"Group commit failed: {e}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_result((False, f"Error allocating IP: {e}", None))
+
+    @instrumentation.operation("group_commit")
+    def _apply(self, batch: List[AllocationRequest]):
+        db = self.session_factory()
+        try:
+            allocator = IPAllocator(db)
+            router = get_router(db)
+            shards = sorted({router.shard_for_pool(request.pool_id) for request in batch}) if router else [None]
+            for shard_id in shards:
+                conn = db.connection(bind_arguments={"shard_id": shard_id} if shard_id else None)
+                if conn.dialect.name == "sqlite":
+                    # pysqlite only opens a transaction before a write, and the first
+                    # SAVEPOINT would otherwise become the transaction, committed by
+                    # its own RELEASE
+                    conn.exec_driver_sql("BEGIN")
+            for request in batch:
+                self._stage(allocator, db, request)
+            try:
+                with instrumentation.phase("commit"):
+                    db.commit()
+            except Exception as e:
+                db.rollback()
+                for request in batch:
+                    if request.held_ip:
+                        if isinstance(e, IntegrityError):
+                            # Which address conflicted is unknown, so rebuild every pool of the batch
+                            IPAllocator._forget_stale_index(request.pool_id, request.held_ip)
+                        else:
+                            IPAllocator._unhold_index(request.pool_id, request.held_ip)
+                logger.warning(f"Group commit of {len(batch)} allocations failed, retrying one by one: {e}")
+                for request in batch:
+                    request.future.set_result(allocator.allocate_next_ip(
+                        request.pool_id, request.client_id, request.client_name,
+                        request.strategy, request.lease_duration
+                    ))
+                return
+        finally:
+            db.close()
+
+        metrics.group_commit_batch_size.observe(len(batch))
+        for request in batch:
+            success, message, ip_address = request.result
+            if success:
+                metrics.allocations_total.inc(pool_id=request.pool_id, strategy=request.strategy)
+                forecaster.record(request.pool_id, 1)
+            request.future.set_result(request.result)
+
+    @staticmethod
+    def _stage(allocator: IPAllocator, db: Session, request: AllocationRequest, retry: bool = True):
+        """Add one allocation to the shared transaction, in a SAVEPOINT of its own"""
+        held_ip = None
+        try:
+            with db.begin_nested():
+                success, message, held_ip = allocator._hold_address(
+                    request.pool_id, request.client_id, request.strategy
+                )
+                if success:
+                    allocator._add_allocation(
+                        request.pool_id, held_ip, request.client_id, request.client_name,
+                        request.strategy, request.lease_duration
+                    )
+            request.held_ip = held_ip
+            request.result = (success, message, held_ip)
+        except IntegrityError as e:
+            if held_ip:
+                IPAllocator._forget_stale_index(request.pool_id, held_ip)
+            if retry:
+                # Once more from the rebuilt index
+                GroupCommitter._stage(allocator, db, request, retry=False)
+                return
+            error_msg = f"Error allocating IP: {str(e)}"
+            allocator._log_allocation_error(request.pool_id, request.client_id, error_msg)
+            request.result = (False, error_msg, None)
+        except Exception as e:
+            if held_ip:
+                IPAllocator._unhold_index(request.pool_id, held_ip)
+            error_msg = f"Error allocating IP: {str(e)}"
+            allocator._log_allocation_error(request.pool_id, request.client_id, error_msg)
+            request.result = (False, error_msg, None)
@@ -0,0 +1,198 @@
+import atexit
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Exponential bucket bounds in seconds, 10us up to ~10s
+DEFAULT_BOUNDS = [0.00001 * 2 ** k for k in range(21)]
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum, min and max"""
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.bounds = list(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[position] if position < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self, scale: float = 1.0) -> Dict[str, object]:
+        """Summarize the histogram, multiplying values by scale"""
+        def scaled(value):
+            return round(value * scale, 6) if value is not None else None
+        return {
+            "count": self.count,
+            "sum": scaled(self.sum),
+            "mean": scaled(self.sum / self.count) if self.count else None,
+            "min": scaled(self.min),
+            "max": scaled(self.max),
+            "p50": scaled(self.quantile(0.5)),
+            "p90": scaled(self.quantile(0.9)),
+            "p99": scaled(self.quantile(0.99)),
+            "buckets": {
+                f"le_{scaled(bound)}": count
+                for bound, count in zip(self.bounds, self.buckets) if count
+            }
+        }
+
+class _NoopTimer:
+    """Shared do-nothing context manager used while instrumentation is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopTimer()
+
+# Operation and SQL statement counter of the call being timed in this context
+_current: contextvars.ContextVar[Optional[List]] = contextvars.ContextVar("blackz_operation", default=None)
+
+class _PhaseTimer:
+    __slots__ = ("registry", "key", "started")
+
+    def __init__(self, registry: "Instrumentation", key: Tuple[str, str]):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry._observe_phase(self.key, time.perf_counter() - self.started)
+        return False
+
+class Instrumentation:
+    """
+    In-process timing and SQL statement histograms per allocator operation
+
+    Disabled by default; enable with BLACKZ_INSTRUMENTATION=1 or enable().
+    While disabled, operation() and phase() cost one attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.phases: Dict[Tuple[str, str], Histogram] = {}
+        self.statements: Dict[str, Histogram] = {}
+        self.started_at = time.time()
+
+    def enable(self):
+        if not self.enabled:
+            event.listen(Engine, "before_cursor_execute", _count_statement)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            event.remove(Engine, "before_cursor_execute", _count_statement)
+            self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.phases.clear()
+            self.statements.clear()
+            self.started_at = time.time()
+
+    def operation(self, name: str):
+        """Decorator timing a whole operation and counting its SQL statements"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                token = _current.set([name, 0])
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    statements = _current.get()[1]
+                    _current.reset(token)
+                    self._observe_phase((name, "total"), elapsed)
+                    with self.lock:
+                        histogram = self.statements.get(name)
+                        if histogram is None:
+                            histogram = self.statements[name] = Histogram(range(0, 65))
+                        histogram.observe(statements)
+            return wrapper
+        return decorator
+
+    def phase(self, name: str):
+        """Context manager timing one phase of the current operation"""
+        if not self.enabled:
+            return _NOOP
+        current = _current.get()
+        return _PhaseTimer(self, (current[0] if current else "unscoped", name))
+
+    def _observe_phase(self, key: Tuple[str, str], elapsed: float):
+        with self.lock:
+            histogram = self.phases.get(key)
+            if histogram is None:
+                histogram = self.phases[key] = Histogram()
+            histogram.observe(elapsed)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Get all histograms, timings in milliseconds"""
+        with self.lock:
+            operations: Dict[str, Dict[str, object]] = {}
+            for (operation, phase), histogram in sorted(self.phases.items()):
+                entry = operations.setdefault(operation, {"phases_ms": {}})
+                entry["phases_ms"][phase] = histogram.snapshot(scale=1000)
+            for operation, histogram in self.statements.items():
+                entry = operations.setdefault(operation, {"phases_ms": {}})
+                entry["sql_statements"] = histogram.snapshot()
+        return {
+            "enabled": self.enabled,
+            "since": self.started_at,
+            "operations": operations
+        }
+
+    def dump(self, path: str):
+        """Write the current snapshot to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    current = _current.get()
+    if current is not None:
+        current[1] += 1
+
+instrumentation = Instrumentation()
+
+if os.environ.get("BLACKZ_INSTRUMENTATION", "").lower() in ("1", "true", "yes"):
+    instrumentation.enable()
+    # Optionally write the histograms out when the process exits
+    if os.environ.get("BLACKZ_INSTRUMENTATION_DUMP"):
+        atexit.register(instrumentation.dump, os.environ["BLACKZ_INSTRUMENTATION_DUMP"])
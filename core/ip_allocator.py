@@ -1,10 +1,36 @@
+import hashlib
 import ipaddress
 import json
+import logging
 import random
+from contextlib import contextmanager
 from typing import List, Optional, Tuple, Dict, Set
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from database.models import IPPool, IPAllocation, IPLease, AllocationLog
+from sqlalchemy import func, insert, literal, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+from database.models import IPPool, PoolReservedRange, IPAllocation, IPLease, AllocationLog
+from database.queries import (
+    POOL_BY_ID, POOL_RANGE_BY_ID, RESERVED_ADDRESS_COUNT, ACTIVE_ALLOCATION_COUNT,
+    ALLOCATION_WITH_LEASE, LEASE_WITH_ALLOCATION
+)
+from database.sharding import group_rows
+from . import metrics
+from .forecast import forecaster
+from .instrumentation import instrumentation
+from .pool_index import PoolIndex, QUARANTINED, host_bounds, get_pool_index, invalidate_pool_index, peek_pool_index
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def _index_locked(index: PoolIndex):
+    """Hold a pool index's lock, timing the wait for it as the index_lock phase"""
+    with instrumentation.phase("index_lock"):
+        index.lock.acquire()
+    try:
+        yield index
+    finally:
+        index.lock.release()
 
 class AllocationStrategy:
     """Base class for allocation strategies"""
@@ -13,6 +39,17 @@ class AllocationStrategy:
     def allocate(available_ips: List[str], allocated_ips: Set[str]) -> Optional[str]:
         """Allocate an IP address using the strategy"""
         raise NotImplementedError
+    
+    @classmethod
+    def select(cls, index: PoolIndex, client_id: Optional[str] = None) -> Optional[int]:
+        """
+        Pick a free offset from a pool index
+        
+        Strategies override this to avoid listing the pool. The default falls
+        back to allocate() over the full list of free addresses.
+        """
+        allocated_ip = cls.allocate(index.free_addresses(), set())
+        return index.offset(allocated_ip) if allocated_ip else None
 
 class FirstFitStrategy(AllocationStrategy):
     """Allocate the first available IP address"""
@@ -23,6 +60,10 @@ class FirstFitStrategy(AllocationStrategy):
             if ip not in allocated_ips:
                 return ip
         return None
+    
+    @classmethod
+    def select(cls, index: PoolIndex, client_id: Optional[str] = None) -> Optional[int]:
+        return index.first_free()
 
 class RandomStrategy(AllocationStrategy):
     """Allocate a random available IP address"""
@@ -31,6 +72,12 @@ class RandomStrategy(AllocationStrategy):
     def allocate(available_ips: List[str], allocated_ips: Set[str]) -> Optional[str]:
         available = [ip for ip in available_ips if ip not in allocated_ips]
         return random.choice(available) if available else None
+    
+    @classmethod
+    def select(cls, index: PoolIndex, client_id: Optional[str] = None) -> Optional[int]:
+        if not index.free_count:
+            return None
+        return index.nth_free(random.randrange(index.free_count))
 
 class SequentialStrategy(AllocationStrategy):
     """Allocate IPs sequentially from last allocated"""
@@ -40,6 +87,10 @@ class SequentialStrategy(AllocationStrategy):
         # For sequential, we'll use the same as first fit for simplicity
         # In a more advanced implementation, we'd track the last allocated IP
         return FirstFitStrategy.allocate(available_ips, allocated_ips)
+    
+    @classmethod
+    def select(cls, index: PoolIndex, client_id: Optional[str] = None) -> Optional[int]:
+        return FirstFitStrategy.select(index, client_id)
 
 class LoadBalancedStrategy(AllocationStrategy):
     """Allocate IPs to balance load across the range"""
@@ -53,6 +104,51 @@ class LoadBalancedStrategy(AllocationStrategy):
         # Choose an IP from the middle of available range for load balancing
         mid_index = len(available) // 2
         return available[mid_index]
+    
+    @classmethod
+    def select(cls, index: PoolIndex, client_id: Optional[str] = None) -> Optional[int]:
+        return index.nth_free(index.free_count // 2)
+
+class HashStrategy(AllocationStrategy):
+    """Hash the client ID to a preferred address and probe linearly until a free one is found
+
+    The same client ID always maps to the same preferred address, so clients
+    get stable addresses across rebuilds as long as that address is free.
+    """
+    
+    @staticmethod
+    def preferred_offset(client_id: str, size: int) -> int:
+        """Map a client ID to an offset in a pool of the given size"""
+        # blake2b rather than hash(): str hashes are salted per process
+        digest = hashlib.blake2b(client_id.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % size
+    
+    @staticmethod
+    def probe(index: PoolIndex, client_id: Optional[str]) -> Tuple[Optional[int], int]:
+        """
+        Probe the index starting at the client's preferred offset
+        
+        Returns: (offset or None if the pool is full, number of offsets probed)
+        """
+        start = HashStrategy.preferred_offset(client_id, index.size) if client_id else 0
+        # The linear probe skips over taken runs through the index, wrapping at the end
+        offset = index.next_free(start)
+        if offset is not None:
+            return offset, offset - start + 1
+        offset = index.first_free()
+        if offset is not None:
+            return offset, index.size - start + offset + 1
+        return None, index.size
+    
+    @classmethod
+    def select(cls, index: PoolIndex, client_id: Optional[str] = None) -> Optional[int]:
+        offset, _ = cls.probe(index, client_id)
+        return offset
+    
+    @staticmethod
+    def allocate(available_ips: List[str], allocated_ips: Set[str]) -> Optional[str]:
+        # Without a client ID there is nothing to hash, so behave like first fit
+        return FirstFitStrategy.allocate(available_ips, allocated_ips)
 
 class IPAllocator:
     """Main IP Allocation Engine"""
@@ -61,15 +157,42 @@ class IPAllocator:
         "first_fit": FirstFitStrategy,
         "random": RandomStrategy,
         "sequential": SequentialStrategy,
-        "load_balanced": LoadBalancedStrategy
+        "load_balanced": LoadBalancedStrategy,
+        "hash": HashStrategy
     }
     
     def __init__(self, db_session: Session):
         self.db = db_session
     
+    @staticmethod
+    def _release_index(pool_id: int, ip_address: str):
+        """Release an address in the cached pool index after the release was committed"""
+        index = peek_pool_index(pool_id)
+        if index is None:
+            return
+        with index.lock:
+            # Released addresses go through the pool's quarantine
+            index.release(ip_address)
+    
+    @staticmethod
+    def _forget_stale_index(pool_id: int, ip_address: str):
+        """Drop a pool index that offered an address already active in the database"""
+        logger.warning(f"Pool {pool_id}: {ip_address} was allocated by another writer, rebuilding the pool index")
+        metrics.pool_index_conflicts_total.inc(pool_id=pool_id)
+        invalidate_pool_index(pool_id)
+    
+    @staticmethod
+    def _unhold_index(pool_id: int, ip_address: str):
+        """Give back an address held for a transaction that was rolled back"""
+        index = peek_pool_index(pool_id)
+        if index is None:
+            return
+        with index.lock:
+            index.mark_free(ip_address)
+    
     def get_pool_utilization(self, pool_id: int) -> Dict[str, any]:
         """Get pool utilization statistics"""
-        pool = self.db.query(IPPool).filter(IPPool.id == pool_id).first()
+        pool = self.db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
         if not pool:
             raise ValueError(f"Pool {pool_id} not found")
         
@@ -80,21 +203,18 @@ class IPAllocator:
         usable_ips = total_ips - 2
         
         # Count reserved IPs
-        reserved_count = 0
-        if pool.reserved_ranges:
-            reserved_ranges = json.loads(pool.reserved_ranges)
-            for range_def in reserved_ranges:
-                start_ip = ipaddress.IPv4Address(range_def["start"])
-                end_ip = ipaddress.IPv4Address(range_def["end"])
-                reserved_count += int(end_ip) - int(start_ip) + 1
+        reserved_count = self.db.execute(RESERVED_ADDRESS_COUNT, {"pool_id": pool_id}).scalar()
         
         # Count allocated IPs
-        allocated_count = self.db.query(IPAllocation).filter(
-            IPAllocation.pool_id == pool_id,
-            IPAllocation.is_active == True
-        ).count()
+        allocated_count = self.db.execute(ACTIVE_ALLOCATION_COUNT, {"pool_id": pool_id}).scalar()
+        
+        # Count IPs still cooling down after release
+        index = get_pool_index(self.db, pool)
+        with index.lock:
+            index.release_expired()
+            quarantined_count = index.quarantined_count
         
-        available_count = usable_ips - reserved_count - allocated_count
+        available_count = usable_ips - reserved_count - allocated_count - quarantined_count
         utilization_percent = (allocated_count / max(1, usable_ips - reserved_count)) * 100
         
         return {
@@ -104,43 +224,221 @@ class IPAllocator:
             "usable_ips": usable_ips,
             "reserved_ips": reserved_count,
             "allocated_ips": allocated_count,
+            "quarantined_ips": quarantined_count,
             "available_ips": available_count,
             "utilization_percent": round(utilization_percent, 2)
         }
     
+    def get_pool_fragmentation(self, pool_id: int) -> Dict[str, any]:
+        """Get free-run statistics showing how scattered the free addresses are"""
+        pool = self.db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
+        if not pool:
+            raise ValueError(f"Pool {pool_id} not found")
+        
+        index = get_pool_index(self.db, pool)
+        with index.lock:
+            index.release_expired()
+            fragmentation = index.fragmentation()
+        
+        fragmentation.update({"pool_id": pool.id, "pool_name": pool.name, "cidr": pool.cidr})
+        return fragmentation
+    
+    def find_free_gaps(self, pool_id: int, min_size: int = 1, limit: int = 100) -> List[Dict[str, any]]:
+        """
+        Find runs of addresses not covered by active allocations or reserved ranges
+        
+        Answered in SQL from the integer addresses: active allocations are
+        read in address order from the (pool_id, is_active, ip_int) index
+        and a window over them finds the holes, so the pool index is not
+        loaded. Quarantined addresses count as free here.
+        
+        Returns: Gaps in address order, each with start_ip, end_ip and size
+        """
+        pool = self.db.execute(POOL_RANGE_BY_ID, {"pool_id": pool_id}).first()
+        if not pool:
+            raise ValueError(f"Pool {pool_id} not found")
+        
+        first, last = host_bounds(pool.cidr)
+        
+        # Taken intervals, ending with a sentinel just past the last host
+        taken = [
+            select(IPAllocation.ip_int.label("start_int"), IPAllocation.ip_int.label("end_int")).where(
+                IPAllocation.pool_id == pool_id,
+                IPAllocation.is_active == True,
+                IPAllocation.ip_int.between(first, last)
+            )
+        ]
+        # Ranges sticking out of the pool are harmless, gaps outside it come out empty
+        taken.append(
+            select(PoolReservedRange.start_int, PoolReservedRange.end_int).where(
+                PoolReservedRange.pool_id == pool_id,
+                PoolReservedRange.start_int <= last,
+                PoolReservedRange.end_int >= first
+            )
+        )
+        taken.append(select(literal(last + 1).label("start_int"), literal(last + 1).label("end_int")))
+        intervals = union_all(*taken).subquery()
+        
+        # Highest address covered by any earlier interval
+        covered = func.max(intervals.c.end_int).over(order_by=intervals.c.start_int, rows=(None, -1))
+        ordered = select(
+            intervals.c.start_int,
+            func.coalesce(covered, first - 1).label("covered_to")
+        ).subquery()
+        gap_start = ordered.c.covered_to + 1
+        gap_end = ordered.c.start_int - 1
+        rows = self.db.execute(
+            select(gap_start.label("start_int"), gap_end.label("end_int"))
+            .where(gap_end - gap_start + 1 >= max(1, min_size))
+            .order_by(ordered.c.start_int)
+            .limit(limit)
+        ).all()
+        
+        return [
+            {
+                "start_ip": str(ipaddress.IPv4Address(row.start_int)),
+                "end_ip": str(ipaddress.IPv4Address(row.end_int)),
+                "size": row.end_int - row.start_int + 1
+            }
+            for row in rows
+        ]
+    
+    def find_reserved_ranges(self, ip_address: str, pool_id: Optional[int] = None) -> List[Dict[str, any]]:
+        """
+        Find the reserved ranges containing an address, in one pool or in all of them
+        
+        Returns: Ranges with pool_id, start, end and size
+        Raises: ValueError for an invalid address
+        """
+        value = int(ipaddress.IPv4Address(ip_address))
+        query = self.db.query(PoolReservedRange).filter(
+            PoolReservedRange.start_int <= value,
+            PoolReservedRange.end_int >= value
+        )
+        if pool_id is not None:
+            query = query.filter(PoolReservedRange.pool_id == pool_id)
+        return [
+            {"pool_id": row.pool_id, "start": row.start_ip, "end": row.end_ip, "size": row.size}
+            for row in query.order_by(PoolReservedRange.start_int, PoolReservedRange.end_int)
+        ]
+    
     def get_available_ips(self, pool_id: int) -> List[str]:
         """Get all available IP addresses in a pool"""
-        pool = self.db.query(IPPool).filter(IPPool.id == pool_id).first()
+        pool = self.db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
         if not pool:
             raise ValueError(f"Pool {pool_id} not found")
         
-        network = ipaddress.IPv4Network(pool.cidr, strict=False)
-        all_ips = [str(ip) for ip in network.hosts()]  # Exclude network and broadcast
-        
-        # Get reserved IPs
-        reserved_ips = set()
-        if pool.reserved_ranges:
-            reserved_ranges = json.loads(pool.reserved_ranges)
-            for range_def in reserved_ranges:
-                start_ip = ipaddress.IPv4Address(range_def["start"])
-                end_ip = ipaddress.IPv4Address(range_def["end"])
-                for i in range(int(start_ip), int(end_ip) + 1):
-                    reserved_ips.add(str(ipaddress.IPv4Address(i)))
-        
-        # Get allocated IPs
-        allocated_ips = set()
-        allocations = self.db.query(IPAllocation).filter(
-            IPAllocation.pool_id == pool_id,
-            IPAllocation.is_active == True
-        ).all()
+        # Reserved, allocated and quarantined IPs are all tracked by the index
+        index = get_pool_index(self.db, pool)
+        with index.lock:
+            index.release_expired()
+            return index.free_addresses()
+    
+    def _hold_address(self, pool_id: int, client_id: Optional[str], strategy: str) -> Tuple[bool, str, Optional[str]]:
+        """
+        Pick a free address with a strategy and hold it in the pool index
+        
+        Concurrent callers skip a held address. It must be given back with
+        _unhold_index() if the allocation is not committed.
+        
+        Returns: (success, message, ip_address)
+        """
+        with instrumentation.phase("pool_load"):
+            # From the identity map when the session already loaded it, as in group commits
+            pool = self.db.get(IPPool, pool_id)
+        if not pool:
+            metrics.allocation_failures_total.inc(operation="allocate", reason="pool_not_found")
+            return False, f"Pool {pool_id} not found", None
+        
+        if not pool.is_active:
+            metrics.allocation_failures_total.inc(operation="allocate", reason="pool_inactive")
+            return False, f"Pool {pool.name} is inactive", None
+        
+        # Apply allocation strategy against the pool's free-space index
+        strategy_class = self.STRATEGIES.get(strategy, FirstFitStrategy)
+        with instrumentation.phase("index_load"):
+            index = get_pool_index(self.db, pool)
+        with _index_locked(index):
+            with instrumentation.phase("release_expired"):
+                index.release_expired()
+            if index.free_count <= 0:
+                metrics.allocation_failures_total.inc(operation="allocate", reason="pool_exhausted")
+                return False, "No available IP addresses in pool", None
+            with instrumentation.phase("strategy"):
+                offset = strategy_class.select(index, client_id)
+            allocated_ip = index.address(offset) if offset is not None else None
+            if allocated_ip:
+                index.mark_allocated(allocated_ip)
+        
+        if not allocated_ip:
+            metrics.allocation_failures_total.inc(operation="allocate", reason="strategy_failed")
+            return False, "Failed to allocate IP using specified strategy", None
+        return True, f"Successfully allocated {allocated_ip}", allocated_ip
+    
+    def _add_allocation(
+        self,
+        pool_id: int,
+        ip_address: str,
+        client_id: Optional[str],
+        client_name: Optional[str],
+        strategy: str,
+        lease_duration: int
+    ):
+        """Add the allocation of a held address, its lease and the log entry to the session"""
+        # Create allocation record
+        allocation = IPAllocation(
+            pool_id=pool_id,
+            ip_address=ip_address,
+            client_id=client_id,
+            client_name=client_name,
+            allocation_type="dynamic",
+            allocation_strategy=strategy,
+            assigned_at=datetime.utcnow(),
+            last_seen=datetime.utcnow(),
+            is_active=True
+        )
+        
+        self.db.add(allocation)
+        
+        # Create lease, linked through the relationship so one flush inserts both
+        lease = IPLease(
+            pool_id=pool_id,
+            allocation=allocation,
+            lease_duration=lease_duration,
+            lease_start=datetime.utcnow(),
+            lease_end=datetime.utcnow() + timedelta(seconds=lease_duration)
+        )
+        
+        self.db.add(lease)
         
-        for allocation in allocations:
-            allocated_ips.add(allocation.ip_address)
+        # Log the allocation
+        log_entry = AllocationLog(
+            pool_id=pool_id,
+            ip_address=ip_address,
+            action="allocate",
+            client_id=client_id,
+            details=json.dumps({
+                "strategy": strategy,
+                "lease_duration": lease_duration,
+                "client_name": client_name
+            }),
+            success=True
+        )
         
-        # Return available IPs
-        unavailable = reserved_ips | allocated_ips
-        return [ip for ip in all_ips if ip not in unavailable]
+        self.db.add(log_entry)
     
+    def _log_allocation_error(self, pool_id: int, client_id: Optional[str], error_msg: str):
+        """Add a failed allocation to the log"""
+        metrics.allocation_failures_total.inc(operation="allocate", reason="error")
+        self.db.add(AllocationLog(
+            pool_id=pool_id,
+            action="allocate",
+            client_id=client_id,
+            success=False,
+            error_message=error_msg
+        ))
+    
+    @instrumentation.operation("allocate_next_ip")
     def allocate_next_ip(
         self,
         pool_id: int,
@@ -152,98 +450,59 @@ class IPAllocator:
         """
         Allocate the next available IP address
         
+        An address another writer allocated behind the cached pool index
+        fails the commit on the unique index of active addresses; the pool
+        index is then rebuilt from the database and the allocation retried
+        once.
+        
         Returns: (success, message, ip_address)
         """
+        held_ip = None
         try:
-            pool = self.db.query(IPPool).filter(IPPool.id == pool_id).first()
-            if not pool:
-                return False, f"Pool {pool_id} not found", None
-            
-            if not pool.is_active:
-                return False, f"Pool {pool.name} is inactive", None
-            
-            # Get available IPs
-            available_ips = self.get_available_ips(pool_id)
-            if not available_ips:
-                return False, "No available IP addresses in pool", None
-            
-            # Get allocated IPs for strategy
-            allocations = self.db.query(IPAllocation).filter(
-                IPAllocation.pool_id == pool_id,
-                IPAllocation.is_active == True
-            ).all()
-            allocated_ips = {alloc.ip_address for alloc in allocations}
-            
-            # Apply allocation strategy
-            strategy_class = self.STRATEGIES.get(strategy, FirstFitStrategy)
-            allocated_ip = strategy_class.allocate(available_ips, allocated_ips)
-            
-            if not allocated_ip:
-                return False, "Failed to allocate IP using specified strategy", None
-            
-            # Create allocation record
-            allocation = IPAllocation(
-                pool_id=pool_id,
-                ip_address=allocated_ip,
-                client_id=client_id,
-                client_name=client_name,
-                allocation_type="dynamic",
-                allocation_strategy=strategy,
-                assigned_at=datetime.utcnow(),
-                last_seen=datetime.utcnow(),
-                is_active=True
-            )
-            
-            self.db.add(allocation)
-            self.db.flush()  # Get the allocation ID
-            
-            # Create lease
-            lease = IPLease(
-                pool_id=pool_id,
-                allocation_id=allocation.id,
-                lease_duration=lease_duration,
-                lease_start=datetime.utcnow(),
-                lease_end=datetime.utcnow() + timedelta(seconds=lease_duration)
-            )
-            
-            self.db.add(lease)
-            
-            # Log the allocation
-            log_entry = AllocationLog(
-                pool_id=pool_id,
-                ip_address=allocated_ip,
-                action="allocate",
-                client_id=client_id,
-                details=json.dumps({
-                    "strategy": strategy,
-                    "lease_duration": lease_duration,
-                    "client_name": client_name
-                }),
-                success=True
-            )
+            for attempt in range(2):
+                success, message, held_ip = self._hold_address(pool_id, client_id, strategy)
+                if not success:
+                    return False, message, None
+                
+                self._add_allocation(pool_id, held_ip, client_id, client_name, strategy, lease_duration)
+                try:
+                    with instrumentation.phase("commit"):
+                        self.db.commit()
+                except IntegrityError:
+                    if attempt:
+                        raise
+                    self.db.rollback()
+                    self._forget_stale_index(pool_id, held_ip)
+                    held_ip = None
+                    continue
+                metrics.allocations_total.inc(pool_id=pool_id, strategy=strategy)
+                forecaster.record(pool_id, 1)
+                
+                return True, message, held_ip
             
-            self.db.add(log_entry)
+        except IntegrityError as e:
+            # Conflicted again after the rebuild: drop the index instead of freeing the address in it
+            self.db.rollback()
+            if held_ip:
+                invalidate_pool_index(pool_id)
+            error_msg = f"Error allocating IP: {str(e)}"
+            self._log_allocation_error(pool_id, client_id, error_msg)
             self.db.commit()
-            
-            return True, f"Successfully allocated {allocated_ip}", allocated_ip
+            return False, error_msg, None
             
         except Exception as e:
             self.db.rollback()
+            if held_ip:
+                self._unhold_index(pool_id, held_ip)
             error_msg = f"Error allocating IP: {str(e)}"
             
             # Log the error
-            log_entry = AllocationLog(
-                pool_id=pool_id,
-                action="allocate",
-                client_id=client_id,
-                success=False,
-                error_message=error_msg
-            )
-            self.db.add(log_entry)
+            self._log_allocation_error(pool_id, client_id, error_msg)
             self.db.commit()
             
             return False, error_msg, None
     
+    @instrumentation.operation("reserve_specific_ip")
     def reserve_specific_ip(
         self,
         pool_id: int,
@@ -257,9 +516,12 @@ class IPAllocator:
         
         Returns: (success, message)
         """
+        held_ip = None
         try:
-            pool = self.db.query(IPPool).filter(IPPool.id == pool_id).first()
+            with instrumentation.phase("pool_load"):
+                pool = self.db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
             if not pool:
+                metrics.allocation_failures_total.inc(operation="reserve", reason="pool_not_found")
                 return False, f"Pool {pool_id} not found"
             
             # Validate IP is in pool range
@@ -267,14 +529,27 @@ class IPAllocator:
             try:
                 target_ip = ipaddress.IPv4Address(ip_address)
                 if target_ip not in network:
+                    metrics.allocation_failures_total.inc(operation="reserve", reason="out_of_range")
                     return False, f"IP {ip_address} is not in pool range {pool.cidr}"
             except ipaddress.AddressValueError:
+                metrics.allocation_failures_total.inc(operation="reserve", reason="invalid_address")
                 return False, f"Invalid IP address: {ip_address}"
             
             # Check if IP is available
-            available_ips = self.get_available_ips(pool_id)
-            if ip_address not in available_ips:
-                return False, f"IP {ip_address} is not available (allocated or reserved)"
+            with instrumentation.phase("index_load"):
+                index = get_pool_index(self.db, pool)
+            with _index_locked(index):
+                with instrumentation.phase("release_expired"):
+                    index.release_expired()
+                offset = index.offset(ip_address)
+                if offset is not None and index.state[offset] == QUARANTINED:
+                    metrics.allocation_failures_total.inc(operation="reserve", reason="quarantined")
+                    return False, f"IP {ip_address} is quarantined until {index.quarantined_until(offset)}"
+                if offset is None or not index.is_free(offset):
+                    metrics.allocation_failures_total.inc(operation="reserve", reason="unavailable")
+                    return False, f"IP {ip_address} is not available (allocated or reserved)"
+                index.mark_allocated(ip_address)
+                held_ip = ip_address
             
             # Create allocation record
             allocation = IPAllocation(
@@ -290,7 +565,8 @@ class IPAllocator:
             )
             
             self.db.add(allocation)
-            self.db.flush()
+            with instrumentation.phase("flush"):
+                self.db.flush()
             
             # Create lease
             lease = IPLease(
@@ -317,13 +593,27 @@ class IPAllocator:
             )
             
             self.db.add(log_entry)
-            self.db.commit()
+            with instrumentation.phase("commit"):
+                self.db.commit()
+            metrics.allocations_total.inc(pool_id=pool_id, strategy="manual")
+            forecaster.record(pool_id, 1)
             
             return True, f"Successfully reserved {ip_address}"
             
+        except IntegrityError:
+            # Allocated by a writer the cached pool index did not see
+            self.db.rollback()
+            if held_ip:
+                self._forget_stale_index(pool_id, held_ip)
+            metrics.allocation_failures_total.inc(operation="reserve", reason="unavailable")
+            return False, f"IP {ip_address} is not available (allocated or reserved)"
+            
         except Exception as e:
             self.db.rollback()
+            if held_ip:
+                self._unhold_index(pool_id, held_ip)
             error_msg = f"Error reserving IP: {str(e)}"
+            metrics.allocation_failures_total.inc(operation="reserve", reason="error")
             
             # Log the error
             log_entry = AllocationLog(
@@ -339,6 +629,7 @@ class IPAllocator:
             
             return False, error_msg
     
+    @instrumentation.operation("deallocate_ip")
     def deallocate_ip(self, allocation_id: int) -> Tuple[bool, str]:
         """
         Deallocate an IP address
@@ -346,9 +637,8 @@ class IPAllocator:
         Returns: (success, message)
         """
         try:
-            allocation = self.db.query(IPAllocation).filter(
-                IPAllocation.id == allocation_id
-            ).first()
+            with instrumentation.phase("load"):
+                allocation = self.db.execute(ALLOCATION_WITH_LEASE, {"allocation_id": allocation_id}).scalar()
             
             if not allocation:
                 return False, f"Allocation {allocation_id} not found"
@@ -358,10 +648,13 @@ class IPAllocator:
             
             # Deactivate allocation
             allocation.is_active = False
+            allocation.released_at = datetime.utcnow()
             
             # Expire lease if exists
-            if allocation.lease:
-                allocation.lease.is_expired = True
+            with instrumentation.phase("load_lease"):
+                lease = allocation.lease
+            if lease:
+                lease.is_expired = True
             
             # Log the deallocation
             log_entry = AllocationLog(
@@ -373,7 +666,12 @@ class IPAllocator:
             )
             
             self.db.add(log_entry)
-            self.db.commit()
+            with instrumentation.phase("commit"):
+                self.db.commit()
+            with instrumentation.phase("index"):
+                self._release_index(allocation.pool_id, allocation.ip_address)
+            metrics.deallocations_total.inc(pool_id=allocation.pool_id)
+            forecaster.record(allocation.pool_id, -1)
             
             return True, f"Successfully deallocated {allocation.ip_address}"
             
@@ -381,6 +679,7 @@ class IPAllocator:
             self.db.rollback()
             return False, f"Error deallocating IP: {str(e)}"
     
+    @instrumentation.operation("renew_lease")
     def renew_lease(self, lease_id: int, extension_seconds: int = 86400) -> Tuple[bool, str]:
         """
         Renew an IP lease
@@ -388,11 +687,14 @@ class IPAllocator:
         Returns: (success, message)
         """
         try:
-            lease = self.db.query(IPLease).filter(IPLease.id == lease_id).first()
+            with instrumentation.phase("load"):
+                lease = self.db.execute(LEASE_WITH_ALLOCATION, {"lease_id": lease_id}).scalar()
             if not lease:
+                metrics.lease_renewals_total.inc(result="not_found")
                 return False, f"Lease {lease_id} not found"
             
             if lease.renewal_count >= lease.max_renewals:
+                metrics.lease_renewals_total.inc(result="max_renewals")
                 return False, f"Maximum renewals ({lease.max_renewals}) reached"
             
             # Extend lease
@@ -401,17 +703,23 @@ class IPAllocator:
             lease.is_expired = False
             
             # Update allocation last seen
-            if lease.allocation:
-                lease.allocation.last_seen = datetime.utcnow()
+            with instrumentation.phase("load_allocation"):
+                allocation = lease.allocation
+            if allocation:
+                allocation.last_seen = datetime.utcnow()
             
-            self.db.commit()
+            with instrumentation.phase("commit"):
+                self.db.commit()
+            metrics.lease_renewals_total.inc(result="renewed")
             
             return True, f"Lease renewed until {lease.lease_end}"
             
         except Exception as e:
             self.db.rollback()
+            metrics.lease_renewals_total.inc(result="error")
             return False, f"Error renewing lease: {str(e)}"
     
+    @instrumentation.operation("cleanup_expired_leases")
     def cleanup_expired_leases(self) -> int:
         """
         Clean up expired leases and deallocate their IPs
@@ -420,34 +728,52 @@ class IPAllocator:
         """
         try:
             # Find expired leases
-            expired_leases = self.db.query(IPLease).filter(
-                IPLease.lease_end < datetime.utcnow(),
-                IPLease.is_expired == False
-            ).all()
+            with instrumentation.phase("query"):
+                # With their allocations in the same statement, not one SELECT per lease
+                expired_leases = self.db.query(IPLease).options(
+                    joinedload(IPLease.allocation)
+                ).filter(
+                    IPLease.lease_end < datetime.utcnow(),
+                    IPLease.is_expired == False
+                ).all()
             
             cleaned_count = 0
-            for lease in expired_leases:
-                # Mark lease as expired
-                lease.is_expired = True
+            released = []
+            logs = []
+            with instrumentation.phase("update"):
+                for lease in expired_leases:
+                    # Mark lease as expired
+                    lease.is_expired = True
                 
-                # Deactivate allocation
-                if lease.allocation and lease.allocation.is_active:
-                    lease.allocation.is_active = False
+                    # Deactivate allocation
+                    if lease.allocation and lease.allocation.is_active:
+                        lease.allocation.is_active = False
+                        lease.allocation.released_at = datetime.utcnow()
                     
-                    # Log the expiration
-                    log_entry = AllocationLog(
-                        pool_id=lease.pool_id,
-                        ip_address=lease.allocation.ip_address,
-                        action="expire",
-                        client_id=lease.allocation.client_id,
-                        details=json.dumps({"lease_id": lease.id}),
-                        success=True
-                    )
-                    self.db.add(log_entry)
+                        # Log the expiration
+                        logs.append({
+                            "pool_id": lease.pool_id,
+                            "ip_address": lease.allocation.ip_address,
+                            "action": "expire",
+                            "client_id": lease.allocation.client_id,
+                            "details": json.dumps({"lease_id": lease.id}),
+                            "success": True
+                        })
+                        released.append((lease.pool_id, lease.allocation.ip_address))
                     
-                    cleaned_count += 1
-            
-            self.db.commit()
+                        cleaned_count += 1
+            
+            # One multi-row INSERT per shard, the ORM would insert the log entries one by one
+            for shard_logs in group_rows(self.db, logs):
+                self.db.execute(insert(AllocationLog.__table__), shard_logs)
+            
+            with instrumentation.phase("commit"):
+                self.db.commit()
+            with instrumentation.phase("index"):
+                for pool_id, ip_address in released:
+                    self._release_index(pool_id, ip_address)
+                    metrics.lease_expiries_total.inc(pool_id=pool_id)
+                    forecaster.record(pool_id, -1)
             return cleaned_count
             
         except Exception as e:
@@ -0,0 +1,934 @@
+"""
+Event-sourced allocation journal
+
+A storage engine for nodes that only hand out addresses and should not need a
+database: pool state is kept in memory, a PoolIndex per pool plus the active
+allocations, and every change is appended to a binary journal as an event
+before it is acknowledged. Opening the journal loads the latest snapshot and
+replays the events written since.
+
+    allocator = JournalAllocator("blackz_allocator.journal")
+    success, message, pool_id = allocator.create_pool("edge", "10.20.0.0/16")
+    success, message, ip_address = allocator.allocate_next_ip(pool_id, client_id="aa:bb")
+
+The methods return the same tuples as IPAllocator's. Leases belong to their
+allocation and share its ID.
+
+File layout, all integers little-endian:
+
+    journal   header (magic, version, generation), then records
+    snapshot  header (magic, version, generation, created_at, next IDs,
+              record count), records, CRC32 trailer
+    record    event type, payload length, payload CRC32, payload
+
+A record cut short or failing its checksum ends the journal; it is what a
+crash in the middle of an append leaves behind, and it is truncated away on
+open. Writers append under the lock, then wait for an fsync covering their
+record. Whoever reaches the fsync first syncs for everyone waiting, so
+concurrent writers share fsyncs.
+
+Compaction writes the current state as a snapshot, in the same record
+format, and starts the next journal generation. A journal whose generation
+is older than the snapshot's was compacted into it and is ignored.
+"""
+
+import ipaddress
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .ip_allocator import IPAllocator, FirstFitStrategy
+from .pool_index import PoolIndex, QUARANTINED
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MAGIC = b"BLKZJRNL"
+JOURNAL_SNAPSHOT_MAGIC = b"BLKZJSNP"
+JOURNAL_VERSION = 1
+DEFAULT_JOURNAL_PATH = "blackz_allocator.journal"
+DEFAULT_COMPACT_EVERY = 100000  # Records appended before the journal is compacted
+DEFAULT_MAX_RENEWALS = 3
+
+# Event types
+EVENT_POOL = 1
+EVENT_DROP_POOL = 2
+EVENT_ALLOCATE = 3
+EVENT_FREE = 4
+EVENT_RENEW = 5
+EVENT_EXPIRE = 6
+EVENT_QUARANTINE = 7  # Snapshots only: an address still in its cooldown
+
+_JOURNAL_HEADER = struct.Struct("<8sHQ")
+# magic, version, generation, created_at, next pool ID, next allocation ID, records
+_SNAPSHOT_HEADER = struct.Struct("<8sHQdIII")
+_TRAILER = struct.Struct("<I")
+_RECORD = struct.Struct("<BII")
+_STRING = struct.Struct("<H")
+_NO_STRING = 0xFFFF
+
+# pool_id, quarantine_seconds, created_at, reserved range count; then name, CIDR, ranges
+_POOL = struct.Struct("<IIdH")
+_RANGE = struct.Struct("<II")
+_DROP_POOL = struct.Struct("<I")
+# allocation_id, pool_id, ip_int, lease_duration, renewal_count, assigned_at,
+# last_seen, lease_end, static; then strategy, client_id, client_name
+_ALLOCATE = struct.Struct("<IIIIIddd?")
+# allocation_id, at, for frees and expiries
+_RELEASE = struct.Struct("<Id")
+# allocation_id, at, lease_end
+_RENEW = struct.Struct("<Idd")
+# pool_id, ip_int, released_at
+_QUARANTINE = struct.Struct("<IId")
+
+_EPOCH = datetime(1970, 1, 1)
+_U32_MAX = 0xFFFFFFFF
+
+class JournalError(Exception):
+    """Raised when a journal or its snapshot cannot be read or written"""
+
+def _to_epoch(value: datetime) -> float:
+    return (value - _EPOCH).total_seconds()
+
+def _from_epoch(value: float) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+def _check_u32(name: str, value: int):
+    """Raise ValueError unless a value fits an unsigned 32-bit journal field"""
+    if not 0 <= value <= _U32_MAX:
+        raise ValueError(f"{name} must be between 0 and {_U32_MAX}")
+
+def _pack_strings(*values: Optional[str]) -> bytes:
+    chunks = []
+    for value in values:
+        if value is None:
+            chunks.append(_STRING.pack(_NO_STRING))
+            continue
+        data = value.encode()
+        if len(data) >= _NO_STRING:
+            raise ValueError("String too long for the journal")
+        chunks.append(_STRING.pack(len(data)))
+        chunks.append(data)
+    return b"".join(chunks)
+
+def _unpack_strings(payload: bytes, position: int, count: int) -> Tuple[List[Optional[str]], int]:
+    values = []
+    for _ in range(count):
+        (length,) = _STRING.unpack_from(payload, position)
+        position += _STRING.size
+        if length == _NO_STRING:
+            values.append(None)
+            continue
+        values.append(payload[position:position + length].decode())
+        position += length
+    return values, position
+
+def _record(event: int, payload: bytes) -> bytes:
+    return _RECORD.pack(event, len(payload), zlib.crc32(payload)) + payload
+
+def _read_records(data: bytes, position: int) -> Iterator[Tuple[int, bytes, int]]:
+    """
+    Yield (event, payload, end position) for each intact record
+
+    Stops at the first record that is cut short or fails its checksum.
+    """
+    while position + _RECORD.size <= len(data):
+        event, length, crc = _RECORD.unpack_from(data, position)
+        start = position + _RECORD.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            return
+        position = start + length
+        yield event, payload, position
+
+class JournalPool:
+    """A pool and the free-space index over its addresses"""
+
+    def __init__(
+        self,
+        pool_id: int,
+        name: str,
+        cidr: str,
+        reserved: List[Tuple[int, int]],
+        quarantine_seconds: int,
+        created_at: datetime
+    ):
+        self.id = pool_id
+        self.name = name
+        self.cidr = cidr
+        self.reserved = reserved
+        self.quarantine_seconds = quarantine_seconds
+        self.created_at = created_at
+        self.allocations: Dict[int, "JournalAllocation"] = {}  # Active ones, by integer address
+        self.index: Optional[PoolIndex] = None
+
+    def build_index(self, allocated: Iterable[int] = ()):
+        self.index = PoolIndex(
+            self.cidr, self.reserved, allocated, pool_id=self.id, quarantine_seconds=self.quarantine_seconds
+        )
+        self.index.pool_name = self.name
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "cidr": self.cidr,
+            "reserved_ranges": [
+                {"start": str(ipaddress.IPv4Address(start)), "end": str(ipaddress.IPv4Address(end))}
+                for start, end in self.reserved
+            ],
+            "quarantine_seconds": self.quarantine_seconds,
+            "created_at": self.created_at
+        }
+
+class JournalAllocation:
+    """An active allocation and its lease"""
+
+    def __init__(
+        self,
+        allocation_id: int,
+        pool_id: int,
+        ip_int: int,
+        client_id: Optional[str],
+        client_name: Optional[str],
+        allocation_type: str,
+        strategy: str,
+        assigned_at: datetime,
+        lease_duration: int,
+        lease_end: datetime,
+        renewal_count: int = 0,
+        last_seen: Optional[datetime] = None
+    ):
+        self.id = allocation_id
+        self.pool_id = pool_id
+        self.ip_int = ip_int
+        self.ip_address = str(ipaddress.IPv4Address(ip_int))
+        self.client_id = client_id
+        self.client_name = client_name
+        self.allocation_type = allocation_type
+        self.strategy = strategy
+        self.assigned_at = assigned_at
+        self.last_seen = last_seen or assigned_at
+        self.lease_duration = lease_duration
+        self.lease_end = lease_end
+        self.renewal_count = renewal_count
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "pool_id": self.pool_id,
+            "ip_address": self.ip_address,
+            "client_id": self.client_id,
+            "client_name": self.client_name,
+            "allocation_type": self.allocation_type,
+            "allocation_strategy": self.strategy,
+            "assigned_at": self.assigned_at,
+            "last_seen": self.last_seen,
+            "lease_duration": self.lease_duration,
+            "lease_end": self.lease_end,
+            "renewal_count": self.renewal_count,
+            "max_renewals": DEFAULT_MAX_RENEWALS
+        }
+
+    def pack(self) -> bytes:
+        return _ALLOCATE.pack(
+            self.id, self.pool_id, self.ip_int, self.lease_duration, self.renewal_count,
+            _to_epoch(self.assigned_at), _to_epoch(self.last_seen), _to_epoch(self.lease_end),
+            self.allocation_type == "static"
+        ) + _pack_strings(self.strategy, self.client_id, self.client_name)
+
+    @classmethod
+    def unpack(cls, payload: bytes) -> "JournalAllocation":
+        (allocation_id, pool_id, ip_int, lease_duration, renewal_count,
+         assigned_at, last_seen, lease_end, static) = _ALLOCATE.unpack_from(payload)
+        (strategy, client_id, client_name), _ = _unpack_strings(payload, _ALLOCATE.size, 3)
+        return cls(
+            allocation_id, pool_id, ip_int, client_id, client_name,
+            "static" if static else "dynamic", strategy,
+            _from_epoch(assigned_at), lease_duration, _from_epoch(lease_end),
+            renewal_count, _from_epoch(last_seen)
+        )
+
+class JournalAllocator:
+    """Allocation engine keeping its state in memory and its changes in a journal"""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_JOURNAL_PATH,
+        fsync: bool = True,
+        compact_every: int = DEFAULT_COMPACT_EVERY
+    ):
+        if compact_every < 1:
+            raise ValueError("compact_every must be at least 1")
+        self.path = path
+        self.snapshot_path = f"{path}.snap"
+        self.fsync = fsync
+        self.compact_every = compact_every
+
+        self.pools: Dict[int, JournalPool] = {}
+        self.allocations: Dict[int, JournalAllocation] = {}
+        self.next_pool_id = 1
+        self.next_allocation_id = 1
+        self.generation = 0
+        self.records = 0  # Appended since the last compaction
+
+        # Guards the state and the order of appends; the sync lock is taken first
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock()
+        self.file = None
+        self.written = 0  # Bytes appended since opening, across generations
+        self.synced = 0
+        self.appended = 0  # Records appended since opening
+        self.synced_records = 0
+        self.failed: Optional[Exception] = None
+
+        self.recovery = self._recover()
+
+    # Recovery
+
+    def _recover(self) -> Dict[str, object]:
+        """Load the snapshot, replay the journal and open it for appending"""
+        started = time.perf_counter()
+        snapshot_records = self._load_snapshot() if os.path.exists(self.snapshot_path) else 0
+
+        replayed = 0
+        truncated = 0
+        data = b""
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                data = f.read()
+        if len(data) >= _JOURNAL_HEADER.size:
+            magic, version, generation = _JOURNAL_HEADER.unpack_from(data)
+            if magic != JOURNAL_MAGIC:
+                raise JournalError(f"{self.path} is not a journal")
+            if version != JOURNAL_VERSION:
+                raise JournalError(f"Unsupported journal version {version}")
+            if generation > self.generation:
+                raise JournalError(
+                    f"Journal generation {generation} is newer than snapshot generation {self.generation}"
+                )
+            if generation == self.generation:
+                end = _JOURNAL_HEADER.size
+                for event, payload, end in _read_records(data, _JOURNAL_HEADER.size):
+                    self._apply(event, payload)
+                    replayed += 1
+                truncated = len(data) - end
+                self.records = replayed
+                self._open_journal(data[:end] if truncated else None)
+            else:
+                # Written before the last compaction and already in the snapshot
+                self._open_journal(b"")
+        else:
+            # A crash while starting a new generation can leave a short header
+            truncated = len(data)
+            self._open_journal(b"")
+
+        if truncated:
+            logger.warning(f"Truncated {truncated} bytes of incomplete records from {self.path}")
+        result = {
+            "snapshot_records": snapshot_records,
+            "replayed": replayed,
+            "truncated_bytes": truncated,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+        logger.info(f"Opened journal {self.path}: {result}")
+        return result
+
+    def _load_snapshot(self) -> int:
+        """Restore the state saved by the last compaction"""
+        with open(self.snapshot_path, "rb") as f:
+            data = f.read()
+        if len(data) < _SNAPSHOT_HEADER.size + _TRAILER.size:
+            raise JournalError("Journal snapshot is truncated")
+        body, (crc,) = data[:-_TRAILER.size], _TRAILER.unpack(data[-_TRAILER.size:])
+        if zlib.crc32(body) != crc:
+            raise JournalError("Journal snapshot checksum mismatch")
+        magic, version, generation, _, next_pool_id, next_allocation_id, count = _SNAPSHOT_HEADER.unpack_from(body)
+        if magic != JOURNAL_SNAPSHOT_MAGIC:
+            raise JournalError(f"{self.snapshot_path} is not a journal snapshot")
+        if version != JOURNAL_VERSION:
+            raise JournalError(f"Unsupported journal snapshot version {version}")
+
+        # Indexes are built once all allocations are known, not address by address
+        quarantined = []
+        applied = 0
+        for event, payload, _ in _read_records(body, _SNAPSHOT_HEADER.size):
+            if event == EVENT_QUARANTINE:
+                quarantined.append(_QUARANTINE.unpack(payload))
+            else:
+                self._apply(event, payload, build=False)
+            applied += 1
+        if applied != count:
+            raise JournalError(f"Journal snapshot holds {applied} of {count} records")
+        for pool in self.pools.values():
+            pool.build_index(allocation.ip_int for allocation in pool.allocations.values())
+        for pool_id, ip_int, released_at in quarantined:
+            index = self.pools[pool_id].index
+            address = str(ipaddress.IPv4Address(ip_int))
+            index.mark_allocated(address)
+            index.release(address, released_at=_from_epoch(released_at))
+
+        self.generation = generation
+        self.next_pool_id = max(self.next_pool_id, next_pool_id)
+        self.next_allocation_id = max(self.next_allocation_id, next_allocation_id)
+        return applied
+
+    def _apply(self, event: int, payload: bytes, build: bool = True):
+        """Apply one event to the in-memory state"""
+        if event == EVENT_POOL:
+            pool_id, quarantine_seconds, created_at, range_count = _POOL.unpack_from(payload)
+            (name, cidr), position = _unpack_strings(payload, _POOL.size, 2)
+            reserved = [_RANGE.unpack_from(payload, position + n * _RANGE.size) for n in range(range_count)]
+            self._add_pool(JournalPool(pool_id, name, cidr, reserved, quarantine_seconds, _from_epoch(created_at)), build)
+        elif event == EVENT_DROP_POOL:
+            (pool_id,) = _DROP_POOL.unpack(payload)
+            self._drop_pool(pool_id)
+        elif event == EVENT_ALLOCATE:
+            self._add_allocation(JournalAllocation.unpack(payload), build)
+        elif event in (EVENT_FREE, EVENT_EXPIRE):
+            allocation_id, at = _RELEASE.unpack(payload)
+            self._release(self.allocations[allocation_id], _from_epoch(at))
+        elif event == EVENT_RENEW:
+            allocation_id, at, lease_end = _RENEW.unpack(payload)
+            self._renew(self.allocations[allocation_id], _from_epoch(at), _from_epoch(lease_end))
+        else:
+            raise JournalError(f"Unknown journal event {event}")
+
+    # State changes, shared by live operations and replay
+
+    def _add_pool(self, pool: JournalPool, build: bool = True):
+        if build:
+            pool.build_index()
+        self.pools[pool.id] = pool
+        self.next_pool_id = max(self.next_pool_id, pool.id + 1)
+
+    def _drop_pool(self, pool_id: int):
+        pool = self.pools.pop(pool_id)
+        for allocation in pool.allocations.values():
+            self.allocations.pop(allocation.id, None)
+
+    def _add_allocation(self, allocation: JournalAllocation, build: bool = True):
+        pool = self.pools[allocation.pool_id]
+        if build:
+            pool.index.mark_allocated(allocation.ip_address)
+        pool.allocations[allocation.ip_int] = allocation
+        self.allocations[allocation.id] = allocation
+        self.next_allocation_id = max(self.next_allocation_id, allocation.id + 1)
+
+    def _release(self, allocation: JournalAllocation, at: datetime):
+        pool = self.pools[allocation.pool_id]
+        pool.index.release_expired(now=at)
+        pool.index.release(allocation.ip_address, released_at=at)
+        del pool.allocations[allocation.ip_int]
+        del self.allocations[allocation.id]
+
+    def _renew(self, allocation: JournalAllocation, at: datetime, lease_end: datetime):
+        allocation.lease_end = lease_end
+        allocation.last_seen = at
+        allocation.renewal_count += 1
+
+    # Writing
+
+    def _open_journal(self, contents: Optional[bytes]):
+        """
+        Open the journal for appending
+
+        With contents, the file is first replaced by them, or by just a header
+        of the current generation when contents is empty.
+        """
+        if contents is not None:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(contents or _JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, self.generation))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        self.file = open(self.path, "ab")
+
+    def _append(self, event: int, payload: bytes) -> int:
+        """
+        Append a record; the caller holds the lock
+
+        Returns: Position the journal must be synced to for the record to be durable
+        """
+        if self.failed is not None:
+            raise JournalError(f"Journal is read-only after an earlier failure: {self.failed}")
+        record = _record(event, payload)
+        try:
+            self.file.write(record)
+        except OSError as e:
+            self.failed = e
+            raise JournalError(f"Cannot write to {self.path}: {e}")
+        self.written += len(record)
+        self.records += 1
+        self.appended += 1
+        return self.written
+
+    def _commit(self, position: int):
+        """Wait until the journal is durable up to position, syncing for other writers too"""
+        with self.sync_lock:
+            if self.synced >= position:
+                return
+            with self.lock:
+                target = self.written
+                appended = self.appended
+                try:
+                    self.file.flush()
+                except OSError as e:
+                    self.failed = e
+                    raise JournalError(f"Cannot write to {self.path}: {e}")
+            if self.fsync:
+                try:
+                    os.fsync(self.file.fileno())
+                except OSError as e:
+                    # Memory may now be ahead of disk, so stop taking changes
+                    self.failed = e
+                    raise JournalError(f"Cannot sync {self.path}: {e}")
+            metrics.journal_sync_batch_size.observe(appended - self.synced_records)
+            self.synced = target
+            self.synced_records = appended
+        if self.records >= self.compact_every:
+            with self.sync_lock, self.lock:
+                # Another writer may have compacted meanwhile
+                if self.records >= self.compact_every:
+                    self._compact()
+
+    def _write(self, event: int, payload: bytes):
+        """Append a record and wait for it to be durable"""
+        with self.lock:
+            position = self._append(event, payload)
+        self._commit(position)
+
+    def _snapshot_records(self) -> Iterator[bytes]:
+        """Records recreating the current state"""
+        for pool in self.pools.values():
+            reserved = b"".join(_RANGE.pack(start, end) for start, end in pool.reserved)
+            yield _record(EVENT_POOL, _POOL.pack(
+                pool.id, pool.quarantine_seconds, _to_epoch(pool.created_at), len(pool.reserved)
+            ) + _pack_strings(pool.name, pool.cidr) + reserved)
+            for allocation in pool.allocations.values():
+                yield _record(EVENT_ALLOCATE, allocation.pack())
+            cooldown = timedelta(seconds=pool.index.quarantine_seconds)
+            for until, offset in pool.index.quarantine:
+                if pool.index.state[offset] == QUARANTINED:
+                    yield _record(EVENT_QUARANTINE, _QUARANTINE.pack(
+                        pool.id, pool.index.first + offset, _to_epoch(until - cooldown)
+                    ))
+
+    def compact(self) -> Dict[str, object]:
+        """
+        Write the current state to the snapshot and start a new, empty journal
+
+        Returns: Dictionary with the new generation, records and bytes written
+        """
+        with self.sync_lock, self.lock:
+            return self._compact()
+
+    def _compact(self) -> Dict[str, object]:
+        """Compact the journal; the caller holds both locks"""
+        started = time.perf_counter()
+        if self.failed is not None:
+            raise JournalError(f"Journal is read-only after an earlier failure: {self.failed}")
+        generation = self.generation + 1
+        records = list(self._snapshot_records())
+        body = _SNAPSHOT_HEADER.pack(
+            JOURNAL_SNAPSHOT_MAGIC, JOURNAL_VERSION, generation, time.time(),
+            self.next_pool_id, self.next_allocation_id, len(records)
+        ) + b"".join(records)
+        data = body + _TRAILER.pack(zlib.crc32(body))
+        try:
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            # The old journal is now covered by the snapshot
+            self.file.close()
+            self.generation = generation
+            self._open_journal(b"")
+        except OSError as e:
+            self.failed = e
+            raise JournalError(f"Cannot compact {self.path}: {e}")
+        self.records = 0
+        self.synced = self.written
+        self.synced_records = self.appended
+
+        result = {
+            "generation": generation,
+            "records": len(records),
+            "bytes": len(data),
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+        logger.info(f"Compacted journal {self.path}: {result}")
+        return result
+
+    def close(self):
+        """Sync and close the journal"""
+        with self.sync_lock, self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            finally:
+                self.file.close()
+                self.file = None
+
+    # Pools
+
+    def create_pool(
+        self,
+        name: str,
+        cidr: str,
+        reserved_ranges: Optional[List[Dict[str, str]]] = None,
+        quarantine_seconds: int = 0
+    ) -> Tuple[bool, str, Optional[int]]:
+        """
+        Create a pool
+
+        Returns: (success, message, pool_id)
+        """
+        try:
+            network = ipaddress.IPv4Network(cidr, strict=False)
+            reserved = [
+                (int(ipaddress.IPv4Address(r["start"])), int(ipaddress.IPv4Address(r["end"])))
+                for r in reserved_ranges or []
+            ]
+        except (ValueError, KeyError, TypeError) as e:
+            return False, f"Invalid pool definition: {e}", None
+        if any(start > end for start, end in reserved):
+            return False, "Reserved range start must not be after its end", None
+        if len(reserved) > 0xFFFF:
+            return False, "Too many reserved ranges for the journal", None
+        try:
+            _check_u32("quarantine_seconds", quarantine_seconds)
+        except ValueError as e:
+            return False, str(e), None
+
+        try:
+            with self.lock:
+                if any(pool.name == name for pool in self.pools.values()):
+                    return False, f"Pool with name '{name}' already exists", None
+                pool = JournalPool(self.next_pool_id, name, str(network), reserved, quarantine_seconds, datetime.utcnow())
+                position = self._append(EVENT_POOL, _POOL.pack(
+                    pool.id, quarantine_seconds, _to_epoch(pool.created_at), len(reserved)
+                ) + _pack_strings(name, pool.cidr) + b"".join(_RANGE.pack(start, end) for start, end in reserved))
+                self._add_pool(pool)
+            self._commit(position)
+            return True, f"Created pool {name}", pool.id
+        except JournalError as e:
+            return False, f"Error creating pool: {e}", None
+
+    def delete_pool(self, pool_id: int) -> Tuple[bool, str]:
+        """
+        Delete a pool without active allocations
+
+        Returns: (success, message)
+        """
+        try:
+            with self.lock:
+                pool = self.pools.get(pool_id)
+                if pool is None:
+                    return False, f"Pool {pool_id} not found"
+                if pool.allocations:
+                    return False, f"Cannot delete pool with {len(pool.allocations)} active allocations"
+                position = self._append(EVENT_DROP_POOL, _DROP_POOL.pack(pool_id))
+                self._drop_pool(pool_id)
+            self._commit(position)
+            return True, f"Pool '{pool.name}' deleted successfully"
+        except JournalError as e:
+            return False, f"Error deleting pool: {e}"
+
+    def list_pools(self) -> List[Dict[str, object]]:
+        with self.lock:
+            return [pool.to_dict() for pool in sorted(self.pools.values(), key=lambda pool: pool.id)]
+
+    def get_pool(self, pool_id: int) -> Optional[Dict[str, object]]:
+        with self.lock:
+            pool = self.pools.get(pool_id)
+            return pool.to_dict() if pool else None
+
+    def get_pool_utilization(self, pool_id: int) -> Dict[str, any]:
+        """Get pool utilization statistics, as IPAllocator.get_pool_utilization()"""
+        with self.lock:
+            pool = self.pools.get(pool_id)
+            if pool is None:
+                raise ValueError(f"Pool {pool_id} not found")
+            index = pool.index
+            index.release_expired()
+            total_ips = ipaddress.IPv4Network(pool.cidr).num_addresses
+            usable_ips = total_ips - 2
+            # Reserved ranges may overlap or reach past the pool; the index counts each address once
+            reserved_count = index.reserved_count
+            allocated_count = index.allocated_count
+            quarantined_count = index.quarantined_count
+        return {
+            "pool_name": pool.name,
+            "cidr": pool.cidr,
+            "total_ips": total_ips,
+            "usable_ips": usable_ips,
+            "reserved_ips": reserved_count,
+            "allocated_ips": allocated_count,
+            "quarantined_ips": quarantined_count,
+            "available_ips": usable_ips - reserved_count - allocated_count - quarantined_count,
+            "utilization_percent": round(allocated_count / max(1, usable_ips - reserved_count) * 100, 2)
+        }
+
+    def get_available_ips(self, pool_id: int) -> List[str]:
+        with self.lock:
+            pool = self.pools.get(pool_id)
+            if pool is None:
+                raise ValueError(f"Pool {pool_id} not found")
+            pool.index.release_expired()
+            return pool.index.free_addresses()
+
+    # Allocations
+
+    def list_allocations(self, pool_id: Optional[int] = None) -> List[Dict[str, object]]:
+        with self.lock:
+            if pool_id is None:
+                allocations = self.allocations.values()
+            else:
+                pool = self.pools.get(pool_id)
+                allocations = pool.allocations.values() if pool else []
+            return [allocation.to_dict() for allocation in sorted(allocations, key=lambda a: a.id)]
+
+    def get_allocation(self, allocation_id: int) -> Optional[Dict[str, object]]:
+        with self.lock:
+            allocation = self.allocations.get(allocation_id)
+            return allocation.to_dict() if allocation else None
+
+    def find_allocation(self, pool_id: int, ip_address: str) -> Optional[Dict[str, object]]:
+        """Get the active allocation of an address"""
+        with self.lock:
+            pool = self.pools.get(pool_id)
+            if pool is None:
+                return None
+            allocation = pool.allocations.get(int(ipaddress.IPv4Address(ip_address)))
+            return allocation.to_dict() if allocation else None
+
+    def _allocate(
+        self,
+        pool: JournalPool,
+        ip_address: str,
+        client_id: Optional[str],
+        client_name: Optional[str],
+        allocation_type: str,
+        strategy: str,
+        lease_duration: int
+    ) -> Tuple[JournalAllocation, int]:
+        """
+        Mark a free address allocated in the index and record it; the caller holds the lock
+
+        The record is packed before the index is touched, so values that do
+        not fit the journal leave the address free.
+        """
+        _check_u32("lease_duration", lease_duration)
+        _check_u32("allocation ID", self.next_allocation_id)
+        now = datetime.utcnow()
+        allocation = JournalAllocation(
+            self.next_allocation_id, pool.id, int(ipaddress.IPv4Address(ip_address)),
+            client_id, client_name, allocation_type, strategy,
+            now, lease_duration, now + timedelta(seconds=lease_duration)
+        )
+        try:
+            payload = allocation.pack()
+        except struct.error as e:
+            raise ValueError(f"Allocation does not fit the journal: {e}")
+        pool.index.mark_allocated(ip_address)
+        try:
+            position = self._append(EVENT_ALLOCATE, payload)
+        except JournalError:
+            pool.index.mark_free(ip_address)
+            raise
+        self._add_allocation(allocation, build=False)
+        return allocation, position
+
+    def allocate_next_ip(
+        self,
+        pool_id: int,
+        client_id: Optional[str] = None,
+        client_name: Optional[str] = None,
+        strategy: str = "first_fit",
+        lease_duration: int = 86400
+    ) -> Tuple[bool, str, Optional[str]]:
+        """
+        Allocate the next available IP address
+
+        Returns: (success, message, ip_address)
+        """
+        try:
+            with self.lock:
+                pool = self.pools.get(pool_id)
+                if pool is None:
+                    metrics.allocation_failures_total.inc(operation="allocate", reason="pool_not_found")
+                    return False, f"Pool {pool_id} not found", None
+                index = pool.index
+                index.release_expired()
+                if index.free_count <= 0:
+                    metrics.allocation_failures_total.inc(operation="allocate", reason="pool_exhausted")
+                    return False, "No available IP addresses in pool", None
+                strategy_class = IPAllocator.STRATEGIES.get(strategy, FirstFitStrategy)
+                offset = strategy_class.select(index, client_id)
+                if offset is None:
+                    metrics.allocation_failures_total.inc(operation="allocate", reason="strategy_failed")
+                    return False, "Failed to allocate IP using specified strategy", None
+                ip_address = index.address(offset)
+                _, position = self._allocate(
+                    pool, ip_address, client_id, client_name, "dynamic", strategy, lease_duration
+                )
+            self._commit(position)
+            metrics.allocations_total.inc(pool_id=pool_id, strategy=strategy)
+            return True, f"Successfully allocated {ip_address}", ip_address
+        except (JournalError, ValueError) as e:
+            metrics.allocation_failures_total.inc(operation="allocate", reason="error")
+            return False, f"Error allocating IP: {e}", None
+
+    def reserve_specific_ip(
+        self,
+        pool_id: int,
+        ip_address: str,
+        client_id: Optional[str] = None,
+        client_name: Optional[str] = None,
+        lease_duration: int = 86400
+    ) -> Tuple[bool, str]:
+        """
+        Reserve a specific IP address
+
+        Returns: (success, message)
+        """
+        try:
+            with self.lock:
+                pool = self.pools.get(pool_id)
+                if pool is None:
+                    metrics.allocation_failures_total.inc(operation="reserve", reason="pool_not_found")
+                    return False, f"Pool {pool_id} not found"
+                try:
+                    if ipaddress.IPv4Address(ip_address) not in ipaddress.IPv4Network(pool.cidr):
+                        metrics.allocation_failures_total.inc(operation="reserve", reason="out_of_range")
+                        return False, f"IP {ip_address} is not in pool range {pool.cidr}"
+                except ipaddress.AddressValueError:
+                    metrics.allocation_failures_total.inc(operation="reserve", reason="invalid_address")
+                    return False, f"Invalid IP address: {ip_address}"
+                index = pool.index
+                index.release_expired()
+                offset = index.offset(ip_address)
+                if offset is not None and index.state[offset] == QUARANTINED:
+                    metrics.allocation_failures_total.inc(operation="reserve", reason="quarantined")
+                    return False, f"IP {ip_address} is quarantined until {index.quarantined_until(offset)}"
+                if offset is None or not index.is_free(offset):
+                    metrics.allocation_failures_total.inc(operation="reserve", reason="unavailable")
+                    return False, f"IP {ip_address} is not available (allocated or reserved)"
+                _, position = self._allocate(
+                    pool, ip_address, client_id, client_name, "static", "manual", lease_duration
+                )
+            self._commit(position)
+            metrics.allocations_total.inc(pool_id=pool_id, strategy="manual")
+            return True, f"Successfully reserved {ip_address}"
+        except (JournalError, ValueError) as e:
+            metrics.allocation_failures_total.inc(operation="reserve", reason="error")
+            return False, f"Error reserving IP: {e}"
+
+    def deallocate_ip(self, allocation_id: int) -> Tuple[bool, str]:
+        """
+        Deallocate an IP address
+
+        Returns: (success, message)
+        """
+        try:
+            with self.lock:
+                allocation = self.allocations.get(allocation_id)
+                if allocation is None:
+                    return False, f"Allocation {allocation_id} not found"
+                now = datetime.utcnow()
+                position = self._append(EVENT_FREE, _RELEASE.pack(allocation_id, _to_epoch(now)))
+                self._release(allocation, now)
+            self._commit(position)
+            metrics.deallocations_total.inc(pool_id=allocation.pool_id)
+            return True, f"Successfully deallocated {allocation.ip_address}"
+        except JournalError as e:
+            return False, f"Error deallocating IP: {e}"
+
+    def renew_lease(self, lease_id: int, extension_seconds: int = 86400) -> Tuple[bool, str]:
+        """
+        Renew the lease of an allocation; leases share their allocation's ID
+
+        Returns: (success, message)
+        """
+        try:
+            with self.lock:
+                allocation = self.allocations.get(lease_id)
+                if allocation is None:
+                    metrics.lease_renewals_total.inc(result="not_found")
+                    return False, f"Lease {lease_id} not found"
+                if allocation.renewal_count >= DEFAULT_MAX_RENEWALS:
+                    metrics.lease_renewals_total.inc(result="max_renewals")
+                    return False, f"Maximum renewals ({DEFAULT_MAX_RENEWALS}) reached"
+                _check_u32("extension_seconds", extension_seconds)
+                now = datetime.utcnow()
+                lease_end = now + timedelta(seconds=extension_seconds)
+                position = self._append(EVENT_RENEW, _RENEW.pack(lease_id, _to_epoch(now), _to_epoch(lease_end)))
+                self._renew(allocation, now, lease_end)
+            self._commit(position)
+            metrics.lease_renewals_total.inc(result="renewed")
+            return True, f"Lease renewed until {lease_end}"
+        except (JournalError, ValueError, OverflowError) as e:
+            metrics.lease_renewals_total.inc(result="error")
+            return False, f"Error renewing lease: {e}"
+
+    def cleanup_expired_leases(self) -> int:
+        """
+        Release the allocations whose leases have ended
+
+        Returns: Number of leases cleaned up
+        """
+        position = 0
+        expired = []
+        with self.lock:
+            now = datetime.utcnow()
+            for allocation in [a for a in self.allocations.values() if a.lease_end < now]:
+                try:
+                    position = self._append(EVENT_EXPIRE, _RELEASE.pack(allocation.id, _to_epoch(now)))
+                except JournalError as e:
+                    logger.error(f"Error expiring leases: {e}")
+                    break
+                self._release(allocation, now)
+                expired.append(allocation.pool_id)
+        if position:
+            self._commit(position)
+        for pool_id in expired:
+            metrics.lease_expiries_total.inc(pool_id=pool_id)
+        return len(expired)
+
+_journal_allocator: Optional[JournalAllocator] = None
+_journal_lock = threading.Lock()
+
+def get_journal_allocator() -> JournalAllocator:
+    """Get the process-wide journal allocator, opened from the settings on first use"""
+    global _journal_allocator
+    with _journal_lock:
+        if _journal_allocator is None:
+            from database.settings import get_settings
+            settings = get_settings()
+            _journal_allocator = JournalAllocator(
+                settings.journal_path,
+                fsync=settings.journal_fsync,
+                compact_every=settings.journal_compact_every
+            )
+        return _journal_allocator
+
+def close_journal_allocator():
+    """Close the process-wide journal allocator, if it was opened"""
+    global _journal_allocator
+    with _journal_lock:
+        if _journal_allocator is not None:
+            _journal_allocator.close()
+            _journal_allocator = None
@@ -0,0 +1,211 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .instrumentation import Histogram
+from .pool_index import all_pool_indexes
+
+# Prometheus client default buckets, in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+DB_LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class Metric:
+    """Base class for a labelled metric family"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Gauge(Metric):
+    """Gauge whose samples are produced by a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], collect: Callable):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self.collect():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = list(buckets)
+        self.histograms: Dict[Tuple[str, ...], Histogram] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def samples(self) -> Iterable[str]:
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for key, histogram in items:
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.buckets):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                le = 'le="+Inf"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {histogram.count}"
+                yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(histogram.sum)}"
+                yield f"{self.name}_count{_format_labels(self.labelnames, key)} {histogram.count}"
+
+class Registry:
+    """Collection of metric families rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+allocations_total = REGISTRY.register(Counter(
+    "blackz_allocations_total", "IP addresses allocated or reserved", ["pool_id", "strategy"]
+))
+allocation_failures_total = REGISTRY.register(Counter(
+    "blackz_allocation_failures_total", "Failed allocation and reservation attempts", ["operation", "reason"]
+))
+deallocations_total = REGISTRY.register(Counter(
+    "blackz_deallocations_total", "IP addresses deallocated", ["pool_id"]
+))
+lease_renewals_total = REGISTRY.register(Counter(
+    "blackz_lease_renewals_total", "Lease renewal attempts", ["result"]
+))
+lease_expiries_total = REGISTRY.register(Counter(
+    "blackz_lease_expiries_total", "Leases expired by cleanup", ["pool_id"]
+))
+pool_index_conflicts_total = REGISTRY.register(Counter(
+    "blackz_pool_index_conflicts_total", "Addresses a cached pool index offered that another writer had allocated",
+    ["pool_id"]
+))
+archived_rows_total = REGISTRY.register(Counter(
+    "blackz_archived_rows_total", "Rows moved to the history tables", ["table"]
+))
+group_commit_batch_size = REGISTRY.register(HistogramMetric(
+    "blackz_group_commit_batch_size", "Allocations applied per group commit", [], BATCH_SIZE_BUCKETS
+))
+journal_sync_batch_size = REGISTRY.register(HistogramMetric(
+    "blackz_journal_sync_batch_size", "Journal records made durable per sync", [], BATCH_SIZE_BUCKETS
+))
+http_request_duration_seconds = REGISTRY.register(HistogramMetric(
+    "blackz_http_request_duration_seconds", "API request latency", ["method", "route", "status"]
+))
+db_statement_duration_seconds = REGISTRY.register(HistogramMetric(
+    "blackz_db_statement_duration_seconds", "Database statement latency", ["statement"], DB_LATENCY_BUCKETS
+))
+
+def _pool_samples(attribute: str):
+    # Only pools whose index this process has built, so a scrape runs no queries;
+    # a pool appears once it is first allocated from, reserved in or inspected
+    def collect():
+        for index in all_pool_indexes():
+            key = (str(index.pool_id), index.pool_name or "")
+            if attribute == "utilization":
+                usable = index.size - index.reserved_count
+                yield key, index.allocated_count / usable if usable else 0.0
+            elif attribute in ("free_runs", "largest_free_run"):
+                with index.lock:
+                    runs = index.run_lengths
+                    yield key, sum(runs.values()) if attribute == "free_runs" else max(runs, default=0)
+            else:
+                yield key, getattr(index, attribute)
+    return collect
+
+for _name, _attribute, _help in [
+    ("blackz_pool_size", "size", "Usable host addresses in the pool"),
+    ("blackz_pool_allocated", "allocated_count", "Allocated addresses in the pool"),
+    ("blackz_pool_reserved", "reserved_count", "Addresses excluded by reserved ranges"),
+    ("blackz_pool_quarantined", "quarantined_count", "Released addresses still in their cooldown"),
+    ("blackz_pool_free", "free_count", "Addresses available for allocation"),
+    ("blackz_pool_utilization_ratio", "utilization", "Allocated share of non-reserved addresses"),
+    ("blackz_pool_free_runs", "free_runs", "Runs of contiguous free addresses"),
+    ("blackz_pool_largest_free_run", "largest_free_run", "Length of the longest run of free addresses"),
+]:
+    REGISTRY.register(Gauge(
+        _name, f"{_help}; pools with a loaded index only", ["pool_id", "pool_name"], _pool_samples(_attribute)
+    ))
+
+# Statement timing, always on: one perf_counter pair per statement
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._blackz_started = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_blackz_started", None)
+    if started is None:
+        return
+    words = statement.split(None, 1)
+    verb = words[0].upper() if words else "OTHER"
+    db_statement_duration_seconds.observe(time.perf_counter() - started, statement=verb)
@@ -0,0 +1,503 @@
+import heapq
+import ipaddress
+import re
+import threading
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from sqlalchemy.orm import Session
+from database.models import IPPool, PoolReservedRange, IPAllocation, AllocationLog
+
+# Per-address states
+FREE = 0
+ALLOCATED = 1
+RESERVED = 2
+QUARANTINED = 3
+
+# Maps a state byte to 1 if the address is free, else 0
+_FREE_TABLE = bytes([1] + [0] * 255)
+_FREE_RUN = re.compile(b"\x01+")
+
+def host_bounds(cidr: str) -> Tuple[int, int]:
+    """Get the first and last host address of a network as integers"""
+    network = ipaddress.IPv4Network(cidr, strict=False)
+    if network.num_addresses > 2:
+        # Exclude network and broadcast, same as network.hosts()
+        return int(network.network_address) + 1, int(network.broadcast_address) - 1
+    return int(network.network_address), int(network.broadcast_address)
+
+class PoolIndex:
+    """In-memory free-space index for a single pool
+
+    Every host address of the pool is addressed by its offset from the first
+    host address, and its state is kept in one byte of a bytearray. A segment
+    tree of free counts sits on top, so finding the first, next or n-th free
+    address is O(log n) and membership checks are O(1).
+
+    Released addresses can be held back in a quarantine for a cooldown before
+    they become free again. Quarantined addresses wait in a heap ordered by
+    release time and are moved back to free as allocations come in.
+
+    A histogram of free run lengths is kept up to date on every state change,
+    using the tree to find the neighbouring runs in O(log n), so
+    fragmentation can be reported without rescanning the pool.
+    """
+
+    def __init__(
+        self,
+        cidr: str,
+        reserved: Iterable[Tuple[int, int]] = (),
+        allocated_ips: Iterable[Union[str, int]] = (),
+        pool_id: Optional[int] = None,
+        quarantine_seconds: int = 0,
+        reserved_version: int = 0
+    ):
+        self.pool_id = pool_id
+        self.pool_name: Optional[str] = None
+        self.cidr = cidr
+        self.reserved_version = reserved_version
+        self.quarantine_seconds = quarantine_seconds
+
+        self.first, self.last = host_bounds(cidr)
+        self.size = self.last - self.first + 1
+        self.state = bytearray(self.size)
+
+        # Reserved ranges as (start, end) integer addresses
+        for start, end in reserved:
+            start = max(self.first, start)
+            end = min(self.last, end)
+            if start > end:
+                continue
+            start_offset = start - self.first
+            end_offset = end - self.first + 1
+            self.state[start_offset:end_offset] = bytes([RESERVED]) * (end_offset - start_offset)
+        self.reserved_count = self.state.count(RESERVED)
+
+        self.allocated_count = 0
+        for ip in allocated_ips:
+            offset = self.offset(ip)
+            if offset is not None and self.state[offset] == FREE:
+                self.state[offset] = ALLOCATED
+                self.allocated_count += 1
+
+        self.quarantined_count = 0
+        self.quarantine: List[Tuple[datetime, int]] = []
+
+        self._build_tree()
+        self._build_runs()
+        self.lock = threading.RLock()
+
+    @classmethod
+    def restore(
+        cls,
+        cidr: str,
+        state: bytes,
+        pool_id: Optional[int] = None,
+        quarantine_seconds: int = 0,
+        quarantine: Iterable[Tuple[datetime, int]] = (),
+        tree: Optional[array] = None,
+        reserved_version: int = 0
+    ) -> "PoolIndex":
+        """
+        Recreate an index from a saved state array, e.g. one read from a snapshot
+
+        The segment tree is rebuilt from the state unless a saved one is given.
+        """
+        index = cls.__new__(cls)
+        index.pool_id = pool_id
+        index.pool_name = None
+        index.cidr = cidr
+        index.reserved_version = reserved_version
+        index.quarantine_seconds = quarantine_seconds
+        index.first, index.last = host_bounds(cidr)
+        index.size = index.last - index.first + 1
+        if len(state) != index.size:
+            raise ValueError(f"State has {len(state)} entries, pool {cidr} has {index.size} addresses")
+        index.state = bytearray(state)
+        index.reserved_count = index.state.count(RESERVED)
+        index.allocated_count = index.state.count(ALLOCATED)
+        index.quarantined_count = index.state.count(QUARANTINED)
+        index.quarantine = [entry for entry in quarantine if index.state[entry[1]] == QUARANTINED]
+        heapq.heapify(index.quarantine)
+        if tree is None:
+            index._build_tree()
+        else:
+            capacity = len(tree) // 2
+            if capacity < index.size or capacity & (capacity - 1) or tree[1] != index.state.count(FREE):
+                raise ValueError(f"Saved tree does not match the state of pool {cidr}")
+            index.capacity = capacity
+            index.tree = tree
+        index._build_runs()
+        index.lock = threading.RLock()
+        return index
+
+    def _build_tree(self):
+        capacity = 1
+        while capacity < self.size:
+            capacity *= 2
+        self.capacity = capacity
+        tree = array('i', bytes(4 * capacity))
+        tree.extend(self.state.translate(_FREE_TABLE))
+        tree.extend(array('i', bytes(4 * (capacity - self.size))))
+        for node in range(capacity - 1, 0, -1):
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+        self.tree = tree
+
+    def _build_runs(self):
+        self.run_lengths: Counter = Counter(
+            len(match.group()) for match in _FREE_RUN.finditer(self.state.translate(_FREE_TABLE))
+        )
+
+    def _set_state(self, offset: int, value: int):
+        was_free = self.state[offset] == FREE
+        self.state[offset] = value
+        if was_free == (value == FREE):
+            return
+        delta = 1 if value == FREE else -1
+        node = offset + self.capacity
+        while node:
+            self.tree[node] += delta
+            node //= 2
+
+        # Free runs touching the offset on either side
+        left = offset - 1 - self.prev_used(offset - 1)
+        right = self.next_used(offset + 1) - offset - 1
+        runs = self.run_lengths
+        if value == FREE:
+            # Joins the neighbouring runs into one
+            for length in (left, right):
+                if length:
+                    runs[length] -= 1
+                    if not runs[length]:
+                        del runs[length]
+            runs[left + right + 1] += 1
+        else:
+            # Splits the run it was part of
+            merged = left + right + 1
+            runs[merged] -= 1
+            if not runs[merged]:
+                del runs[merged]
+            for length in (left, right):
+                if length:
+                    runs[length] += 1
+
+    def _leftmost_free(self, node: int) -> int:
+        """Descend from a node with free space to its leftmost free offset"""
+        tree = self.tree
+        while node < self.capacity:
+            node *= 2
+            if not tree[node]:
+                node += 1
+        return node - self.capacity
+
+    def next_used(self, start: int) -> int:
+        """Get the lowest non-free offset at or after start, or size if there is none"""
+        if start >= self.size:
+            return self.size
+        tree = self.tree
+        node = start + self.capacity
+        if not tree[node]:
+            return start
+        width = 1
+        while node > 1:
+            if not node & 1 and tree[node + 1] < width:
+                node += 1
+                # Descend to the leftmost leaf that is not free
+                while node < self.capacity:
+                    node *= 2
+                    width //= 2
+                    if tree[node] == width:
+                        node += 1
+                return min(node - self.capacity, self.size)
+            node //= 2
+            width *= 2
+        return self.size
+
+    def prev_used(self, start: int) -> int:
+        """Get the highest non-free offset at or before start, or -1 if there is none"""
+        if start < 0:
+            return -1
+        tree = self.tree
+        node = start + self.capacity
+        if not tree[node]:
+            return start
+        width = 1
+        while node > 1:
+            if node & 1 and tree[node - 1] < width:
+                node -= 1
+                # Descend to the rightmost leaf that is not free
+                while node < self.capacity:
+                    node = 2 * node + 1
+                    width //= 2
+                    if tree[node] == width:
+                        node -= 1
+                return node - self.capacity
+            node //= 2
+            width *= 2
+        return -1
+
+    def fragmentation(self) -> Dict[str, object]:
+        """
+        Summarize how the free space is split up
+        
+        The fragmentation index is 0 when all free addresses form one run and
+        approaches 1 as the free space is scattered into single addresses.
+        """
+        free = self.free_count
+        runs = sum(self.run_lengths.values())
+        largest = max(self.run_lengths) if self.run_lengths else 0
+        histogram: Dict[str, int] = {}
+        for length, count in sorted(self.run_lengths.items()):
+            low = 1 << (length.bit_length() - 1)
+            key = str(low) if low == 1 else f"{low}-{2 * low - 1}"
+            histogram[key] = histogram.get(key, 0) + count
+        return {
+            "free_ips": free,
+            "free_runs": runs,
+            "largest_free_run": largest,
+            "average_free_run": round(free / runs, 2) if runs else 0.0,
+            "fragmentation_index": round(1 - largest / free, 4) if free else 0.0,
+            "run_length_histogram": histogram
+        }
+
+    @property
+    def free_count(self) -> int:
+        """Number of addresses that can be handed out right now"""
+        return self.tree[1]
+
+    def offset(self, ip_address: Union[str, int]) -> Optional[int]:
+        """Get the offset of a dotted or integer address, or None if it is outside the pool"""
+        value = ip_address if isinstance(ip_address, int) else int(ipaddress.IPv4Address(ip_address))
+        if value < self.first or value > self.last:
+            return None
+        return value - self.first
+
+    def address(self, offset: int) -> str:
+        """Get the dotted address at an offset"""
+        return str(ipaddress.IPv4Address(self.first + offset))
+
+    def is_free(self, offset: int) -> bool:
+        return self.state[offset] == FREE
+
+    def first_free(self) -> Optional[int]:
+        """Get the lowest free offset"""
+        if not self.tree[1]:
+            return None
+        return self._leftmost_free(1)
+
+    def next_free(self, start: int) -> Optional[int]:
+        """Get the lowest free offset at or after start, without wrapping"""
+        if start >= self.size:
+            return None
+        node = start + self.capacity
+        if self.tree[node]:
+            return start
+        tree = self.tree
+        while node > 1:
+            if not node & 1 and tree[node + 1]:
+                return self._leftmost_free(node + 1)
+            node //= 2
+        return None
+
+    def nth_free(self, n: int) -> Optional[int]:
+        """Get the n-th free offset (zero based) in offset order"""
+        if n < 0 or n >= self.tree[1]:
+            return None
+        tree = self.tree
+        node = 1
+        while node < self.capacity:
+            node *= 2
+            if n >= tree[node]:
+                n -= tree[node]
+                node += 1
+        return node - self.capacity
+
+    def mark_allocated(self, ip_address: str) -> bool:
+        """Mark an address as allocated. Returns False if it was not free."""
+        offset = self.offset(ip_address)
+        if offset is None or self.state[offset] != FREE:
+            return False
+        self._set_state(offset, ALLOCATED)
+        self.allocated_count += 1
+        return True
+
+    def mark_free(self, ip_address: str) -> bool:
+        """Mark an allocated address as free immediately. Returns False if it was not allocated."""
+        offset = self.offset(ip_address)
+        if offset is None or self.state[offset] != ALLOCATED:
+            return False
+        self._set_state(offset, FREE)
+        self.allocated_count -= 1
+        return True
+
+    def release(self, ip_address: str, released_at: Optional[datetime] = None) -> bool:
+        """
+        Release an allocated address, quarantining it if the pool has a cooldown
+
+        Returns: False if the address was not allocated
+        """
+        if self.quarantine_seconds <= 0:
+            return self.mark_free(ip_address)
+        offset = self.offset(ip_address)
+        if offset is None or self.state[offset] != ALLOCATED:
+            return False
+        released_at = released_at or datetime.utcnow()
+        self._set_state(offset, QUARANTINED)
+        self.allocated_count -= 1
+        self.quarantined_count += 1
+        heapq.heappush(self.quarantine, (released_at + timedelta(seconds=self.quarantine_seconds), offset))
+        return True
+
+    def release_expired(self, now: Optional[datetime] = None) -> int:
+        """
+        Move addresses whose cooldown has passed from quarantine back to free
+
+        Returns: Number of addresses released
+        """
+        if not self.quarantine:
+            return 0
+        now = now or datetime.utcnow()
+        released = 0
+        while self.quarantine and self.quarantine[0][0] <= now:
+            _, offset = heapq.heappop(self.quarantine)
+            if self.state[offset] == QUARANTINED:
+                self._set_state(offset, FREE)
+                self.quarantined_count -= 1
+                released += 1
+        return released
+
+    def quarantined_until(self, offset: int) -> Optional[datetime]:
+        """Get the time a quarantined offset becomes free again"""
+        if self.state[offset] != QUARANTINED:
+            return None
+        return min((until for until, entry in self.quarantine if entry == offset), default=None)
+
+    def free_addresses(self) -> List[str]:
+        """Get all free addresses in offset order"""
+        addresses = []
+        offset = self.first_free()
+        while offset is not None:
+            addresses.append(self.address(offset))
+            offset = self.next_free(offset + 1)
+        return addresses
+
+    def matches(self, pool: IPPool) -> bool:
+        """Check whether the index was built from the pool's current range definition"""
+        return self.cidr == pool.cidr and self.reserved_version == (pool.reserved_version or 0)
+
+# Process-wide index cache, keyed by pool ID
+#
+# Allocations are checked against these indexes instead of the database, so
+# the cache assumes this process makes every change to its pools' addresses.
+# It is refreshed when a pool's range or reserved ranges change, nothing
+# else. Other writers (a second server process, CLI imports, SQL run by
+# hand) leave it stale:
+#   - an address they allocated is still free here; committing it again
+#     fails on the unique index of active addresses, and IPAllocator then
+#     drops the pool's index so it is rebuilt from the database
+#   - an address they released stays taken here until the index is rebuilt
+#     or the process restarts
+_indexes: Dict[int, PoolIndex] = {}
+# Guards the dict only; builds run outside it, one at a time per pool
+_indexes_lock = threading.Lock()
+_build_locks: Dict[int, threading.Lock] = {}
+# Bumped by invalidate_pool_index, so a build that started before is not cached
+_generations: Dict[int, int] = {}
+_generation = 0
+
+def build_pool_index(db: Session, pool: IPPool) -> PoolIndex:
+    """Build a pool index from the database"""
+    # Integer addresses straight from the indexes, no parsing of dotted strings
+    reserved = db.query(PoolReservedRange.start_int, PoolReservedRange.end_int).filter(
+        PoolReservedRange.pool_id == pool.id
+    ).all()
+    rows = db.query(IPAllocation.ip_int).filter(
+        IPAllocation.pool_id == pool.id,
+        IPAllocation.is_active == True
+    ).all()
+    index = PoolIndex(
+        pool.cidr,
+        reserved,
+        (row.ip_int for row in rows),
+        pool_id=pool.id,
+        reserved_version=pool.reserved_version or 0
+    )
+
+    # Rebuild the quarantine from releases that are still inside the cooldown
+    quarantine_seconds = pool.quarantine_seconds or 0
+    if quarantine_seconds > 0:
+        index.quarantine_seconds = quarantine_seconds
+        releases = db.query(AllocationLog.ip_address, AllocationLog.timestamp).filter(
+            AllocationLog.pool_id == pool.id,
+            AllocationLog.action.in_(("deallocate", "expire")),
+            AllocationLog.success == True,
+            AllocationLog.timestamp >= datetime.utcnow() - timedelta(seconds=quarantine_seconds)
+        ).order_by(AllocationLog.id.desc()).all()
+        # Newest first, so an address released twice keeps its latest release time
+        for row in releases:
+            offset = index.offset(row.ip_address)
+            if offset is not None and index.state[offset] == FREE:
+                # Stage as allocated so release() applies the usual bookkeeping
+                index._set_state(offset, ALLOCATED)
+                index.allocated_count += 1
+                index.release(row.ip_address, released_at=row.timestamp)
+    return index
+
+def get_pool_index(db: Session, pool: IPPool) -> PoolIndex:
+    """
+    Get the cached index for a pool, building it on first use or after the pool's range changed
+
+    The build queries the database without holding the cache lock, so a
+    large pool being built does not hold up the other pools. Concurrent
+    callers for the same pool wait for one build and share it.
+    """
+    with _indexes_lock:
+        index = _indexes.get(pool.id)
+        if index is None or not index.matches(pool):
+            index = None
+            build_lock = _build_locks.setdefault(pool.id, threading.Lock())
+    if index is None:
+        with build_lock:
+            while True:
+                # Another caller may have built it while this one waited
+                with _indexes_lock:
+                    index = _indexes.get(pool.id)
+                    generation = (_generation, _generations.get(pool.id, 0))
+                if index is not None and index.matches(pool):
+                    break
+                index = build_pool_index(db, pool)
+                with _indexes_lock:
+                    if generation == (_generation, _generations.get(pool.id, 0)):
+                        _indexes[pool.id] = index
+                        break
+                # Invalidated during the build, which may predate the change
+    # Cooldown changes apply to future releases only
+    index.quarantine_seconds = pool.quarantine_seconds or 0
+    index.pool_name = pool.name
+    return index
+
+def cache_pool_index(index: PoolIndex):
+    """Put a prebuilt index into the cache, replacing any cached index of the same pool"""
+    with _indexes_lock:
+        _indexes[index.pool_id] = index
+
+def peek_pool_index(pool_id: int) -> Optional[PoolIndex]:
+    """Get the cached index for a pool without building it"""
+    return _indexes.get(pool_id)
+
+def all_pool_indexes() -> List[PoolIndex]:
+    """Get every cached pool index"""
+    with _indexes_lock:
+        return list(_indexes.values())
+
+def invalidate_pool_index(pool_id: Optional[int] = None):
+    """Drop the cached index of one pool, or of all pools"""
+    global _generation
+    with _indexes_lock:
+        if pool_id is None:
+            _indexes.clear()
+            _generation += 1
+        else:
+            _indexes.pop(pool_id, None)
+            _generations[pool_id] = _generations.get(pool_id, 0) + 1
@@ -0,0 +1,359 @@
+"""
+Binary snapshots of the in-memory pool indexes
+
+A snapshot holds, for every pool, the per-address state array, the segment
+tree over it, the quarantine heap and the counters, together with a log
+sequence number (LSN): the highest allocation_logs ID whose effect is
+included. Startup loads the snapshot and replays only the log entries after
+the LSN instead of rebuilding every pool from ip_allocations.
+
+File layout, all integers little-endian:
+
+    header   magic, version, LSN, created_at, pool count
+    pool     fixed-size record, then CIDR, quarantine entries,
+             zlib-compressed state and zlib-compressed tree
+    trailer  CRC32 of everything before it
+"""
+
+import logging
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.models import IPPool, AllocationLog
+from database.sharding import get_router
+from .pool_index import (
+    PoolIndex, ALLOCATED, QUARANTINED, build_pool_index, cache_pool_index, peek_pool_index
+)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"BLKZSNAP"
+SNAPSHOT_VERSION = 2
+DEFAULT_SNAPSHOT_PATH = "blackz_allocator.snap"
+
+_HEADER = struct.Struct("<8sHQdI")
+# pool_id, first, size, allocated, reserved, quarantined, quarantine_seconds,
+# CIDR length, reserved ranges version, quarantine entries,
+# compressed state length, state CRC32, compressed tree length, tree CRC32
+_POOL = struct.Struct("<IIIIIIIHIIIIII")
+_QUARANTINE_ENTRY = struct.Struct("<dI")
+_TRAILER = struct.Struct("<I")
+
+# Log actions that change the state of an address
+_ALLOCATE_ACTIONS = ("allocate", "reserve", "import")
+_RELEASE_ACTIONS = ("deallocate", "expire")
+
+_EPOCH = datetime(1970, 1, 1)
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, corrupt or of an unknown version"""
+
+def _to_epoch(value: datetime) -> float:
+    return (value - _EPOCH).total_seconds()
+
+def _from_epoch(value: float) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+def _tree_bytes(tree: array) -> bytes:
+    if sys.byteorder == "big":
+        tree = array("i", tree)
+        tree.byteswap()
+    return tree.tobytes()
+
+def _tree_from_bytes(data: bytes) -> array:
+    tree = array("i")
+    tree.frombytes(data)
+    if sys.byteorder == "big":
+        tree.byteswap()
+    return tree
+
+def _require_single_shard(db: Session):
+    # The LSN is an allocation log ID, and every shard numbers its log separately
+    if get_router(db) is not None:
+        raise SnapshotError("Snapshots are not supported with more than one shard")
+
+def current_lsn(db: Session) -> int:
+    """Get the highest allocation log ID"""
+    _require_single_shard(db)
+    return db.query(func.max(AllocationLog.id)).scalar() or 0
+
+def write_snapshot(path: str, indexes: List[PoolIndex], lsn: int) -> int:
+    """
+    Write pool indexes to a snapshot file, replacing it atomically
+
+    Returns: Size of the written file in bytes
+    """
+    chunks = [_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, lsn, time.time(), len(indexes))]
+    for index in indexes:
+        with index.lock:
+            state = bytes(index.state)
+            tree = _tree_bytes(index.tree)
+            quarantine = [
+                _QUARANTINE_ENTRY.pack(_to_epoch(until), offset)
+                for until, offset in index.quarantine if index.state[offset] == QUARANTINED
+            ]
+            counters = (
+                index.pool_id, index.first, index.size, index.allocated_count,
+                index.reserved_count, index.quarantined_count, index.quarantine_seconds
+            )
+        cidr = index.cidr.encode()
+        packed_state = zlib.compress(state)
+        packed_tree = zlib.compress(tree)
+        chunks.append(_POOL.pack(
+            *counters, len(cidr), index.reserved_version, len(quarantine),
+            len(packed_state), zlib.crc32(state), len(packed_tree), zlib.crc32(tree)
+        ))
+        chunks.extend([cidr, *quarantine, packed_state, packed_tree])
+
+    body = b"".join(chunks)
+    data = body + _TRAILER.pack(zlib.crc32(body))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(data)
+
+def read_snapshot(path: str) -> Dict[str, object]:
+    """
+    Read and check a snapshot file
+
+    Returns: Dictionary with lsn, created_at and the restored pool indexes
+    Raises: SnapshotError if the file is corrupt or of an unknown version
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        raise SnapshotError(f"Cannot read snapshot {path}: {e}")
+
+    if len(data) < _HEADER.size + _TRAILER.size:
+        raise SnapshotError("Snapshot is truncated")
+    body, (crc,) = data[:-_TRAILER.size], _TRAILER.unpack(data[-_TRAILER.size:])
+    if zlib.crc32(body) != crc:
+        raise SnapshotError("Snapshot checksum mismatch")
+    magic, version, lsn, created_at, pool_count = _HEADER.unpack_from(body)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("Not a snapshot file")
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+
+    position = _HEADER.size
+    indexes = []
+    try:
+        for _ in range(pool_count):
+            (pool_id, first, size, allocated, reserved, quarantined, quarantine_seconds,
+             cidr_length, reserved_version, quarantine_length,
+             state_length, state_crc, tree_length, tree_crc) = _POOL.unpack_from(body, position)
+            position += _POOL.size
+            cidr = body[position:position + cidr_length].decode()
+            position += cidr_length
+            quarantine = []
+            for _ in range(quarantine_length):
+                until, offset = _QUARANTINE_ENTRY.unpack_from(body, position)
+                quarantine.append((_from_epoch(until), offset))
+                position += _QUARANTINE_ENTRY.size
+            state = zlib.decompress(body[position:position + state_length])
+            position += state_length
+            tree = zlib.decompress(body[position:position + tree_length])
+            position += tree_length
+
+            if zlib.crc32(state) != state_crc or zlib.crc32(tree) != tree_crc:
+                raise SnapshotError(f"Pool {pool_id} data checksum mismatch")
+            index = PoolIndex.restore(
+                cidr, state,
+                pool_id=pool_id,
+                quarantine_seconds=quarantine_seconds,
+                quarantine=quarantine,
+                tree=_tree_from_bytes(tree),
+                reserved_version=reserved_version
+            )
+            if (index.first, index.size) != (first, size) or (
+                index.allocated_count, index.reserved_count, index.quarantined_count
+            ) != (allocated, reserved, quarantined):
+                raise SnapshotError(f"Pool {pool_id} counters do not match its state")
+            indexes.append(index)
+    except (struct.error, zlib.error, UnicodeDecodeError, ValueError) as e:
+        raise SnapshotError(f"Malformed snapshot: {e}")
+
+    if position != len(body):
+        raise SnapshotError("Trailing data after the last pool")
+    return {"lsn": lsn, "created_at": _from_epoch(created_at), "indexes": indexes}
+
+def replay_logs(db: Session, indexes: Dict[int, PoolIndex], lsn: int,
+                mismatches: Optional[List[str]] = None) -> int:
+    """
+    Apply allocation log entries newer than the LSN to restored indexes
+
+    Entries are applied in ID order, and quarantine time is advanced to each
+    entry's timestamp first so cooldowns expire as they did originally.
+    Entries that do not fit the restored state, an allocation of an address
+    that is not free or an address outside its pool, are skipped, logged and
+    described in mismatches when a list is passed.
+
+    Returns: Number of entries applied
+    """
+    _require_single_shard(db)
+    if not indexes:
+        return 0
+    rows = db.query(
+        AllocationLog.id, AllocationLog.pool_id, AllocationLog.ip_address,
+        AllocationLog.action, AllocationLog.timestamp
+    ).filter(
+        AllocationLog.id > lsn,
+        AllocationLog.success == True,
+        AllocationLog.pool_id.in_(list(indexes)),
+        AllocationLog.action.in_(_ALLOCATE_ACTIONS + _RELEASE_ACTIONS)
+    ).order_by(AllocationLog.id).yield_per(1000)
+
+    applied = 0
+    skipped = []
+    for row in rows:
+        if not row.ip_address:
+            continue
+        index = indexes[row.pool_id]
+        offset = index.offset(row.ip_address)
+        if offset is None:
+            skipped.append(f"Log {row.id}: {row.action} of {row.ip_address} is outside pool {row.pool_id}")
+            continue
+        index.release_expired(now=row.timestamp)
+        if row.action in _ALLOCATE_ACTIONS:
+            if not index.mark_allocated(row.ip_address):
+                skipped.append(f"Log {row.id}: {row.action} of {row.ip_address} in pool {row.pool_id}, "
+                               f"which the snapshot does not have free")
+                continue
+        elif index.state[offset] == ALLOCATED:
+            index.release(row.ip_address, released_at=row.timestamp)
+        applied += 1
+
+    if skipped:
+        logger.warning(f"Skipped {len(skipped)} log entries that do not fit the snapshot, first: {skipped[0]}")
+    if mismatches is not None:
+        mismatches.extend(skipped)
+    return applied
+
+def create_snapshot(db: Session, path: str = DEFAULT_SNAPSHOT_PATH, use_cache: bool = False) -> Dict[str, object]:
+    """
+    Snapshot every pool to a file
+
+    The LSN and the pools are read in one transaction, so the indexes
+    rebuilt from the database hold exactly the log entries up to the LSN.
+
+    With use_cache, indexes already cached in this process are written as
+    they are instead of being rebuilt from the database. They include only
+    this process's own changes and may be ahead of the LSN, so use it only
+    when this process is the sole writer.
+    """
+    started = time.perf_counter()
+    _require_single_shard(db)
+    conn = db.connection()
+    if conn.dialect.name == "sqlite" and not conn.connection.dbapi_connection.in_transaction:
+        # pysqlite runs each SELECT in a transaction of its own; one read
+        # transaction keeps writes committed meanwhile out of both
+        conn.exec_driver_sql("BEGIN")
+    lsn = current_lsn(db)
+    indexes = []
+    for pool in db.query(IPPool).order_by(IPPool.id).all():
+        index = peek_pool_index(pool.id) if use_cache else None
+        if index is None or not index.matches(pool):
+            index = build_pool_index(db, pool)
+        indexes.append(index)
+    size = write_snapshot(path, indexes, lsn)
+    return {
+        "path": path,
+        "lsn": lsn,
+        "pools": len(indexes),
+        "bytes": size,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+def load_snapshot(db: Session, path: str = DEFAULT_SNAPSHOT_PATH) -> Dict[str, object]:
+    """
+    Load a snapshot into the index cache and catch it up from the allocation log
+
+    Pools deleted or re-ranged since the snapshot are skipped and rebuilt
+    from the database on first use as usual.
+    """
+    started = time.perf_counter()
+    snapshot = read_snapshot(path)
+    pools = {pool.id: pool for pool in db.query(IPPool).all()}
+    indexes = {}
+    for index in snapshot["indexes"]:
+        pool = pools.get(index.pool_id)
+        if pool is not None and index.matches(pool):
+            index.pool_name = pool.name
+            index.quarantine_seconds = pool.quarantine_seconds or 0
+            indexes[index.pool_id] = index
+
+    mismatches = []
+    replayed = replay_logs(db, indexes, snapshot["lsn"], mismatches)
+    for index in indexes.values():
+        cache_pool_index(index)
+
+    result = {
+        "path": path,
+        "lsn": snapshot["lsn"],
+        "pools": len(indexes),
+        "skipped": len(snapshot["indexes"]) - len(indexes),
+        "replayed": replayed,
+        "mismatches": len(mismatches),
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+    logger.info(f"Loaded snapshot {path}: {result}")
+    return result
+
+def verify_snapshot(db: Session, path: str = DEFAULT_SNAPSHOT_PATH) -> Dict[str, object]:
+    """
+    Check a snapshot against the database
+
+    Each pool is restored, caught up from the log and compared address by
+    address with an index rebuilt from ip_allocations. Log entries that do
+    not fit the snapshot are reported too.
+
+    Returns: Report with a list of mismatches under "errors"
+    """
+    snapshot = read_snapshot(path)
+    pools = {pool.id: pool for pool in db.query(IPPool).all()}
+    indexes = {}
+    errors = []
+    for index in snapshot["indexes"]:
+        pool = pools.get(index.pool_id)
+        if pool is None:
+            errors.append(f"Pool {index.pool_id} no longer exists")
+        elif not index.matches(pool):
+            errors.append(f"Pool {index.pool_id} range changed since the snapshot")
+        else:
+            index.quarantine_seconds = pool.quarantine_seconds or 0
+            indexes[index.pool_id] = index
+    for pool_id in pools.keys() - {index.pool_id for index in snapshot["indexes"]}:
+        errors.append(f"Pool {pool_id} is not in the snapshot")
+
+    replayed = replay_logs(db, indexes, snapshot["lsn"], errors)
+    now = datetime.utcnow()
+    for pool_id, index in sorted(indexes.items()):
+        expected = build_pool_index(db, pools[pool_id])
+        index.release_expired(now)
+        expected.release_expired(now)
+        if index.state != expected.state:
+            differing = sum(1 for a, b in zip(index.state, expected.state) if a != b)
+            errors.append(f"Pool {pool_id}: {differing} addresses differ from the database")
+
+    return {
+        "path": path,
+        "lsn": snapshot["lsn"],
+        "created_at": snapshot["created_at"].isoformat(),
+        "pools": len(snapshot["indexes"]),
+        "replayed": replayed,
+        "errors": errors,
+        "ok": not errors
+    }
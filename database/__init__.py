@@ -1,24 +1,54 @@
-from .models import Base, IPPool, IPAllocation, IPLease, NetworkInterface, AllocationLog
+from .models import (
+    Base, IPPool, PoolReservedRange, PoolDNSServer, IPAllocation, IPLease, IPAllocationHistory, IPLeaseHistory,
+    NetworkInterface, AllocationLog, ShardIdBlock
+)
 from .connection import (
-    engine,
     SessionLocal,
+    get_engine,
+    get_shard_engines,
+    ensure_database,
     create_tables,
     get_db,
     get_db_session,
+    get_read_engines,
+    get_read_db,
+    get_read_db_session,
     init_database
 )
+from .settings import Settings, SettingsError, get_settings, load_settings
 
 __all__ = [
     "Base",
     "IPPool",
+    "PoolReservedRange",
+    "PoolDNSServer",
     "IPAllocation", 
     "IPLease",
+    "IPAllocationHistory",
+    "IPLeaseHistory",
     "NetworkInterface",
     "AllocationLog",
+    "ShardIdBlock",
     "engine",
+    "get_engine",
+    "get_shard_engines",
+    "ensure_database",
     "SessionLocal",
     "create_tables",
     "get_db",
     "get_db_session",
-    "init_database"
-] 
\ No newline at end of file
+    "get_read_engines",
+    "get_read_db",
+    "get_read_db_session",
+    "init_database",
+    "Settings",
+    "SettingsError",
+    "get_settings",
+    "load_settings"
+] 
+
+def __getattr__(name: str):
+    # The engine is created on first use, not when the package is imported
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
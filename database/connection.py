@@ -1,32 +1,135 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.ext.declarative import declarative_base
-from typing import Generator
-import os
+from typing import AsyncGenerator, List, Optional
+import threading
 from .models import Base
+from .migrations import run_migrations, schema_is_current
+from .settings import Settings, get_settings
+from .sharding import count_rows, sharded_sessionmaker
+from .sqlite_profile import apply_sqlite_profile
 
-# Database configuration
-DATABASE_URL = "sqlite:///./blackz_allocator.db"
+# Nothing touches the database at import time. The engine is created from the
+# settings on first use, and the schema is verified once per process before the
+# first session is handed out.
+_engine: Optional[Engine] = None
+_shard_engines: List[Engine] = []
+_schema_verified = False
+_init_lock = threading.RLock()
 
-# Create SQLAlchemy engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},  # Needed for SQLite
-    echo=False  # Set to True for SQL debugging
-)
+# Bound to the engine when it is created; with more than one shard it only
+# reaches the first, and sessions come from _sharded_sessions instead
+_sessions = sessionmaker(autocommit=False, autoflush=False)
+_sharded_sessions: Optional[sessionmaker] = None
 
-# Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Read-only sessions for GET routes, from their own connection pool
+_read_engines: List[Engine] = []
+_read_sessions: Optional[sessionmaker] = None
+
+def _create_engine(settings: Settings, url: str, read_only: bool = False) -> Engine:
+    engine = create_engine(url, **settings.engine_kwargs(read_only))
+    if make_url(url).get_backend_name() == "sqlite":
+        # WAL, relaxed sync, mmap and busy timeout unless the sqlite_profile says otherwise
+        pragmas = settings.pragmas()
+        if read_only:
+            # The writers set the journal mode, which read-only connections cannot
+            pragmas = {name: value for name, value in pragmas.items() if name != "journal_mode"}
+            pragmas["query_only"] = "ON"
+        apply_sqlite_profile(engine, pragmas)
+    return engine
+
+def get_engine() -> Engine:
+    """Get the SQLAlchemy engine, creating it from the settings on first use"""
+    global _engine, _shard_engines, _sharded_sessions
+    if _engine is None:
+        with _init_lock:
+            if _engine is None:
+                settings = get_settings()
+                engine = _create_engine(settings, settings.database_url)
+                _sessions.configure(bind=engine)
+                if settings.shards > 1:
+                    _shard_engines = [engine] + [_create_engine(settings, url) for url in settings.shard_urls()[1:]]
+                    _sharded_sessions = sharded_sessionmaker(_shard_engines, autoflush=False)
+                else:
+                    _shard_engines = [engine]
+                _engine = engine
+    return _engine
+
+def get_shard_engines() -> List[Engine]:
+    """Get the engine of every shard, the first being get_engine()"""
+    get_engine()
+    return _shard_engines
+
+def _new_session() -> Session:
+    return _sharded_sessions() if _sharded_sessions is not None else _sessions()
+
+def get_read_engines() -> List[Engine]:
+    """
+    Get the engines of read-only sessions, one per shard
+
+    They connect to read_database_url when set, or else to the SQLite files
+    of the database with PRAGMA query_only, in a pool of their own. Other
+    databases without a replica, and in-memory SQLite, are read through the
+    write engines.
+    """
+    global _read_engines, _read_sessions
+    if not _read_engines:
+        with _init_lock:
+            if not _read_engines:
+                settings = get_settings()
+                engines = get_shard_engines()
+                if settings.read_database_url:
+                    urls = settings.shard_urls(settings.read_database_url)
+                elif settings.sqlite_path is not None:
+                    urls = settings.shard_urls()
+                else:
+                    _read_engines = engines
+                    return _read_engines
+                read_engines = [_create_engine(settings, url, read_only=True) for url in urls]
+                if len(read_engines) > 1:
+                    _read_sessions = sharded_sessionmaker(read_engines, autoflush=False)
+                else:
+                    _read_sessions = sessionmaker(autocommit=False, autoflush=False, bind=read_engines[0])
+                _read_engines = read_engines
+    return _read_engines
+
+def _new_read_session() -> Session:
+    get_read_engines()
+    return _read_sessions() if _read_sessions is not None else _new_session()
 
 def create_tables():
-    """Create all database tables"""
-    Base.metadata.create_all(bind=engine)
+    """Create all database tables and migrate existing ones"""
+    global _schema_verified
+    with _init_lock:
+        for engine in get_shard_engines():
+            Base.metadata.create_all(bind=engine)
+            run_migrations(engine)
+        _schema_verified = True
+
+def ensure_database() -> Engine:
+    """
+    Make sure the schema is current, once per process
 
-def get_db() -> Generator[Session, None, None]:
+    The database records a fingerprint of the schema it was last migrated
+    to, so an up-to-date database costs a single query here instead of
+    create_all() and the migration checks.
+    """
+    global _schema_verified
+    if not _schema_verified:
+        with _init_lock:
+            if not _schema_verified:
+                if all(schema_is_current(engine) for engine in get_shard_engines()):
+                    _schema_verified = True
+                else:
+                    create_tables()
+    return get_engine()
+
+async def get_db() -> AsyncGenerator[Session, None]:
     """
     Database dependency for FastAPI
     """
-    db = SessionLocal()
+    ensure_database()
+    db = _new_session()
     try:
         yield db
     finally:
@@ -36,22 +139,56 @@ def get_db_session() -> Session:
     """
     Get a database session for non-FastAPI usage
     """
-    return SessionLocal()
+    ensure_database()
+    return _new_session()
+
+def SessionLocal() -> Session:
+    """
+    Get a database session, for callers of the former sessionmaker
+
+    Called like the sessionmaker it replaces, but the engine is created and
+    the schema verified first, and sessions reach every shard.
+    """
+    return get_db_session()
+
+async def get_read_db() -> AsyncGenerator[Session, None]:
+    """
+    Read-only database dependency for FastAPI GET routes
+
+    Reads take connections from their own pool and never a write lock, so
+    they do not hold up allocations. Writes through the session fail.
+    """
+    ensure_database()
+    db = _new_read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db_session() -> Session:
+    """
+    Get a read-only database session for non-FastAPI usage
+    """
+    ensure_database()
+    return _new_read_session()
 
 def init_database():
     """
     Initialize the database with tables and sample data
+    
+    Safe to call more than once; sample pools are only added to a database
+    without any pools.
     """
-    # Create tables
-    create_tables()
+    # Verify or create the schema
+    ensure_database()
     
     # Add sample data if database is empty
-    db = SessionLocal()
+    db = _new_session()
     try:
         from .models import IPPool, NetworkInterface
         
-        # Check if pools exist
-        pool_count = db.query(IPPool).count()
+        # Check if pools exist, in every shard
+        pool_count = count_rows(db.query(IPPool))
         if pool_count == 0:
             # Create sample pools
             sample_pools = [
@@ -93,10 +230,10 @@ def init_database():
     finally:
         db.close()
 
-# Initialize database on import
-if not os.path.exists("blackz_allocator.db"):
-    print("Creating new database...")
-    init_database()
-else:
-    # Ensure tables exist
-    create_tables() 
\ No newline at end of file
+def __getattr__(name: str):
+    # Module attributes kept for older callers, resolved lazily
+    if name == "engine":
+        return get_engine()
+    if name == "DATABASE_URL":
+        return get_settings().database_url
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
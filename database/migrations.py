@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String, Table, delete, inspect, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from .models import Base, PoolReservedRange, PoolDNSServer, address_to_int, network_bounds
+
+logger = logging.getLogger(__name__)
+
+# Fingerprint of the schema a database was last migrated to, one row
+schema_marker = Table(
+    "blackz_schema",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+    Column("migrated_at", DateTime, nullable=False)
+)
+
+# Columns added after the first release: (table, column, DDL type and default)
+ADDED_COLUMNS = [
+    ("ip_pools", "quarantine_seconds", "INTEGER DEFAULT 0"),
+    ("ip_pools", "start_int", "BIGINT"),
+    ("ip_pools", "end_int", "BIGINT"),
+    ("ip_allocations", "ip_int", "BIGINT"),
+    ("allocation_logs", "ip_int", "BIGINT"),
+    ("ip_pools", "reserved_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("ip_allocations", "released_at", "DATETIME"),
+]
+
+# JSON text columns of ip_pools whose contents moved to their own tables.
+# The columns are left in place, emptied, in databases that have them.
+MOVED_JSON_COLUMNS = ("reserved_ranges", "dns_servers")
+
+BACKFILL_BATCH_SIZE = 5000
+
+def _backfill_address_ints(conn: Connection, table: str):
+    """Fill ip_int from ip_address, in batches walking the primary key"""
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            f"SELECT id, ip_address FROM {table} "
+            f"WHERE ip_address IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        updates = [
+            {"id": row.id, "ip_int": value}
+            for row in rows
+            if (value := address_to_int(row.ip_address)) is not None
+        ]
+        if updates:
+            conn.execute(text(f"UPDATE {table} SET ip_int = :ip_int WHERE id = :id"), updates)
+
+def _backfill_pool_bounds(conn: Connection):
+    """Fill start_int and end_int from the CIDR"""
+    rows = conn.execute(text("SELECT id, cidr FROM ip_pools")).all()
+    updates = []
+    for row in rows:
+        try:
+            start_int, end_int = network_bounds(row.cidr)
+        except ValueError:
+            continue
+        updates.append({"id": row.id, "start_int": start_int, "end_int": end_int})
+    if updates:
+        conn.execute(text("UPDATE ip_pools SET start_int = :start_int, end_int = :end_int WHERE id = :id"), updates)
+
+def _move_pool_json_columns(conn: Connection, columns: set):
+    """Copy reserved ranges and DNS servers out of the JSON columns of ip_pools"""
+    present = [column for column in MOVED_JSON_COLUMNS if column in columns]
+    if not present:
+        return
+    not_empty = " OR ".join(f"{column} IS NOT NULL" for column in present)
+    rows = conn.execute(text(f"SELECT id, {', '.join(present)} FROM ip_pools WHERE {not_empty}")).mappings().all()
+    ranges, servers = [], []
+    for row in rows:
+        try:
+            for range_def in json.loads(row.get("reserved_ranges") or "[]"):
+                if address_to_int(range_def["start"]) is None or address_to_int(range_def["end"]) is None:
+                    raise ValueError(f"invalid range {range_def}")
+                ranges.append({"pool_id": row["id"], "start_ip": range_def["start"], "end_ip": range_def["end"]})
+            for position, address in enumerate(json.loads(row.get("dns_servers") or "[]")):
+                servers.append({"pool_id": row["id"], "position": position, "address": address})
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Skipping unreadable reserved ranges or DNS servers of pool {row['id']}: {e}")
+    if ranges:
+        conn.execute(insert(PoolReservedRange), ranges)
+    if servers:
+        conn.execute(insert(PoolDNSServer), servers)
+    if rows:
+        conn.execute(text(
+            f"UPDATE ip_pools SET {', '.join(f'{column} = NULL' for column in present)}, "
+            f"reserved_version = reserved_version + 1 WHERE {not_empty}"
+        ))
+
+def _release_duplicate_allocations(conn: Connection):
+    """Release every active allocation of an address but the oldest, with its lease"""
+    duplicates = conn.execute(text(
+        "SELECT id FROM ip_allocations WHERE is_active = 1 AND ip_int IS NOT NULL AND id NOT IN ("
+        "SELECT MIN(id) FROM ip_allocations WHERE is_active = 1 AND ip_int IS NOT NULL GROUP BY pool_id, ip_int)"
+    )).scalars().all()
+    if not duplicates:
+        return
+    logger.warning(f"Releasing {len(duplicates)} duplicate active allocations: {duplicates[:20]}")
+    now = datetime.utcnow()
+    for start in range(0, len(duplicates), BACKFILL_BATCH_SIZE):
+        batch = [{"id": allocation_id, "now": now} for allocation_id in duplicates[start:start + BACKFILL_BATCH_SIZE]]
+        conn.execute(text("UPDATE ip_allocations SET is_active = 0, released_at = :now WHERE id = :id"), batch)
+        conn.execute(text("UPDATE ip_leases SET is_expired = 1 WHERE allocation_id = :id"), batch)
+
+def schema_fingerprint() -> str:
+    """Hash of the tables, columns and indexes the models declare"""
+    parts = []
+    for table in sorted(Base.metadata.tables.values(), key=lambda table: table.name):
+        parts.append(table.name)
+        parts.extend(f"{column.name}:{column.type}:{column.nullable}" for column in table.columns)
+        parts.extend(
+            f"{index.name}:{','.join(column.name for column in index.columns)}"
+            for index in sorted(table.indexes, key=lambda index: index.name)
+        )
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+SCHEMA_FINGERPRINT = schema_fingerprint()
+
+def schema_is_current(engine: Engine) -> bool:
+    """Whether the database was migrated to the schema of this version"""
+    try:
+        with engine.connect() as conn:
+            fingerprint = conn.execute(select(schema_marker.c.fingerprint)).scalar()
+    except SQLAlchemyError:
+        # No marker table yet: a new database, or one from before the marker
+        return False
+    return fingerprint == SCHEMA_FINGERPRINT
+
+def run_migrations(engine: Engine):
+    """
+    Bring an existing database up to the current schema
+
+    create_all() only creates missing tables, so columns and indexes added
+    to existing tables are applied here, and derived columns are backfilled
+    before their indexes are built. Every step is idempotent.
+    """
+    inspector = inspect(engine)
+    added = set()
+    pool_columns = (
+        {col["name"] for col in inspector.get_columns("ip_pools")} if inspector.has_table("ip_pools") else set()
+    )
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                added.add((table, column))
+
+        # Integer forms of addresses for rows written before the columns existed;
+        # newer rows get them from the column defaults
+        if ("ip_pools", "start_int") in added or ("ip_pools", "end_int") in added:
+            _backfill_pool_bounds(conn)
+        for table in ("ip_allocations", "allocation_logs"):
+            if (table, "ip_int") in added:
+                _backfill_address_ints(conn, table)
+
+        # Released before the column existed: last_seen is the closest thing
+        if ("ip_allocations", "released_at") in added:
+            conn.execute(text("UPDATE ip_allocations SET released_at = last_seen WHERE is_active = 0"))
+
+        # Reserved ranges and DNS servers now live in their own tables
+        _move_pool_json_columns(conn, pool_columns)
+
+        # Duplicate active allocations would fail the unique index on active addresses
+        if inspector.has_table("ip_allocations") and "ux_ip_allocations_pool_active_int" not in {
+            index["name"] for index in inspector.get_indexes("ip_allocations")
+        }:
+            _release_duplicate_allocations(conn)
+
+        # Indexes declared on the models but missing from older database files
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+
+        conn.execute(delete(schema_marker))
+        conn.execute(insert(schema_marker).values(
+            id=1, fingerprint=SCHEMA_FINGERPRINT, migrated_at=datetime.utcnow()
+        ))
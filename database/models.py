@@ -1,11 +1,40 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Float
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional, Tuple, Union
+import ipaddress
+import json
 
 Base = declarative_base()
 
+def address_to_int(value: Optional[str]) -> Optional[int]:
+    """Get the integer form of a dotted IPv4 address, or None if it is not one"""
+    try:
+        return int(ipaddress.IPv4Address(value)) if value else None
+    except ValueError:
+        return None
+
+def _address_int_default(source: str):
+    def default(context) -> Optional[int]:
+        # Filled from the dotted address of the same row, for ORM and Core inserts alike
+        return address_to_int(context.get_current_parameters().get(source))
+    return default
+
+def network_bounds(cidr: str) -> Tuple[int, int]:
+    """Get the network and broadcast address of a CIDR as integers"""
+    network = ipaddress.IPv4Network(cidr, strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+def _network_bound_default(last: bool):
+    def default(context) -> Optional[int]:
+        cidr = context.get_current_parameters().get("cidr")
+        try:
+            return network_bounds(cidr)[last] if cidr else None
+        except ValueError:
+            return None
+    return default
+
 class IPPool(Base):
     """IP Pool model for managing network ranges"""
     __tablename__ = "ip_pools"
@@ -13,17 +42,109 @@ class IPPool(Base):
     id: int = Column(Integer, primary_key=True, index=True)
     name: str = Column(String(255), unique=True, index=True, nullable=False)
     cidr: str = Column(String(18), nullable=False)  # e.g., "192.168.1.0/24"
+    start_int: int = Column(BigInteger, default=_network_bound_default(last=False))  # Network address as an integer
+    end_int: int = Column(BigInteger, default=_network_bound_default(last=True))  # Broadcast address as an integer
     description: str = Column(Text, nullable=True)
     gateway: str = Column(String(15), nullable=True)  # Reserved gateway IP
-    dns_servers: str = Column(Text, nullable=True)  # JSON array of DNS servers
-    reserved_ranges: str = Column(Text, nullable=True)  # JSON array of reserved ranges
+    reserved_version: int = Column(Integer, default=0, nullable=False)  # Bumped whenever the reserved ranges change
+    quarantine_seconds: int = Column(Integer, default=0)  # Cooldown before a released IP is reused
     created_at: datetime = Column(DateTime, default=datetime.utcnow)
     updated_at: datetime = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active: bool = Column(Boolean, default=True)
     
+    __table_args__ = (
+        # Pools overlapping or containing an address range
+        Index("ix_ip_pools_range", "start_int", "end_int"),
+    )
+    
     # Relationships
     allocations = relationship("IPAllocation", back_populates="pool", cascade="all, delete-orphan")
     leases = relationship("IPLease", back_populates="pool", cascade="all, delete-orphan")
+    reserved_range_rows = relationship(
+        "PoolReservedRange", back_populates="pool", cascade="all, delete-orphan",
+        order_by="(PoolReservedRange.start_int, PoolReservedRange.id)"
+    )
+    dns_server_rows = relationship(
+        "PoolDNSServer", back_populates="pool", cascade="all, delete-orphan",
+        order_by="PoolDNSServer.position"
+    )
+    
+    @property
+    def reserved_ranges(self) -> Optional[str]:
+        """Reserved ranges as a JSON array of {"start", "end"} objects, or None"""
+        if not self.reserved_range_rows:
+            return None
+        return json.dumps([{"start": row.start_ip, "end": row.end_ip} for row in self.reserved_range_rows])
+    
+    @reserved_ranges.setter
+    def reserved_ranges(self, value: Union[str, List[dict], None]):
+        """Replace the reserved ranges from a JSON string or a list of {"start", "end"} objects"""
+        ranges = json.loads(value) if isinstance(value, str) else (value or [])
+        rows = [PoolReservedRange(start_ip=range_def["start"], end_ip=range_def["end"]) for range_def in ranges]
+        rows.sort(key=lambda row: row.start_int)
+        self.reserved_range_rows = rows
+        # Cached pool indexes compare this instead of loading the ranges
+        self.reserved_version = (self.reserved_version or 0) + 1
+    
+    @property
+    def dns_servers(self) -> Optional[str]:
+        """DNS servers as a JSON array, or None"""
+        if not self.dns_server_rows:
+            return None
+        return json.dumps([row.address for row in self.dns_server_rows])
+    
+    @dns_servers.setter
+    def dns_servers(self, value: Union[str, List[str], None]):
+        """Replace the DNS servers from a JSON string or a list of addresses"""
+        servers = json.loads(value) if isinstance(value, str) else (value or [])
+        self.dns_server_rows = [PoolDNSServer(position=n, address=address) for n, address in enumerate(servers)]
+
+class PoolReservedRange(Base):
+    """Address range of a pool that is never allocated"""
+    __tablename__ = "pool_reserved_ranges"
+    
+    id: int = Column(Integer, primary_key=True)
+    pool_id: int = Column(Integer, ForeignKey("ip_pools.id"), nullable=False)
+    start_ip: str = Column(String(15), nullable=False)
+    end_ip: str = Column(String(15), nullable=False)
+    start_int: int = Column(BigInteger, nullable=False, default=_address_int_default("start_ip"))
+    end_int: int = Column(BigInteger, nullable=False, default=_address_int_default("end_ip"))
+    
+    __table_args__ = (
+        # Ranges of one pool in address order
+        Index("ix_pool_reserved_ranges_pool_start", "pool_id", "start_int", "end_int"),
+        # Ranges containing an address, across pools
+        Index("ix_pool_reserved_ranges_start_end", "start_int", "end_int"),
+    )
+    
+    pool = relationship("IPPool", back_populates="reserved_range_rows")
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Known before the flush, so the rows can be ordered and counted right away
+        if self.start_int is None:
+            self.start_int = address_to_int(self.start_ip)
+        if self.end_int is None:
+            self.end_int = address_to_int(self.end_ip)
+    
+    @property
+    def size(self) -> int:
+        return self.end_int - self.start_int + 1
+
+class PoolDNSServer(Base):
+    """DNS server handed out with a pool's addresses"""
+    __tablename__ = "pool_dns_servers"
+    
+    id: int = Column(Integer, primary_key=True)
+    pool_id: int = Column(Integer, ForeignKey("ip_pools.id"), nullable=False)
+    position: int = Column(Integer, nullable=False, default=0)
+    address: str = Column(String(15), nullable=False)
+    
+    __table_args__ = (
+        Index("ix_pool_dns_servers_pool_position", "pool_id", "position"),
+    )
+    
+    pool = relationship("IPPool", back_populates="dns_server_rows")
 
 class IPAllocation(Base):
     """IP Allocation model for tracking assigned IPs"""
@@ -32,6 +153,7 @@ class IPAllocation(Base):
     id: int = Column(Integer, primary_key=True, index=True)
     pool_id: int = Column(Integer, ForeignKey("ip_pools.id"), nullable=False)
     ip_address: str = Column(String(15), nullable=False, index=True)
+    ip_int: int = Column(BigInteger, default=_address_int_default("ip_address"))  # ip_address as an integer, for range queries
     client_id: str = Column(String(255), nullable=True)  # MAC address, hostname, etc.
     client_name: str = Column(String(255), nullable=True)
     allocation_type: str = Column(String(20), default="dynamic")  # dynamic, static, reserved
@@ -39,9 +161,29 @@ class IPAllocation(Base):
     assigned_at: datetime = Column(DateTime, default=datetime.utcnow)
     last_seen: datetime = Column(DateTime, default=datetime.utcnow)
     is_active: bool = Column(Boolean, default=True)
+    released_at: datetime = Column(DateTime, nullable=True)  # When is_active was cleared
     network_interface: str = Column(String(255), nullable=True)
     binding_status: str = Column(String(20), default="unbound")  # unbound, bound, failed
     
+    __table_args__ = (
+        # Active addresses of a pool: lookups by address and listings
+        Index("ix_ip_allocations_pool_active_ip", "pool_id", "is_active", "ip_address"),
+        # Address order within a pool: index builds and gap finding
+        Index("ix_ip_allocations_pool_active_int", "pool_id", "is_active", "ip_int"),
+        # Address ranges across pools
+        Index("ix_ip_allocations_ip_int", "ip_int"),
+        # One active allocation per address: catches writers a cached pool index did not see
+        Index(
+            "ux_ip_allocations_pool_active_int", "pool_id", "ip_int", unique=True,
+            sqlite_where=is_active == True, postgresql_where=is_active == True
+        ),
+        # Released allocations due for archiving
+        Index(
+            "ix_ip_allocations_released_at", "released_at",
+            sqlite_where=is_active == False, postgresql_where=is_active == False
+        ),
+    )
+    
     # Relationships
     pool = relationship("IPPool", back_populates="allocations")
     lease = relationship("IPLease", back_populates="allocation", uselist=False)
@@ -61,6 +203,16 @@ class IPLease(Base):
     is_expired: bool = Column(Boolean, default=False)
     auto_renew: bool = Column(Boolean, default=True)
     
+    __table_args__ = (
+        # Leases still to expire, ordered by end time, for the cleanup job
+        Index(
+            "ix_ip_leases_active_end", "lease_end",
+            sqlite_where=is_expired == False, postgresql_where=is_expired == False
+        ),
+        Index("ix_ip_leases_pool_expired", "pool_id", "is_expired"),
+        Index("ix_ip_leases_allocation_id", "allocation_id"),
+    )
+    
     # Relationships
     pool = relationship("IPPool", back_populates="leases")
     allocation = relationship("IPAllocation", back_populates="lease")
@@ -80,6 +232,55 @@ class IPLease(Base):
         """Get remaining lease time"""
         return max(timedelta(0), self.lease_end - datetime.utcnow())
 
+class IPAllocationHistory(Base):
+    """Released allocation moved out of ip_allocations by the archiver"""
+    __tablename__ = "ip_allocations_history"
+    
+    id: int = Column(Integer, primary_key=True)
+    allocation_id: int = Column(Integer, nullable=False)  # ID it had in ip_allocations
+    pool_id: int = Column(Integer, nullable=False)  # No foreign key, history outlives deleted pools
+    ip_address: str = Column(String(15), nullable=False)
+    ip_int: int = Column(BigInteger, nullable=True)
+    client_id: str = Column(String(255), nullable=True)
+    client_name: str = Column(String(255), nullable=True)
+    allocation_type: str = Column(String(20), nullable=True)
+    allocation_strategy: str = Column(String(20), nullable=True)
+    assigned_at: datetime = Column(DateTime, nullable=True)
+    last_seen: datetime = Column(DateTime, nullable=True)
+    released_at: datetime = Column(DateTime, nullable=True)
+    network_interface: str = Column(String(255), nullable=True)
+    binding_status: str = Column(String(20), nullable=True)
+    archived_at: datetime = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # A pool's history newest first: SQLite indexes end in the rowid, so this serves ORDER BY id
+        Index("ix_ip_allocations_history_pool_id", "pool_id"),
+        Index("ix_ip_allocations_history_ip_int", "ip_int"),
+        Index("ix_ip_allocations_history_client_id", "client_id"),
+        Index("ix_ip_allocations_history_allocation_id", "allocation_id"),
+    )
+
+class IPLeaseHistory(Base):
+    """Lease of an archived allocation"""
+    __tablename__ = "ip_leases_history"
+    
+    id: int = Column(Integer, primary_key=True)
+    lease_id: int = Column(Integer, nullable=False)  # ID it had in ip_leases
+    pool_id: int = Column(Integer, nullable=False)
+    allocation_id: int = Column(Integer, nullable=False)  # ID the allocation had in ip_allocations
+    lease_start: datetime = Column(DateTime, nullable=True)
+    lease_duration: int = Column(Integer, nullable=True)
+    lease_end: datetime = Column(DateTime, nullable=True)
+    renewal_count: int = Column(Integer, nullable=True)
+    max_renewals: int = Column(Integer, nullable=True)
+    auto_renew: bool = Column(Boolean, nullable=True)
+    archived_at: datetime = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_ip_leases_history_pool_id", "pool_id"),
+        Index("ix_ip_leases_history_allocation_id", "allocation_id"),
+    )
+
 class NetworkInterface(Base):
     """Network Interface model for binding management"""
     __tablename__ = "network_interfaces"
@@ -103,6 +304,7 @@ class AllocationLog(Base):
     id: int = Column(Integer, primary_key=True, index=True)
     pool_id: int = Column(Integer, ForeignKey("ip_pools.id"), nullable=True)
     ip_address: str = Column(String(15), nullable=True)
+    ip_int: int = Column(BigInteger, default=_address_int_default("ip_address"))  # ip_address as an integer, for range queries
     action: str = Column(String(50), nullable=False)  # allocate, deallocate, bind, unbind, etc.
     client_id: str = Column(String(255), nullable=True)
     details: str = Column(Text, nullable=True)  # JSON details
@@ -110,4 +312,17 @@ class AllocationLog(Base):
     error_message: str = Column(Text, nullable=True)
     timestamp: datetime = Column(DateTime, default=datetime.utcnow)
     user_agent: str = Column(String(255), nullable=True)
-    source_ip: str = Column(String(15), nullable=True) 
\ No newline at end of file
+    source_ip: str = Column(String(15), nullable=True)
+    
+    __table_args__ = (
+        # Recent history of a pool: quarantine rebuilds and forecast seeding
+        Index("ix_allocation_logs_pool_timestamp", "pool_id", "timestamp"),
+        Index("ix_allocation_logs_ip_int", "ip_int"),
+    )
+
+class ShardIdBlock(Base):
+    """Next unreserved ID of a table in one shard, see database.sharding"""
+    __tablename__ = "shard_id_blocks"
+    
+    table_name: str = Column(String(64), primary_key=True)
+    next_id: int = Column(BigInteger, nullable=False)
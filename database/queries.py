@@ -0,0 +1,63 @@
+"""
+Statements of the hot paths, built once
+
+Each statement is constructed when the module is imported and takes its
+values as bound parameters, so a call only binds the values, and SQLAlchemy
+finds the compiled SQL in its cache without building a Query, its options
+and its cache key again:
+
+    pool = db.execute(POOL_BY_ID, {"pool_id": pool_id}).scalar()
+
+Statements that only need a few columns select those columns and return
+plain rows instead of ORM objects. Sharded sessions route on the bound
+pool, allocation and lease IDs like on literal ones.
+"""
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.orm import joinedload
+
+from .models import IPPool, PoolReservedRange, IPAllocation, IPLease
+
+# A pool by ID, as an ORM object
+POOL_BY_ID = select(IPPool).where(IPPool.id == bindparam("pool_id"))
+
+# The columns of a pool needed to answer from SQL alone
+POOL_RANGE_BY_ID = select(IPPool.id, IPPool.name, IPPool.cidr).where(IPPool.id == bindparam("pool_id"))
+
+# Addresses covered by a pool's reserved ranges
+RESERVED_ADDRESS_COUNT = select(
+    func.coalesce(func.sum(PoolReservedRange.end_int - PoolReservedRange.start_int + 1), 0)
+).where(PoolReservedRange.pool_id == bindparam("pool_id"))
+
+# Active allocations of a pool
+ACTIVE_ALLOCATION_COUNT = select(func.count(IPAllocation.id)).where(
+    IPAllocation.pool_id == bindparam("pool_id"),
+    IPAllocation.is_active == True
+)
+
+# An allocation by ID, with its lease
+ALLOCATION_WITH_LEASE = select(IPAllocation).options(
+    joinedload(IPAllocation.lease)
+).where(IPAllocation.id == bindparam("allocation_id"))
+
+# A lease by ID, with its allocation
+LEASE_WITH_ALLOCATION = select(IPLease).options(
+    joinedload(IPLease.allocation)
+).where(IPLease.id == bindparam("lease_id"))
+
+# The active allocation of an address in a pool, as an ORM object
+ACTIVE_ALLOCATION_BY_ADDRESS = select(IPAllocation).where(
+    IPAllocation.pool_id == bindparam("pool_id"),
+    IPAllocation.is_active == True,
+    IPAllocation.ip_address == bindparam("ip_address")
+)
+
+# The allocation and lease IDs of the active allocation of an address in a pool
+ACTIVE_ALLOCATION_IDS_BY_ADDRESS = select(
+    IPAllocation.id.label("allocation_id"),
+    IPLease.id.label("lease_id")
+).outerjoin(IPLease, IPLease.allocation_id == IPAllocation.id).where(
+    IPAllocation.pool_id == bindparam("pool_id"),
+    IPAllocation.is_active == True,
+    IPAllocation.ip_address == bindparam("ip_address")
+)
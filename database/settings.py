@@ -0,0 +1,262 @@
+"""
+Application settings
+
+Settings come from, in increasing order of precedence:
+
+    1. the defaults below
+    2. a JSON or INI config file named by BLACKZ_CONFIG
+    3. environment variables, BLACKZ_ followed by the setting name in upper
+       case, e.g. BLACKZ_DATABASE_URL or BLACKZ_POOL_SIZE
+
+SQLite PRAGMA overrides are given as BLACKZ_SQLITE_<PRAGMA> in the
+environment, a "sqlite_pragmas" object in JSON or a [sqlite] section in INI.
+In INI files all other settings go in a [blackz] section.
+
+Everything is validated when the settings are loaded, so a bad value stops
+the API server, GUI or CLI at startup instead of at the first query.
+"""
+
+import configparser
+import json
+import os
+from typing import Dict, List, Mapping, Optional, Union
+
+from pydantic import BaseModel, Field, ValidationError, validator
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import ArgumentError
+from sqlalchemy.pool import StaticPool
+
+from .sqlite_profile import SQLITE_PROFILES, sqlite_pragmas
+
+ENV_PREFIX = "BLACKZ_"
+CONFIG_ENV = "BLACKZ_CONFIG"
+STORAGE_ENGINES = ("database", "journal")
+
+class SettingsError(ValueError):
+    """Raised when the configuration cannot be read or is invalid"""
+
+class Settings(BaseModel):
+    # Database
+    database_url: str = Field("sqlite:///./blackz_allocator.db", description="SQLAlchemy database URL")
+    database_echo: bool = Field(False, description="Log every SQL statement")
+    pool_size: Optional[int] = Field(None, ge=1, description="Connections kept open (SQLAlchemy default if unset)")
+    max_overflow: Optional[int] = Field(None, ge=0, description="Extra connections allowed beyond pool_size")
+    pool_timeout: Optional[float] = Field(None, gt=0, description="Seconds to wait for a free connection")
+    pool_recycle: int = Field(-1, ge=-1, description="Reconnect after this many seconds, -1 to never")
+    pool_pre_ping: bool = Field(False, description="Test connections before handing them out")
+    sqlite_profile: str = Field("tuned", description="SQLite PRAGMA profile")
+    sqlite_pragmas: Dict[str, Union[int, str]] = Field(default_factory=dict, description="SQLite PRAGMA overrides")
+    shards: int = Field(1, ge=1, le=64, description="SQLite files pools are spread over")
+
+    # Sessions for GET routes: a replica, or else the database opened read-only
+    read_database_url: Optional[str] = Field(None, description="SQLAlchemy URL read-only sessions connect to, e.g. a replica")
+    read_pool_size: Optional[int] = Field(None, ge=1, description="Connections kept open for reads (pool_size if unset)")
+
+    # API server and clients
+    api_host: str = Field("127.0.0.1", description="Address the API server listens on")
+    api_port: int = Field(8000, ge=1, le=65535, description="Port the API server listens on")
+    api_url: Optional[str] = Field(None, description="API URL used by the GUI and CLI")
+
+    # Pool index snapshot loaded at startup and written at shutdown
+    snapshot_path: Optional[str] = Field(None, description="Pool index snapshot file")
+
+    # Allocations from concurrent requests applied in shared transactions
+    group_commit: bool = Field(False, description="Apply API allocations in group commits")
+    group_commit_max_batch: int = Field(64, ge=1, description="Most allocations per group commit")
+    group_commit_window_ms: float = Field(2.0, ge=0, description="How long a group commit waits for more allocations")
+
+    # Where allocation state is kept: the database, or an event journal for edge nodes
+    storage_engine: str = Field("database", description="Storage engine, database or journal")
+    journal_path: str = Field("blackz_allocator.journal", description="Allocation journal file")
+    journal_fsync: bool = Field(True, description="Sync the journal before acknowledging a change")
+    journal_compact_every: int = Field(100000, ge=1, description="Journal records written between compactions")
+
+    # Released allocations and their leases move to the history tables after this long
+    archive_after_seconds: int = Field(7 * 86400, ge=0, description="Age of released allocations to archive")
+
+    @validator('database_url')
+    def validate_database_url(cls, v):
+        try:
+            make_url(v)
+        except ArgumentError as e:
+            raise ValueError(f'Invalid database URL: {e}')
+        return v
+
+    @validator('sqlite_profile')
+    def validate_sqlite_profile(cls, v):
+        if v not in SQLITE_PROFILES:
+            raise ValueError(f'SQLite profile must be one of: {", ".join(SQLITE_PROFILES)}')
+        return v
+
+    @validator('sqlite_pragmas')
+    def validate_sqlite_pragmas(cls, v, values):
+        # Normalizes values and rejects unknown PRAGMAs
+        sqlite_pragmas(values.get('sqlite_profile', 'tuned'), v)
+        return v
+
+    @validator('shards')
+    def validate_shards(cls, v, values):
+        if v > 1 and 'database_url' in values:
+            url = make_url(values['database_url'])
+            database = url.database or ""
+            if url.get_backend_name() != "sqlite" or not database or database == ":memory:" or database.startswith("file:"):
+                raise ValueError('Sharding needs a SQLite database file')
+        return v
+
+    @validator('read_database_url')
+    def validate_read_database_url(cls, v, values):
+        if not v:
+            return None
+        try:
+            url = make_url(v)
+        except ArgumentError as e:
+            raise ValueError(f'Invalid database URL: {e}')
+        if 'database_url' in values and url.get_backend_name() != make_url(values['database_url']).get_backend_name():
+            raise ValueError('The read database must use the same backend as database_url')
+        if values.get('shards', 1) > 1 and (not url.database or url.database == ":memory:"):
+            raise ValueError('Sharding needs a SQLite database file to read from')
+        return v
+
+    @validator('snapshot_path')
+    def validate_snapshot_path(cls, v, values):
+        if v and values.get('shards', 1) > 1:
+            # Snapshots record one allocation log position, and each shard has its own log
+            raise ValueError('Pool index snapshots are not supported with more than one shard')
+        return v
+
+    @validator('storage_engine')
+    def validate_storage_engine(cls, v):
+        if v not in STORAGE_ENGINES:
+            raise ValueError(f'Storage engine must be one of: {", ".join(STORAGE_ENGINES)}')
+        return v
+
+    @validator('api_url', always=True)
+    def default_api_url(cls, v, values):
+        if v:
+            return v.rstrip('/')
+        host = values.get('api_host', '127.0.0.1')
+        if host in ('0.0.0.0', '::'):
+            host = 'localhost'
+        return f"http://{host}:{values.get('api_port', 8000)}"
+
+    @property
+    def is_sqlite(self) -> bool:
+        return make_url(self.database_url).get_backend_name() == "sqlite"
+
+    @property
+    def sqlite_path(self) -> Optional[str]:
+        """Path of the SQLite database file, or None for other databases and in-memory SQLite"""
+        if not self.is_sqlite:
+            return None
+        database = make_url(self.database_url).database
+        if not database or database == ":memory:" or database.startswith("file::memory:"):
+            return None
+        return database
+
+    def shard_urls(self, database_url: Optional[str] = None) -> List[str]:
+        """
+        Get the database URL of every shard
+
+        The first shard is database_url itself, the others are files next to
+        it, e.g. blackz_allocator.shard1.db. Another URL, such as that of a
+        replica, is split the same way.
+        """
+        database_url = database_url or self.database_url
+        url = make_url(database_url)
+        root, ext = os.path.splitext(url.database or "")
+        return [database_url] + [
+            url.set(database=f"{root}.shard{number}{ext}").render_as_string(hide_password=False)
+            for number in range(1, self.shards)
+        ]
+
+    def pragmas(self) -> Dict[str, Union[int, str]]:
+        """Get the SQLite PRAGMAs to apply to each connection"""
+        return sqlite_pragmas(self.sqlite_profile, self.sqlite_pragmas)
+
+    def engine_kwargs(self, read_only: bool = False) -> Dict[str, object]:
+        """Get the keyword arguments for create_engine(), for the read-only engine with read_only"""
+        kwargs: Dict[str, object] = {
+            "echo": self.database_echo,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping
+        }
+        if self.is_sqlite:
+            kwargs["connect_args"] = {"check_same_thread": False}  # Needed for SQLite
+            if self.sqlite_path is None:
+                # One shared connection, or every session would see its own empty database
+                kwargs["poolclass"] = StaticPool
+                return kwargs
+        for name in ("pool_size", "max_overflow", "pool_timeout"):
+            value = getattr(self, name)
+            if name == "pool_size" and read_only and self.read_pool_size is not None:
+                value = self.read_pool_size
+            if value is not None:
+                kwargs[name] = value
+        return kwargs
+
+def _read_config_file(path: str) -> Dict[str, object]:
+    if not os.path.exists(path):
+        raise SettingsError(f"Config file {path} not found")
+    try:
+        if path.endswith(".json"):
+            with open(path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise SettingsError(f"Config file {path} must contain a JSON object")
+            return data
+        parser = configparser.ConfigParser()
+        parser.read(path)
+        data: Dict[str, object] = dict(parser["blackz"]) if parser.has_section("blackz") else {}
+        if parser.has_section("sqlite"):
+            data["sqlite_pragmas"] = dict(parser["sqlite"])
+        return data
+    except (OSError, json.JSONDecodeError, configparser.Error) as e:
+        raise SettingsError(f"Cannot read config file {path}: {e}")
+
+def _read_environment(environ: Mapping[str, str]) -> Dict[str, object]:
+    data: Dict[str, object] = {}
+    pragmas: Dict[str, str] = {}
+    for name in Settings.model_fields:
+        if name == "sqlite_pragmas":
+            continue
+        value = environ.get(f"{ENV_PREFIX}{name.upper()}")
+        if value is not None and value != "":
+            data[name] = value
+    for key, value in environ.items():
+        if key.startswith(f"{ENV_PREFIX}SQLITE_") and key != f"{ENV_PREFIX}SQLITE_PROFILE" and value:
+            pragmas[key[len(f"{ENV_PREFIX}SQLITE_"):].lower()] = value
+    if pragmas:
+        data["sqlite_pragmas"] = pragmas
+    return data
+
+def load_settings(config_path: Optional[str] = None, environ: Optional[Mapping[str, str]] = None) -> Settings:
+    """
+    Read and validate the settings and make them the current ones
+
+    Raises: SettingsError with every problem found
+    """
+    global _settings
+    environ = os.environ if environ is None else environ
+    config_path = config_path or environ.get(CONFIG_ENV)
+
+    data = _read_config_file(config_path) if config_path else {}
+    unknown = set(data) - set(Settings.model_fields)
+    if unknown:
+        raise SettingsError(f"Unknown settings in {config_path}: {', '.join(sorted(unknown))}")
+    from_env = _read_environment(environ)
+    if "sqlite_pragmas" in from_env:
+        from_env["sqlite_pragmas"] = {**data.get("sqlite_pragmas", {}), **from_env["sqlite_pragmas"]}
+    data.update(from_env)
+
+    try:
+        _settings = Settings(**data)
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+        raise SettingsError(f"Invalid settings: {problems}")
+    return _settings
+
+def get_settings() -> Settings:
+    """Get the current settings, loading them on first use"""
+    return _settings if _settings is not None else load_settings()
+
+_settings: Optional[Settings] = None
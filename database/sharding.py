@@ -0,0 +1,329 @@
+"""
+Pools spread over several SQLite files
+
+With the shards setting above 1, every pool lives in one of N SQLite files,
+chosen by pool_id % N, together with everything that belongs to it: reserved
+ranges, DNS servers, allocations, leases, logs and history. Writes to pools
+on different shards take different database locks instead of queueing for
+one.
+
+Sessions from get_db() and get_db_session() are then ShardedSessions, which
+IPAllocator and the API use as before:
+
+    - new rows go to the shard of their pool, and new pools to the shard of
+      their ID
+    - allocation and lease IDs are handed out from a range per shard,
+      starting at shard * SHARD_ID_SPAN, so a lookup by pool, allocation or
+      lease ID goes straight to one shard
+    - statements filtering on pool_id, or on a pool, allocation or lease ID,
+      given as literals or bound parameters, run on the shards those values
+      map to; all others run on every shard and their rows are concatenated
+      in shard order
+
+Concatenated rows are not sorted or limited across shards, so paged lists
+go through page() or seek() and counts through count_rows(). IDs of the other tables
+(logs, reserved ranges, DNS servers, history) are only unique per shard.
+
+IDs are handed out in blocks reserved in the shard_id_blocks table of each
+shard (of the first shard for pool IDs), seeded from the highest ID in use,
+so processes writing to the same shards at once, like the API server and
+the CLI, never hand out the same ID. Pools cannot move between shards:
+changing the number of shards needs a fresh set of files.
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import Table, and_, event, func, or_, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import ORMExecuteState, Query, Session, sessionmaker
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList, Grouping
+from sqlalchemy.sql.schema import Column
+
+from .models import IPPool, IPAllocation, IPLease, ShardIdBlock
+
+# Allocation and lease IDs of shard n start above n * SHARD_ID_SPAN
+SHARD_ID_SPAN = 1 << 40
+
+# IDs reserved at a time; a process exiting leaves the rest of its block unused
+ID_BLOCK_SIZE = 100
+
+_POOLS = IPPool.__table__.name
+_RANGED_TABLES = (IPAllocation.__table__.name, IPLease.__table__.name)
+
+def _conjuncts(clause) -> Iterable:
+    """Split a WHERE clause into the terms ANDed together at its top level"""
+    while isinstance(clause, Grouping):
+        clause = clause.element
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        for term in clause.clauses:
+            yield from _conjuncts(term)
+    elif clause is not None:
+        yield clause
+
+class ShardRouter:
+    """Maps rows and statements to shards and hands out IDs for new rows"""
+
+    def __init__(self, engines: List[Engine]):
+        self.engines = {str(number): engine for number, engine in enumerate(engines)}
+        self.shard_ids = list(self.engines)
+        self.lock = threading.Lock()
+        # (next ID, end of the reserved block) per table and shard
+        self.blocks: Dict[Tuple[str, Optional[str]], Tuple[int, int]] = {}
+
+    def shard_for_pool(self, pool_id: int) -> str:
+        return str(int(pool_id) % len(self.shard_ids))
+
+    def shard_for_id(self, row_id: int) -> str:
+        """Get the shard of an allocation or lease ID"""
+        return str(int(row_id) // SHARD_ID_SPAN)
+
+    def configure(self, factory: sessionmaker):
+        """Make a sessionmaker created with class_=ShardedSession route through this router"""
+        factory.configure(
+            shards=self.engines,
+            shard_chooser=self.shard_chooser,
+            identity_chooser=self.identity_chooser,
+            execute_chooser=self.execute_chooser,
+            info={"shard_router": self}
+        )
+        event.listen(factory, "before_flush", self._assign_ids)
+
+    # IDs
+
+    def _highest_id(self, table: Table, shard_id: Optional[str]) -> int:
+        """Get the highest ID used in a table, in all shards for pools or in one shard's range"""
+        column = table.c.id
+        if shard_id is None:
+            highest = 0
+            for engine in self.engines.values():
+                with engine.connect() as conn:
+                    highest = max(highest, conn.execute(select(func.max(column))).scalar() or 0)
+            return highest
+        base = int(shard_id) * SHARD_ID_SPAN
+        with self.engines[shard_id].connect() as conn:
+            return conn.execute(
+                select(func.max(column)).where(column > base, column <= base + SHARD_ID_SPAN)
+            ).scalar() or base
+
+    def _reserve_block(self, table: Table, shard_id: Optional[str]) -> Tuple[int, int]:
+        """
+        Reserve the next ID_BLOCK_SIZE IDs of a table in the database
+
+        Returns: (first ID, end of the block)
+        """
+        blocks = ShardIdBlock.__table__
+        engine = self.engines[shard_id if shard_id is not None else self.shard_ids[0]]
+        seed = self._highest_id(table, shard_id) + 1
+        with engine.begin() as conn:
+            # Seeded by the first reservation ever; when two processes race, one row wins
+            conn.execute(sqlite_insert(blocks).values(table_name=table.name, next_id=seed).on_conflict_do_nothing())
+            # The UPDATE takes the write lock, so the value read after it is ours alone
+            conn.execute(
+                blocks.update().where(blocks.c.table_name == table.name).values(next_id=blocks.c.next_id + ID_BLOCK_SIZE)
+            )
+            end = conn.execute(select(blocks.c.next_id).where(blocks.c.table_name == table.name)).scalar()
+        return end - ID_BLOCK_SIZE, end
+
+    def next_id(self, table: Table, pool_id: Optional[int] = None) -> int:
+        """Get an unused ID for a new pool, or for a new allocation or lease of a pool"""
+        shard_id = None if table.name == _POOLS else self.shard_for_pool(pool_id)
+        key = (table.name, shard_id)
+        with self.lock:
+            row_id, end = self.blocks.get(key, (0, 0))
+            if row_id >= end:
+                row_id, end = self._reserve_block(table, shard_id)
+            self.blocks[key] = (row_id + 1, end)
+        return row_id
+
+    def _assign_ids(self, session: Session, flush_context, instances):
+        # Pools first, so the rows added with them know their shard
+        for instance in session.new:
+            if isinstance(instance, IPPool) and instance.id is None:
+                instance.id = self.next_id(IPPool.__table__)
+        for instance in session.new:
+            if isinstance(instance, (IPAllocation, IPLease)) and instance.id is None:
+                instance.id = self.next_id(instance.__table__, self._pool_id_of(instance))
+
+    # Choosers for ShardedSession
+
+    @staticmethod
+    def _pool_id_of(instance) -> Optional[int]:
+        pool_id = getattr(instance, "pool_id", None)
+        if pool_id is None:
+            # Added through a relationship and not flushed yet
+            pool = instance.__dict__.get("pool")
+            pool_id = pool.id if pool is not None else None
+        return pool_id
+
+    def shard_chooser(self, mapper, instance, clause=None) -> str:
+        """Get the shard a new row is written to"""
+        if isinstance(instance, IPPool):
+            return self.shard_for_pool(instance.id)
+        if instance is not None:
+            pool_id = self._pool_id_of(instance)
+            if pool_id is not None:
+                return self.shard_for_pool(pool_id)
+        # Rows of no pool, such as network interfaces
+        return self.shard_ids[0]
+
+    def identity_chooser(self, mapper, primary_key, *, lazy_loaded_from, **kw) -> List[str]:
+        """Get the shards to look for a primary key in"""
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        table = mapper.local_table.name
+        if table == _POOLS:
+            return [self.shard_for_pool(primary_key[0])]
+        if table in _RANGED_TABLES:
+            shard_id = self.shard_for_id(primary_key[0])
+            return [shard_id] if shard_id in self.engines else []
+        return self.shard_ids
+
+    def _shards_for_term(self, term, params: Dict) -> Optional[Set[str]]:
+        """Get the shards a `column = value` or `column IN (...)` term confines a statement to"""
+        if not isinstance(term, BinaryExpression) or term.operator not in (operators.eq, operators.in_op):
+            return None
+        column, value = term.left, term.right
+        if not isinstance(column, Column) or not isinstance(value, BindParameter):
+            return None
+        # Prebuilt statements get their values at execution, see database.queries
+        values = params.get(value.key, value.effective_value)
+        if values is None:
+            return None
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        table = getattr(column.table, "name", None)
+        if column.name == "pool_id" or (table == _POOLS and column.name == "id"):
+            return {self.shard_for_pool(v) for v in values}
+        if column.name == "allocation_id" or (table in _RANGED_TABLES and column.name == "id"):
+            return {self.shard_for_id(v) for v in values}
+        return None
+
+    def _shards_for_criteria(self, statement, params: Dict) -> Optional[Set[str]]:
+        """Intersect what the filters of every SELECT, UPDATE and DELETE in a statement allow"""
+        shards = None
+        for element in visitors.iterate(statement):
+            if not hasattr(element, "whereclause") or element.whereclause is None:
+                continue
+            for term in _conjuncts(element.whereclause):
+                allowed = self._shards_for_term(term, params)
+                if allowed is not None:
+                    shards = allowed if shards is None else shards & allowed
+        return shards
+
+    def _shards_for_insert(self, context: ORMExecuteState) -> Optional[Set[str]]:
+        rows = context.parameters
+        if not rows:
+            return None
+        if isinstance(rows, dict):
+            rows = [rows]
+        table = context.statement.table.name
+        key = "id" if table == _POOLS else "pool_id"
+        if table == _POOLS and any(row.get("id") is None for row in rows):
+            raise ValueError("Pools inserted into sharded databases need IDs, see assign_ids()")
+        shards = {self.shard_for_pool(row[key]) if row.get(key) is not None else self.shard_ids[0] for row in rows}
+        if len(shards) > 1:
+            raise ValueError(f"Rows inserted into {table} in one statement belong to different shards, see group_rows()")
+        return shards
+
+    def execute_chooser(self, context: ORMExecuteState) -> List[str]:
+        """Get the shards a statement runs on"""
+        if context.is_select and context.lazy_loaded_from is not None:
+            return [context.lazy_loaded_from.identity_token]
+        shards = self._shards_for_insert(context) if context.is_insert else None
+        if shards is None:
+            params = context.parameters if isinstance(context.parameters, dict) else {}
+            shards = self._shards_for_criteria(context.statement, params)
+        if shards is None:
+            return self.shard_ids
+        shards = [shard_id for shard_id in self.shard_ids if shard_id in shards]
+        # Values outside every shard find nothing, wherever they are looked for
+        return shards or self.shard_ids[:1]
+
+def sharded_sessionmaker(engines: List[Engine], **kwargs) -> sessionmaker:
+    """Create a session factory spreading pools over the given engines, one per shard"""
+    factory = sessionmaker(class_=ShardedSession, **kwargs)
+    ShardRouter(engines).configure(factory)
+    return factory
+
+def get_router(db: Session) -> Optional[ShardRouter]:
+    """Get the router of a sharded session, or None"""
+    return db.info.get("shard_router")
+
+def shard_ids(db: Session) -> List[Optional[str]]:
+    """Get the shards of a session, [None] when it is not sharded"""
+    router = get_router(db)
+    return router.shard_ids if router else [None]
+
+def count_rows(query: Query) -> int:
+    """Count the rows a query returns, adding up the counts of all shards"""
+    counts = query.session.execute(select(func.count()).select_from(query.subquery())).scalars()
+    return sum(counts)
+
+def page(query: Query, skip: int, limit: int, key, descending: bool = False) -> List:
+    """
+    Get one page of a query's rows
+
+    An unsharded query is paged by the database. A sharded one is sorted by
+    key and limited to skip + limit rows on every shard, and the page is cut
+    from the merged rows.
+    """
+    if get_router(query.session) is None:
+        return query.offset(skip).limit(limit).all()
+    rows = query.order_by(key.desc() if descending else key).limit(skip + limit).all()
+    name = key.key
+
+    def sort_key(row):
+        value = getattr(row, name)
+        return (value is None, value)
+
+    rows.sort(key=sort_key, reverse=descending)
+    return rows[skip:skip + limit]
+
+def _after(keys: Sequence, values: Sequence):
+    """Build the condition for rows past the given key values, in key order"""
+    if len(keys) == 1:
+        return keys[0] > values[0]
+    # The first key alone bounds the index range, the rest break its ties
+    return and_(keys[0] >= values[0], or_(keys[0] > values[0], _after(keys[1:], values[1:])))
+
+def seek(query: Query, keys: Sequence, after: Optional[Sequence], limit: int) -> List:
+    """
+    Get the rows of a query that follow a position, in key order
+
+    Keyset pagination: after holds the key values of the last row of the
+    previous page, or None for the first page. A page starts where an index
+    on the keys is found at those values, so it costs the same however deep
+    it is, and rows added or removed on earlier pages do not shift it. The
+    last key must be unique. A sharded query is limited on every shard and
+    the page is cut from the merged rows.
+    """
+    if after is not None:
+        query = query.filter(_after(keys, after))
+    rows = query.order_by(*keys).limit(limit).all()
+    if get_router(query.session) is not None:
+        names = [key.key for key in keys]
+        rows.sort(key=lambda row: tuple(getattr(row, name) for name in names))
+        rows = rows[:limit]
+    return rows
+
+def assign_ids(db: Session, table: Table, rows: List[Dict]):
+    """Give rows of a bulk insert into a sharded database their IDs; other databases assign their own"""
+    router = get_router(db)
+    if router is None or table.name not in (_POOLS, *_RANGED_TABLES):
+        return
+    for row in rows:
+        row["id"] = router.next_id(table, row.get("pool_id"))
+
+def group_rows(db: Session, rows: List[Dict], key: str = "pool_id") -> List[List[Dict]]:
+    """Split the rows of a bulk insert into one list per shard, by the pool ID in key"""
+    router = get_router(db)
+    if router is None:
+        return [rows] if rows else []
+    groups: Dict[str, List[Dict]] = {}
+    for row in rows:
+        groups.setdefault(router.shard_for_pool(row[key]), []).append(row)
+    return list(groups.values())
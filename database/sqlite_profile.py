@@ -0,0 +1,93 @@
+"""
+SQLite connection profiles
+
+PRAGMAs are applied to every new DBAPI connection through the engine's
+connect event. The "tuned" profile is the default:
+
+    journal_mode=WAL      readers no longer block the writer and vice versa
+    synchronous=NORMAL    fsync at checkpoints only, safe in WAL mode
+    mmap_size             read pages through a memory map
+    cache_size            page cache per connection (negative means KiB)
+    temp_store=MEMORY     temporary tables and indexes in memory
+    busy_timeout          wait for a lock instead of failing at once
+
+The "default" profile applies no PRAGMAs. The profile and single overrides
+are configured through the settings (sqlite_profile and sqlite_pragmas).
+"""
+
+from typing import Dict, Optional, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQLITE_PROFILES: Dict[str, Dict[str, Union[str, int]]] = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000
+    }
+}
+
+# Accepted values per PRAGMA; None means any integer
+_ALLOWED = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+    "mmap_size": None,
+    "cache_size": None,
+    "busy_timeout": None
+}
+
+def validate_pragma(name: str, value) -> Union[str, int]:
+    """
+    Check a PRAGMA name and value
+
+    Returns: The normalized value
+    Raises: ValueError for unknown PRAGMAs or invalid values
+    """
+    if name not in _ALLOWED:
+        raise ValueError(f"Unsupported SQLite PRAGMA '{name}'")
+    allowed = _ALLOWED[name]
+    if allowed is None:
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"SQLite PRAGMA {name} must be an integer, got {value!r}")
+        if name in ("mmap_size", "busy_timeout") and value < 0:
+            raise ValueError(f"SQLite PRAGMA {name} must not be negative")
+        return value
+    value = str(value).upper()
+    if value not in allowed:
+        raise ValueError(f"SQLite PRAGMA {name} must be one of {', '.join(sorted(allowed))}, got {value!r}")
+    return value
+
+def sqlite_pragmas(profile: str = "tuned", overrides: Optional[Dict] = None) -> Dict[str, Union[str, int]]:
+    """
+    Get the PRAGMAs of a profile with overrides applied
+
+    Raises: ValueError for an unknown profile or invalid values
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile '{profile}', expected one of: {', '.join(SQLITE_PROFILES)}")
+    pragmas = dict(SQLITE_PROFILES[profile])
+    pragmas.update(overrides or {})
+    return {name: validate_pragma(name, value) for name, value in pragmas.items()}
+
+def apply_sqlite_profile(engine: Engine, pragmas: Dict[str, Union[str, int]]):
+    """Run the PRAGMAs on every new connection of a SQLite engine"""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # busy_timeout first so switching the journal mode can wait for a lock too
+            for name in sorted(pragmas, key=lambda name: name != "busy_timeout"):
+                cursor.execute(f"PRAGMA {name}={pragmas[name]}")
+        finally:
+            cursor.close()
@@ -10,7 +10,7 @@ import asyncio
 class BlackzAllocatorGUI:
     """Main GUI application for BlackzAllocator"""
     
-    def __init__(self):
+    def __init__(self, api_base: Optional[str] = None):
         self.root = tk.Tk()
         self.root.title("BlackzAllocator - Professional IP Pool Management")
         self.root.geometry("1400x900")
@@ -18,7 +18,10 @@ class BlackzAllocatorGUI:
         self.root.minsize(1200, 800)
         
         # API base URL
-        self.api_base = "http://localhost:8000"
+        if api_base is None:
+            from database.settings import get_settings
+            api_base = get_settings().api_url
+        self.api_base = api_base
         
         # Configure modern style
         self.setup_modern_styles()
@@ -339,7 +342,7 @@ class BlackzAllocatorGUI:
                 font=('Segoe UI', 10)).pack(side='left', padx=(0, 10))
         self.strategy_var = tk.StringVar(value="first_fit")
         strategy_combo = ttk.Combobox(row1, textvariable=self.strategy_var, 
-                                    values=["first_fit", "random", "sequential", "load_balanced"], 
+                                    values=["first_fit", "random", "sequential", "load_balanced", "hash"], 
                                     state='readonly', width=20, font=('Segoe UI', 10))
         strategy_combo.pack(side='left', padx=(0, 30))
         
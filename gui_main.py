@@ -17,11 +17,13 @@ from tkinter import messagebox
 # Add project root to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from database.settings import get_settings
+
 def check_api_server():
     """Check if API server is running"""
     import requests
     try:
-        response = requests.get("http://localhost:8000/health", timeout=2)
+        response = requests.get(f"{get_settings().api_url}/health", timeout=2)
         return response.status_code == 200
     except:
         return False
@@ -35,7 +37,7 @@ def start_api_server():
         
         def run_server():
             try:
-                uvicorn.run(app, host="127.0.0.1", port=8000, log_level="error")
+                uvicorn.run(app, host=get_settings().api_host, port=get_settings().api_port, log_level="error")
             except Exception as e:
                 print(f"Server startup error: {e}")
         
@@ -14,10 +14,12 @@ import time
 # Add project root to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from database.settings import get_settings
+
 def check_api_connection():
     """Check if API server is accessible"""
     try:
-        response = requests.get("http://localhost:8000/health", timeout=2)
+        response = requests.get(f"{get_settings().api_url}/health", timeout=2)
         return response.status_code == 200
     except:
         return False